@@ -1,17 +1,20 @@
+import threading
 from typing import Optional, Dict, TypedDict
-from langgraph.graph import StateGraph, END
 
-# Import our nodes.
-from app.nodes.classification import classify_input_node
-from app.nodes.bug_report import bug_report_extraction_node
-from app.nodes.feature_request import feature_request_extraction_node
-from app.nodes.general_inquiry import general_inquiry_extraction_node
+# Only the constant: langgraph.graph, the nodes and the OpenAI SDK they use take
+# seconds to import, so they are loaded in build_workflow.
+from langgraph.constants import END
+
+from app.config import config
 
 
 # Define the state used throughout the workflow.
 class GraphState(TypedDict):
     customer_id: Optional[str]
+    mode: Optional[str]
     message: Optional[str]
+    # The message as put in LLM prompts, see preprocess_node; `message` stays the original.
+    clean_message: Optional[str]
     product: Optional[str]
     classification: Optional[str]
     confidence_score: Optional[float]
@@ -20,14 +23,49 @@ class GraphState(TypedDict):
     response_data: Optional[Dict]
 
 
-# Initialize the workflow with our GraphState.
-workflow = StateGraph(GraphState)
+def create_initial_state(
+    customer_id: str, message: str, product: str, mode: Optional[str] = None
+) -> GraphState:
+    # Initialize the workflow state for a single customer message.
+    return {
+        "customer_id": customer_id,
+        "mode": mode,
+        "message": message,
+        "clean_message": None,
+        "product": product,
+        "classification": None,
+        "confidence_score": None,
+        "extraction_data": {},
+        "customer_response": None,
+        "response_data": {},
+    }
+
+
+# This function picks the graph mode: "two_step" (classify, then extract), "fused"
+# (classify and extract in one LLM call) or "speculative" (classify while extracting
+# the likely class). The request's mode overrides the deployment's.
+def decide_mode_node(state: GraphState) -> str:
+    mode = state.get("mode") or config.get("graph", {}).get("mode", "two_step")
+    if mode == "fused":
+        return "fused_extraction"
+    if mode == "speculative":
+        return "speculative_extraction"
+    return "classify_input"
+
+
+# The fused node only produces a response when it is confident enough,
+# otherwise we fall back to the two-step path.
+def decide_after_fused_node(state: GraphState) -> str:
+    if state.get("customer_response"):
+        return END
+    return "classify_input"
+
 
-# Add nodes to the workflow.
-workflow.add_node("classify_input", classify_input_node)
-workflow.add_node("bug_extraction", bug_report_extraction_node)
-workflow.add_node("feature_extraction", feature_request_extraction_node)
-workflow.add_node("inquiry_extraction", general_inquiry_extraction_node)
+# A wrong guess only returns the classification, so the right extraction node runs next.
+def decide_after_speculative_node(state: GraphState) -> str:
+    if state.get("customer_response"):
+        return END
+    return decide_extraction_node(state)
 
 
 # This function determines which extraction node to call based on classification.
@@ -44,28 +82,121 @@ def decide_extraction_node(state: GraphState) -> str:
         return "inquiry_extraction"
 
 
-# Conditional Edge to send the input to the appropriate node
-workflow.add_conditional_edges(
-    "classify_input",
-    decide_extraction_node,
-    {
-        "bug_extraction": "bug_extraction",
-        "feature_extraction": "feature_extraction",
-        "inquiry_extraction": "inquiry_extraction",
-    },
-)
+# Messages the local pre-classifier answered go straight to extraction,
+# the rest continue with the LLM path of the graph mode.
+def decide_after_pre_classify_node(state: GraphState) -> str:
+    if state.get("classification"):
+        return decide_extraction_node(state)
+    return decide_mode_node(state)
+
+
+def build_workflow():
+    """
+    Builds the (uncompiled) StateGraph, importing langgraph and the nodes on first call.
+    Use get_compiled_workflow to run it.
+    """
+    from langgraph.graph import StateGraph
+
+    from app.nodes.bug_report import bug_report_extraction_node
+    from app.nodes.classification import classify_input_node
+    from app.nodes.feature_request import feature_request_extraction_node
+    from app.nodes.fused import fused_extraction_node
+    from app.nodes.general_inquiry import general_inquiry_extraction_node
+    from app.nodes.pre_classification import pre_classify_node
+    from app.nodes.preprocessing import preprocess_node
+    from app.nodes.speculative import speculative_extraction_node
+    from app.utils.metrics import instrument_node
+    from app.utils.streaming import stream_llm_partials
+
+    # Initialize the workflow with our GraphState.
+    workflow = StateGraph(GraphState)
+
+    # Add nodes to the workflow, each timed per node, product and classification, and able
+    # to token-stream its LLM calls when the graph is streamed.
+    for name, node in (
+        ("preprocess", preprocess_node),
+        ("pre_classify", pre_classify_node),
+        ("classify_input", classify_input_node),
+        ("bug_extraction", bug_report_extraction_node),
+        ("feature_extraction", feature_request_extraction_node),
+        ("inquiry_extraction", general_inquiry_extraction_node),
+        ("fused_extraction", fused_extraction_node),
+        ("speculative_extraction", speculative_extraction_node),
+    ):
+        workflow.add_node(name, instrument_node(name, stream_llm_partials(name, node)))
+
+    workflow.add_conditional_edges(
+        "pre_classify",
+        decide_after_pre_classify_node,
+        {
+            "classify_input": "classify_input",
+            "fused_extraction": "fused_extraction",
+            "speculative_extraction": "speculative_extraction",
+            "bug_extraction": "bug_extraction",
+            "feature_extraction": "feature_extraction",
+            "inquiry_extraction": "inquiry_extraction",
+        },
+    )
+
+    # Conditional Edge to send the input to the appropriate node
+    workflow.add_conditional_edges(
+        "classify_input",
+        decide_extraction_node,
+        {
+            "bug_extraction": "bug_extraction",
+            "feature_extraction": "feature_extraction",
+            "inquiry_extraction": "inquiry_extraction",
+        },
+    )
+
+    workflow.add_conditional_edges(
+        "fused_extraction",
+        decide_after_fused_node,
+        {END: END, "classify_input": "classify_input"},
+    )
+
+    workflow.add_conditional_edges(
+        "speculative_extraction",
+        decide_after_speculative_node,
+        {
+            END: END,
+            "bug_extraction": "bug_extraction",
+            "feature_extraction": "feature_extraction",
+            "inquiry_extraction": "inquiry_extraction",
+        },
+    )
+
+    workflow.add_edge("preprocess", "pre_classify")
+
+    # All the nodes lead to END
+    workflow.add_edge("bug_extraction", END)
+    workflow.add_edge("feature_extraction", END)
+    workflow.add_edge("inquiry_extraction", END)
+
+    # Define entry point as the message preprocessing node
+    workflow.set_entry_point("preprocess")
+    return workflow
+
+
+_compiled_workflow = None
+_compile_lock = threading.Lock()
+
 
-# All the nodes lead to END
-workflow.add_edge("bug_extraction", END)
-workflow.add_edge("feature_extraction", END)
-workflow.add_edge("inquiry_extraction", END)
+def get_compiled_workflow():
+    """
+    The compiled workflow, built on first call and shared by every later one. The
+    server compiles it during warm-up (see app.main), off the event loop.
+    """
+    global _compiled_workflow
+    if _compiled_workflow is None:
+        with _compile_lock:
+            if _compiled_workflow is None:
+                _compiled_workflow = build_workflow().compile()
+    return _compiled_workflow
 
-# Define entry point as classification node
-workflow.set_entry_point("classify_input")
 
 if __name__ == "__main__":
-    # Compile the workflow first
-    compiled = workflow.compile()
+    compiled = get_compiled_workflow()
 
     # Print ASCII visualization
     print("📊 LangGraph ASCII Visualization:")
@@ -0,0 +1,73 @@
+"""
+Classifies a burst of concurrent, distinct customer messages against the local mock
+LLM server with and without micro-batching, and compares wall time, LLM requests and
+prompt tokens. With --provider-rps, the mock enforces a request rate limit, as the
+provider does at peak.
+
+    python -m app.benchmarks.classification_batching --messages 500 --provider-rps 100
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from app.benchmarks.load_test import MESSAGES
+from app.benchmarks.mock_llm import MockLLMServer
+from app.nodes import classification
+from app.nodes.classification import classify_batch, classify_input_node
+from app.utils.batching import MicroBatcher
+from app.utils.cache import response_cache
+from app.utils.LLM import close_llm_client
+
+
+async def run(messages: int, batcher) -> float:
+    classification.classification_batcher = batcher
+    states = []
+    for i in range(messages):
+        product, message = MESSAGES[i % len(MESSAGES)]
+        states.append(
+            {"customer_id": "bench", "message": f"{message} (#{i})", "product": product}
+        )
+    start = time.perf_counter()
+    await asyncio.gather(*(classify_input_node(state) for state in states))
+    elapsed = time.perf_counter() - start
+    await close_llm_client()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--provider-rps", type=float, default=None)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-wait", type=float, default=0.005)
+    args = parser.parse_args()
+
+    # Every message is distinct; the cache would only hide the difference.
+    response_cache.backend = None
+    with MockLLMServer(
+        latency=args.latency, requests_per_second=args.provider_rps
+    ) as server:
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "mock")
+        state = server.app.state
+        batchers = {
+            "unbatched": None,
+            "batched": MicroBatcher(
+                "classify_input", classify_batch, args.max_batch_size, args.max_wait
+            ),
+        }
+        for name, batcher in batchers.items():
+            state.requests = state.prompt_tokens = state.completion_tokens = 0
+            elapsed = asyncio.run(run(args.messages, batcher))
+            print(
+                f"{name:<10} {args.messages} messages in {elapsed:.2f}s, "
+                f"{state.requests} LLM requests, "
+                f"{state.prompt_tokens / args.messages:.0f} prompt tokens/message"
+            )
+
+
+if __name__ == "__main__":
+    main()
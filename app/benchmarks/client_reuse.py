@@ -0,0 +1,84 @@
+"""
+Compares building a fresh LLMClient per call (the old per-request behaviour)
+with the process-wide client created at startup, against the local mock LLM server.
+
+Reports startup cost (client construction and connection warm-up), wall time
+per request and peak traced memory (via tracemalloc).
+
+    python -m app.benchmarks.client_reuse --requests 100 --warm-up 8
+"""
+
+import argparse
+import asyncio
+import os
+import time
+import tracemalloc
+
+from app.benchmarks.mock_llm import MockLLMServer
+from app.nodes.classification import ClassificationModel
+from app.utils.LLM import LLMClient, init_llm_client, close_llm_client
+
+MESSAGES = [{"role": "user", "content": 'Customer message: "The app crashes on login"'}]
+
+
+async def call(llm_client: LLMClient):
+    await llm_client.parse(
+        model="mock", messages=MESSAGES, response_format=ClassificationModel
+    )
+
+
+async def per_request_client(requests: int):
+    for _ in range(requests):
+        llm_client = LLMClient()
+        await call(llm_client)
+        await llm_client.aclose()
+
+
+async def shared_client(requests: int, warm_up: int):
+    start = time.perf_counter()
+    llm_client = await init_llm_client(warm_up_connections=warm_up)
+    startup = time.perf_counter() - start
+    for _ in range(requests):
+        await call(llm_client)
+    await close_llm_client()
+    return startup
+
+
+def measure(coroutine):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = asyncio.run(coroutine)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--warm-up", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.01)
+    args = parser.parse_args()
+
+    with MockLLMServer(latency=args.latency) as server:
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "mock")
+        # Pay one-off import and schema costs before measuring.
+        asyncio.run(per_request_client(1))
+
+        _, elapsed, peak = measure(per_request_client(args.requests))
+        print(
+            f"per-request client: {elapsed / args.requests * 1000:.2f} ms/request, "
+            f"peak {peak / 1024:.0f} KiB"
+        )
+        startup, elapsed, peak = measure(shared_client(args.requests, args.warm_up))
+        print(
+            f"shared client:      {(elapsed - startup) / args.requests * 1000:.2f} ms/request, "
+            f"peak {peak / 1024:.0f} KiB, startup {startup * 1000:.1f} ms "
+            f"({args.warm_up} warm connections)"
+        )
+
+
+if __name__ == "__main__":
+    main()
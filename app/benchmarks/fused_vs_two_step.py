@@ -0,0 +1,75 @@
+"""
+Compares latency, LLM calls and token usage of the "two_step", "fused" and
+"speculative" graph modes by running the compiled workflow against the local mock
+LLM server.
+
+    python -m app.benchmarks.fused_vs_two_step --latency 0.2
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from app.agent import get_compiled_workflow
+from app.benchmarks.mock_llm import MockLLMServer
+from app.utils.cache import response_cache
+from app.utils.dedup import bug_report_index
+from app.utils.LLM import close_llm_client
+
+MESSAGES = [
+    "The app crashes every time I upload a photo",
+    "I would like a dark mode for the chat screen",
+    "How do I change the email address on my account?",
+    "Checkout fails with an error after entering my card",
+]
+
+
+async def run(mode: str, rounds: int) -> list[float]:
+    compiled_app = get_compiled_workflow()
+    latencies = []
+    for _ in range(rounds):
+        for message in MESSAGES:
+            state = {
+                "customer_id": "bench",
+                "mode": mode,
+                "message": message,
+                "product": "MobileApp",
+            }
+            start = time.perf_counter()
+            await compiled_app.ainvoke(state)
+            latencies.append(time.perf_counter() - start)
+    await close_llm_client()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    # Every mode must make its own calls, rather than reuse the outputs (or bug tickets)
+    # of the modes run before it.
+    response_cache.backend = None
+    bug_report_index.enabled = False
+    with MockLLMServer(latency=args.latency) as server:
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "mock")
+        state = server.app.state
+        for mode in ("two_step", "fused", "speculative"):
+            state.requests = state.prompt_tokens = state.completion_tokens = 0
+            latencies = asyncio.run(run(mode, args.rounds))
+            count = len(latencies)
+            print(
+                f"{mode:<11} mean {statistics.mean(latencies) * 1000:.0f} ms, "
+                f"p95 {statistics.quantiles(latencies, n=20)[-1] * 1000:.0f} ms, "
+                f"{state.requests / count:.2f} LLM calls/message, "
+                f"{state.prompt_tokens / count:.0f} prompt + "
+                f"{state.completion_tokens / count:.0f} completion tokens/message"
+            )
+
+
+if __name__ == "__main__":
+    main()
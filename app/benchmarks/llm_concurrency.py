@@ -0,0 +1,56 @@
+"""
+Measures how many customer messages a single event loop can classify
+concurrently against the local mock LLM server.
+
+The run with `max_concurrency=1` reproduces the old behaviour where every LLM
+call blocked the loop; the second run uses the configured concurrency limit.
+
+    python -m app.benchmarks.llm_concurrency --messages 200 --latency 0.1
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from app.benchmarks.mock_llm import MockLLMServer
+from app.config import config
+from app.nodes.classification import classify_input_node
+from app.utils import LLM
+
+
+async def run(messages: int, max_concurrency: int) -> float:
+    LLM._clients[asyncio.get_running_loop()] = LLM.LLMClient(
+        max_concurrency=max_concurrency
+    )
+    state = {
+        "customer_id": "bench",
+        "message": "The app crashes when I open my profile",
+        "product": "MobileApp",
+    }
+    start = time.perf_counter()
+    await asyncio.gather(*(classify_input_node(state) for _ in range(messages)))
+    elapsed = time.perf_counter() - start
+    await LLM.get_llm_client().aclose()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.1)
+    args = parser.parse_args()
+
+    with MockLLMServer(latency=args.latency) as server:
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "mock")
+        for limit in (1, config["llm"]["max_concurrency"]):
+            elapsed = asyncio.run(run(args.messages, limit))
+            print(
+                f"max_concurrency={limit:<4} {args.messages} messages in {elapsed:.2f}s "
+                f"({args.messages / elapsed:.1f} msg/s)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+Load-tests the FastAPI app end to end: the app is served by uvicorn on its own thread,
+backed by the local mock LLM server, and driven over HTTP at fixed request rates
+(open loop) and/or concurrency levels (closed loop).
+
+Reports throughput, p50/p95/p99 latency, errors, event-loop lag of the app's loop and
+traced memory per in-flight request for each level, and writes them as JSON so runs
+can be compared across commits (pass the previous run's file as --baseline).
+
+    python -m app.benchmarks.load_test --rps 20,50 --concurrency 16 --duration 10 \\
+        --latency 0.2 --latency-distribution lognormal --output load_test.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import httpx
+
+from app.benchmarks.mock_llm import (
+    LATENCY_DISTRIBUTIONS,
+    BackgroundServer,
+    MockLLMServer,
+)
+from app.config import DATA_ROOT_ENV
+
+MESSAGES = [
+    ("MobileApp", "The app crashes when I open my profile"),
+    ("MobileApp", "I would like a dark mode feature for the feed"),
+    ("MobileApp", "Where can I see my invoices?"),
+    ("WebApp", "Uploading a photo fails with an error"),
+    ("WebApp", "Could you add an option to export my data?"),
+    ("WebApp", "How does account verification work?"),
+]
+
+
+def percentile(values: list, percent: float) -> float:
+    """Nearest-rank percentile of `values` (0 if there are none)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = math.ceil(percent / 100 * len(ordered)) - 1
+    return ordered[max(0, min(index, len(ordered) - 1))]
+
+
+def distribution(values: list) -> dict:
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values, default=0.0),
+        "mean": sum(values) / len(values) if values else 0.0,
+    }
+
+
+# Numbers every message of the run, so the response cache does not answer them for free.
+_sequence = itertools.count()
+
+
+class LoadGenerator:
+    """Sends customer messages to the app and records each request's outcome."""
+
+    def __init__(self, base_url: str, timeout: float):
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=None),
+        )
+        self.latencies = []
+        self.statuses = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def request(self):
+        number = next(_sequence)
+        product, message = MESSAGES[number % len(MESSAGES)]
+        payload = {
+            "customer_id": f"load-{number}",
+            "message": f"{message} (#{number})",
+            "product": product,
+        }
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        start = time.perf_counter()
+        try:
+            response = await self.client.post("/process-customer-message", json=payload)
+            status = str(response.status_code)
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        finally:
+            self.in_flight -= 1
+        if status == "200":
+            self.latencies.append(time.perf_counter() - start)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    async def open_loop(self, rps: float, duration: float):
+        """Starts requests at a fixed rate, whether or not earlier ones have finished."""
+        start = time.perf_counter()
+        tasks = []
+        for i in range(int(rps * duration)):
+            delay = start + i / rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.request()))
+        await asyncio.gather(*tasks)
+
+    async def closed_loop(self, concurrency: int, duration: float):
+        """Keeps `concurrency` requests in flight, each user sending its next when done."""
+        end = time.perf_counter() + duration
+
+        async def user():
+            while time.perf_counter() < end:
+                await self.request()
+
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+
+
+async def probe_loop_lag(interval: float, lags: list, stop: asyncio.Event):
+    """Runs on the app's loop: how late a sleep of `interval` wakes up is the lag."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - start - interval))
+
+
+async def run_level(
+    base_url: str, mode: str, target: float, duration: float, timeout: float
+) -> dict:
+    generator = LoadGenerator(base_url, timeout)
+    start = time.perf_counter()
+    if mode == "rps":
+        await generator.open_loop(target, duration)
+    else:
+        await generator.closed_loop(int(target), duration)
+    elapsed = time.perf_counter() - start
+    await generator.client.aclose()
+    requests = sum(generator.statuses.values())
+    return {
+        "requests": requests,
+        "errors": requests - generator.statuses.get("200", 0),
+        "statuses": generator.statuses,
+        "elapsed_seconds": elapsed,
+        "throughput_rps": len(generator.latencies) / elapsed if elapsed else 0.0,
+        "latency_seconds": distribution(generator.latencies),
+        "peak_in_flight": generator.peak_in_flight,
+    }
+
+
+def measure_level(
+    server: BackgroundServer, mode: str, target: float, args: argparse.Namespace
+) -> dict:
+    lags = []
+    stop = asyncio.Event()
+    probe = asyncio.run_coroutine_threadsafe(
+        probe_loop_lag(args.lag_interval, lags, stop), server.loop
+    )
+    result = asyncio.run(
+        run_level(server.url, mode, target, args.duration, args.timeout)
+    )
+    server.loop.call_soon_threadsafe(stop.set)
+    probe.result(timeout=5)
+    result["loop_lag_seconds"] = distribution(lags)
+    if args.trace_memory:
+        result["memory_per_in_flight_kib"] = measure_memory(server, mode, target, args)
+    return {"mode": mode, "target": target, **result}
+
+
+def measure_memory(
+    server: BackgroundServer, mode: str, target: float, args: argparse.Namespace
+) -> float:
+    """
+    Repeats the level briefly with tracemalloc on, which slows everything down too much
+    to time the same run. The peak traced memory includes the load generator's share of
+    each request, as both run in this process.
+    """
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = asyncio.run(
+        run_level(server.url, mode, target, args.memory_duration, args.timeout)
+    )
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (peak - baseline) / max(1, result["peak_in_flight"]) / 1024
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_load_test(args: argparse.Namespace) -> dict:
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    # The app's tickets, ticket IDs and jobs go to a scratch directory, not data/.
+    data_root = tempfile.TemporaryDirectory()
+    os.environ[DATA_ROOT_ENV] = data_root.name
+    with data_root, MockLLMServer(
+        latency=args.latency,
+        latency_distribution=args.latency_distribution,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        seed=0,
+    ) as mock:
+        os.environ["OPENAI_BASE_URL"] = mock.base_url
+        # Imported here so the app is set up after the mock LLM server's URL is known.
+        from app.main import app
+        from app.utils.dedup import bug_report_index
+
+        # The messages only differ in their number, so they would all be attached to the
+        # first ticket of their kind.
+        bug_report_index.enabled = args.dedup
+
+        with BackgroundServer(app) as server:
+            # Pays one-off costs (client setup, prompt rendering) outside the levels.
+            asyncio.run(run_level(server.url, "concurrency", 4, 1, args.timeout))
+            levels = [("rps", rps) for rps in args.rps] + [
+                ("concurrency", users) for users in args.concurrency
+            ]
+            results = [
+                measure_level(server, mode, target, args) for mode, target in levels
+            ]
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "settings": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "baseline")
+        },
+        "levels": results,
+    }
+
+
+def print_report(report: dict, baseline: dict = None):
+    previous = {
+        (level["mode"], level["target"]): level
+        for level in (baseline or {}).get("levels", [])
+    }
+    for level in report["levels"]:
+        latency = level["latency_seconds"]
+        line = (
+            f"{level['mode']}={level['target']:<6g} {level['throughput_rps']:7.1f} req/s, "
+            f"p50 {latency['p50'] * 1000:6.0f} ms, p95 {latency['p95'] * 1000:6.0f} ms, "
+            f"p99 {latency['p99'] * 1000:6.0f} ms, {level['errors']} errors, "
+            f"loop lag p99 {level['loop_lag_seconds']['p99'] * 1000:.1f} ms"
+        )
+        if "memory_per_in_flight_kib" in level:
+            line += f", {level['memory_per_in_flight_kib']:.0f} KiB/in-flight request"
+        before = previous.get((level["mode"], level["target"]))
+        if before and before["latency_seconds"]["p95"]:
+            change = latency["p95"] / before["latency_seconds"]["p95"] - 1
+            line += f" (p95 {change:+.0%} vs {baseline['commit']})"
+        print(line)
+
+
+def number_list(value: str) -> list:
+    return [float(part) for part in value.split(",") if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rps", type=number_list, default=[20.0, 50.0])
+    parser.add_argument("--concurrency", type=number_list, default=[16.0])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument(
+        "--latency-distribution", choices=LATENCY_DISTRIBUTIONS, default="lognormal"
+    )
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--lag-interval", type=float, default=0.01)
+    parser.add_argument(
+        "--trace-memory",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="repeat each level with tracemalloc to report memory per in-flight request",
+    )
+    parser.add_argument(
+        "--dedup",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="attach repeated bug reports to existing tickets, as configured",
+    )
+    parser.add_argument("--memory-duration", type=float, default=3)
+    parser.add_argument("--output", default="load_test.json")
+    parser.add_argument("--baseline", help="a previous --output file to compare with")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report = run_load_test(args)
+    print_report(report, baseline)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
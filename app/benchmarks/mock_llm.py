@@ -0,0 +1,325 @@
+"""
+A local, OpenAI-compatible mock server used by the benchmarks.
+
+It answers `/v1/chat/completions` with a structured-output payload generated
+from the request's JSON schema, after sleeping for a configurable latency, so
+that the full client stack (connection pool, JSON parsing, pydantic validation)
+is exercised without any network access or API cost. Streaming requests get the
+same payload as server-sent chunks, `token_latency` seconds apart. Latencies can
+be drawn from a distribution (`latency_distribution`) with `latency` as its mean,
+to reproduce the long tail of a real provider.
+
+Provider faults can be injected: a server-side `requests_per_second` limit and a
+random `error_rate` answered with 429 + Retry-After, and a random `timeout_rate`
+of requests that hang for `hang_seconds`.
+"""
+
+import asyncio
+import collections
+import json
+import math
+import random
+import re
+import socket
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Keyword heuristics used to make the mock answer plausibly.
+CLASSIFICATION_KEYWORDS = {
+    "bug_report": re.compile(
+        r"\b(bug|error|crash|broken|fail|can't|cannot|doesn't work|exception)", re.I
+    ),
+    "feature_request": re.compile(
+        r"\b(feature|would like|wish|please add|could you add|suggest)", re.I
+    ),
+}
+
+
+def guess_classification(text: str) -> str:
+    for label, pattern in CLASSIFICATION_KEYWORDS.items():
+        if pattern.search(text):
+            return label
+    return "general_inquiry"
+
+
+def _resolve(schema: dict, root: dict) -> dict:
+    ref = schema.get("$ref")
+    if ref:
+        node = root
+        for part in ref.lstrip("#/").split("/"):
+            node = node[part]
+        return node
+    return schema
+
+
+def _matches_label(schema: dict, label: str, root: dict) -> bool:
+    schema = _resolve(schema, root)
+    classification = schema.get("properties", {}).get("classification", {})
+    return classification.get("const") == label or label in classification.get(
+        "enum", []
+    )
+
+
+def build_instance(schema: dict, root: dict, label: str, name: str = ""):
+    """Generate a value satisfying `schema`, steering towards `label`."""
+    schema = _resolve(schema, root)
+    options = schema.get("anyOf") or schema.get("oneOf")
+    if options:
+        chosen = next((o for o in options if _matches_label(o, label, root)), None)
+        return build_instance(chosen or options[0], root, label, name)
+    if "const" in schema:
+        return schema["const"]
+    if "enum" in schema:
+        return label if label in schema["enum"] else schema["enum"][0]
+    kind = schema.get("type")
+    if kind == "object":
+        return {
+            key: build_instance(value, root, label, key)
+            for key, value in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return [build_instance(schema.get("items", {}), root, label, name)]
+    if kind == "boolean":
+        return False
+    if kind == "integer":
+        return 0
+    if kind == "number":
+        return 0.95
+    if name == "classification":
+        return label
+    return "UNKNOWN_VALUE"
+
+
+# The numbered messages of a batched prompt, one per line.
+NUMBERED_MESSAGE = re.compile(r'^(\d+)\. Customer message: "(.*)"$', re.M)
+
+
+def build_batch_instance(schema: dict, numbered: list) -> dict:
+    """A `results` list with one item per numbered message, steered by its own text."""
+    item_schema = _resolve(schema["properties"]["results"]["items"], schema)
+    return {
+        "results": [
+            {
+                **build_instance(item_schema, schema, guess_classification(text)),
+                "id": int(number),
+            }
+            for number, text in numbered
+        ]
+    }
+
+
+def build_completion(body: dict) -> dict:
+    """Build an OpenAI chat completion response for a parsed request body."""
+    messages = body.get("messages", [])
+    user_text = " ".join(
+        m.get("content", "") for m in messages if isinstance(m.get("content"), str)
+    )
+    label = guess_classification(user_text.rsplit("Customer message:", 1)[-1])
+    response_format = body.get("response_format") or {}
+    schema = response_format.get("json_schema", {}).get("schema")
+    numbered = NUMBERED_MESSAGE.findall(user_text)
+    if schema and numbered and "results" in schema.get("properties", {}):
+        content = json.dumps(build_batch_instance(schema, numbered))
+    elif schema:
+        content = json.dumps(build_instance(schema, schema, label))
+    else:
+        content = "OK"
+    prompt_tokens = max(1, len(user_text) // 4)
+    completion_tokens = max(1, len(content) // 4)
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def stream_completion(completion: dict, include_usage: bool, chunk_chars: int = 8):
+    """Yields `completion` as OpenAI chat completion chunks of `chunk_chars` characters."""
+    content = completion["choices"][0]["message"]["content"]
+    base = {k: completion[k] for k in ("id", "created", "model")}
+    base["object"] = "chat.completion.chunk"
+    for start in range(0, len(content), chunk_chars):
+        delta = {"content": content[start : start + chunk_chars]}
+        if start == 0:
+            delta["role"] = "assistant"
+        yield {
+            **base,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+        }
+    yield {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+    if include_usage:
+        yield {**base, "choices": [], "usage": completion["usage"]}
+
+
+LATENCY_DISTRIBUTIONS = ("constant", "uniform", "exponential", "lognormal")
+
+
+def sample_latency(
+    rng: random.Random, mean: float, distribution: str, sigma: float = 1.0
+) -> float:
+    """Draws a latency with the given `mean` from `distribution`."""
+    if mean <= 0 or distribution == "constant":
+        return mean
+    if distribution == "uniform":
+        return rng.uniform(0, 2 * mean)
+    if distribution == "exponential":
+        return rng.expovariate(1 / mean)
+    if distribution == "lognormal":
+        # The median is below the mean; `sigma` sets how long the tail is.
+        return rng.lognormvariate(math.log(mean) - sigma**2 / 2, sigma)
+    raise ValueError(f"Unknown latency distribution: {distribution}")
+
+
+def rate_limited_response(retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={"error": {"message": "Rate limit reached", "type": "requests"}},
+        headers={
+            "retry-after-ms": str(int(retry_after * 1000)),
+            "retry-after": str(math.ceil(retry_after)),
+        },
+    )
+
+
+def create_mock_app(
+    latency: float = 0.05,
+    latency_distribution: str = "constant",
+    latency_sigma: float = 1.0,
+    token_latency: float = 0.0,
+    requests_per_second: float = None,
+    error_rate: float = 0.0,
+    timeout_rate: float = 0.0,
+    hang_seconds: float = 30.0,
+    seed: int = None,
+) -> FastAPI:
+    mock_app = FastAPI()
+    mock_app.state.requests = 0
+    mock_app.state.prompt_tokens = 0
+    mock_app.state.completion_tokens = 0
+    mock_app.state.rate_limited = 0
+    mock_app.state.timeouts = 0
+    rng = random.Random(seed)
+    # Arrival times of the accepted requests in the last second.
+    accepted = collections.deque()
+
+    def check_faults():
+        """Returns a 429 response if this request is rate limited, else None."""
+        now = time.monotonic()
+        while accepted and accepted[0] <= now - 1:
+            accepted.popleft()
+        if requests_per_second and len(accepted) >= requests_per_second:
+            mock_app.state.rate_limited += 1
+            return rate_limited_response(accepted[0] + 1 - now)
+        if rng.random() < error_rate:
+            mock_app.state.rate_limited += 1
+            return rate_limited_response(0.1)
+        accepted.append(now)
+        return None
+
+    @mock_app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model"}]}
+
+    @mock_app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        mock_app.state.requests += 1
+        rejected = check_faults()
+        if rejected is not None:
+            return rejected
+        if rng.random() < timeout_rate:
+            mock_app.state.timeouts += 1
+            await asyncio.sleep(hang_seconds)
+        await asyncio.sleep(
+            sample_latency(rng, latency, latency_distribution, latency_sigma)
+        )
+        completion = build_completion(body)
+        mock_app.state.prompt_tokens += completion["usage"]["prompt_tokens"]
+        mock_app.state.completion_tokens += completion["usage"]["completion_tokens"]
+        if not body.get("stream"):
+            # Generation takes as long as when streaming; the client only sees it at the end.
+            chunks = len(list(stream_completion(completion, include_usage=False)))
+            await asyncio.sleep(token_latency * chunks)
+            return completion
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        async def sse_chunks():
+            for chunk in stream_completion(completion, include_usage):
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(token_latency)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(sse_chunks(), media_type="text/event-stream")
+
+    return mock_app
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class BackgroundServer:
+    """Runs an ASGI app with uvicorn on its own event loop in a background thread."""
+
+    def __init__(self, app, port: int = None):
+        self.app = app
+        self.port = port or _free_port()
+        self.loop = None
+        self._server = uvicorn.Server(
+            uvicorn.Config(
+                self.app, host="127.0.0.1", port=self.port, log_level="warning"
+            )
+        )
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self._server.serve())
+        self.loop.close()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join()
+
+
+class MockLLMServer(BackgroundServer):
+    """Runs the mock app with uvicorn on a background thread."""
+
+    def __init__(self, latency: float = 0.05, port: int = None, **options):
+        # `options` are passed on to create_mock_app (latency distribution, token
+        # latency, fault injection).
+        super().__init__(create_mock_app(latency=latency, **options), port)
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.url}/v1"
@@ -0,0 +1,52 @@
+"""
+Microbenchmark of per-request prompt construction: rebuilding every node's prompt
+from the product config on each request (the old behaviour) versus looking up the
+prefix pre-rendered by the prompt registry and appending the customer message.
+
+    python -m app.benchmarks.prompt_render --iterations 100000
+"""
+
+import argparse
+import timeit
+
+from app.agent import build_workflow
+from app.config import config
+from app.utils.prompts import prompt_registry
+
+# Building the graph imports the nodes, which register their prompts.
+build_workflow()
+
+MESSAGE = "The app crashes every time I upload a photo from the gallery"
+PRODUCT = "MobileApp"
+
+
+def rebuild_every_request():
+    for system, render_prefix in prompt_registry._templates.values():
+        prefix = render_prefix(config["products"][PRODUCT])
+        [
+            {"role": "system", "content": system},
+            {"role": "user", "content": f'{prefix}Customer message: "{MESSAGE}"'},
+        ]
+
+
+def registry_lookup():
+    for node in prompt_registry._templates:
+        prompt_registry.get(node, PRODUCT).messages(MESSAGE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+
+    nodes = len(prompt_registry._templates)
+    for name, fn in (("rebuild", rebuild_every_request), ("registry", registry_lookup)):
+        elapsed = timeit.timeit(fn, number=args.iterations)
+        print(
+            f"{name:<9} {elapsed / args.iterations / nodes * 1e6:.2f} us per prompt "
+            f"({nodes} node prompts)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Shows how the LLM client behaves against a rate-limited, flaky provider: the local
+mock LLM server enforces a requests-per-second limit and injects random 429s and
+hanging requests, while many calls are fired at once with and without the client-side
+rate limiter.
+
+    python -m app.benchmarks.rate_limit --calls 300 --provider-rps 50
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from app.benchmarks.mock_llm import MockLLMServer
+from app.nodes.classification import ClassificationModel
+from app.utils.LLM import LLMClient
+
+MESSAGES = [{"role": "user", "content": 'Customer message: "The app crashes"'}]
+
+
+async def run(calls: int, rate_limits: dict, timeout: float) -> dict:
+    llm_client = LLMClient(max_retries=5, timeout=timeout, rate_limits=rate_limits)
+
+    async def call():
+        start = time.perf_counter()
+        try:
+            await llm_client.parse(
+                model="mock", messages=MESSAGES, response_format=ClassificationModel
+            )
+            return time.perf_counter() - start
+        except Exception:
+            return None
+
+    # The first call pays one-off client initialisation; keep it out of the run, or every
+    # call released meanwhile would reach the provider in one burst.
+    await call()
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(call() for _ in range(calls)))
+    elapsed = time.perf_counter() - start
+    await llm_client.aclose()
+    succeeded = sorted(latency for latency in latencies if latency is not None)
+    return {
+        "succeeded": succeeded,
+        "failed": calls - len(succeeded),
+        "elapsed": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--provider-rps", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--timeout-rate", type=float, default=0.01)
+    parser.add_argument("--timeout", type=float, default=2.0)
+    parser.add_argument("--latency", type=float, default=0.1)
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    # The client-side limit stays a little below the provider's. The mock enforces a
+    # sliding one-second window, so bursts must be small too.
+    client_limits = {
+        "mock": {
+            "requests_per_minute": args.provider_rps * 60 * 0.9,
+            "burst_seconds": 0.1,
+        }
+    }
+    for name, rate_limits in (("no limiter", {}), ("limiter", client_limits)):
+        with MockLLMServer(
+            latency=args.latency,
+            requests_per_second=args.provider_rps,
+            error_rate=args.error_rate,
+            timeout_rate=args.timeout_rate,
+            hang_seconds=args.timeout * 2,
+            seed=0,
+        ) as server:
+            os.environ["OPENAI_BASE_URL"] = server.base_url
+            result = asyncio.run(run(args.calls, rate_limits, args.timeout))
+            state = server.app.state
+        succeeded = result["succeeded"]
+        p95 = statistics.quantiles(succeeded, n=20)[-1] if len(succeeded) > 1 else 0
+        print(
+            f"{name:<10} {len(succeeded)} ok / {result['failed']} failed, "
+            f"{len(succeeded) / result['elapsed']:.1f} calls/s, "
+            f"p50 {statistics.median(succeeded) * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms, "
+            f"{state.requests} provider requests ({state.rate_limited} rate limited, "
+            f"{state.timeouts} timed out)"
+        )
+
+
+if __name__ == "__main__":
+    main()
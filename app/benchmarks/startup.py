@@ -0,0 +1,157 @@
+"""
+Measures how fast a new API replica becomes useful: the import time of app.main (and
+which heavy modules it loads), and, for a fresh uvicorn process backed by the local mock
+LLM server, the time until it accepts connections, answers its first customer message
+and reports ready. Every run starts a new interpreter, as a new pod would.
+
+    python -m app.benchmarks.startup --runs 5
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from app.benchmarks.mock_llm import MockLLMServer
+from app.config import DATA_ROOT_ENV
+
+# Modules the API should only load during its warm-up, not at import.
+DEFERRED_MODULES = ("langgraph.graph", "openai", "httpx", "app.nodes.classification")
+
+IMPORT_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {deferred!r} if m in sys.modules]}}))
+"""
+
+PROJECT_DIR = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import(module: str = "app.main") -> dict:
+    """Imports `module` in a fresh interpreter: {"seconds", "loaded" deferred modules}."""
+    snippet = IMPORT_SNIPPET.format(module=module, deferred=DEFERRED_MODULES)
+    with tempfile.TemporaryDirectory() as data_root:
+        env = {
+            **os.environ,
+            "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "mock"),
+            DATA_ROOT_ENV: data_root,
+        }
+        output = subprocess.run(
+            [sys.executable, "-c", snippet],
+            cwd=PROJECT_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_first_request(llm_base_url: str, timeout: float = 60) -> dict:
+    """
+    Starts the API with uvicorn in a new process and sends a customer message as soon as
+    it accepts connections. Returns the seconds from process start until it was
+    listening, answered that message and reported ready, and its own warm-up time.
+    The process keeps its data files in a temporary directory, like a fresh replica.
+    """
+    with tempfile.TemporaryDirectory() as data_root:
+        return _measure_first_request(llm_base_url, data_root, timeout)
+
+
+def _measure_first_request(llm_base_url: str, data_root: str, timeout: float) -> dict:
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": llm_base_url,
+        "OPENAI_API_KEY": "mock",
+        DATA_ROOT_ENV: data_root,
+    }
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)],
+        cwd=PROJECT_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(base_url=url, timeout=timeout) as client:
+            while True:
+                if time.perf_counter() - start > timeout:
+                    raise TimeoutError(f"The API did not start within {timeout}s")
+                if server.poll() is not None:
+                    raise RuntimeError(f"The API exited with code {server.returncode}")
+                try:
+                    client.get("/ready")
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.01)
+            listening = time.perf_counter() - start
+            response = client.post(
+                "/process-customer-message",
+                json={
+                    "customer_id": "startup",
+                    "message": "The app crashes when I open my profile",
+                    "product": "MobileApp",
+                },
+            )
+            response.raise_for_status()
+            first_response = time.perf_counter() - start
+            ready = client.get("/ready")
+            ready.raise_for_status()
+            ready_at = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        "listening": listening,
+        "first_response": first_response,
+        "ready": ready_at,
+        "warm_up": ready.json()["warm_up_seconds"],
+    }
+
+
+def summarize(name: str, samples: list[float]) -> str:
+    return (
+        f"{name:<16} median {statistics.median(samples):.3f}s, "
+        f"min {min(samples):.3f}s, max {max(samples):.3f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    print(summarize("import app.main", [run["seconds"] for run in imports]))
+    loaded = sorted({module for run in imports for module in run["loaded"]})
+    print(f"{'':<16} deferred modules loaded at import: {loaded or 'none'}")
+
+    with MockLLMServer(latency=args.latency) as llm:
+        runs = [measure_first_request(llm.base_url) for _ in range(args.runs)]
+    for stage in ("listening", "first_response", "ready", "warm_up"):
+        print(summarize(stage, [run[stage] for run in runs]))
+
+
+if __name__ == "__main__":
+    main()
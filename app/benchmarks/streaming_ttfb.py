@@ -0,0 +1,92 @@
+"""
+Compares the time until a client sees something of the response (the classification)
+when streaming the workflow against waiting for the full response, using the local
+mock LLM server with a per-token generation delay.
+
+    python -m app.benchmarks.streaming_ttfb --latency 0.3 --token-latency 0.01
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from app.agent import get_compiled_workflow
+from app.benchmarks.mock_llm import MockLLMServer
+from app.utils.LLM import close_llm_client
+
+MESSAGES = [
+    "The app crashes every time I upload a photo",
+    "I would like a dark mode for the chat screen",
+    "How do I change the email address on my account?",
+    "Checkout fails with an error after entering my card",
+]
+
+
+def states(run: str, rounds: int):
+    for round_number in range(rounds):
+        for message in MESSAGES:
+            # A distinct message per run and round, so the response cache never answers.
+            yield {
+                "customer_id": "bench",
+                "message": f"{message} ({run} #{round_number})",
+                "product": "MobileApp",
+            }
+
+
+async def run_blocking(rounds: int) -> list[float]:
+    compiled_app = get_compiled_workflow()
+    totals = []
+    for state in states("blocking", rounds):
+        start = time.perf_counter()
+        await compiled_app.ainvoke(state)
+        totals.append(time.perf_counter() - start)
+    await close_llm_client()
+    return totals
+
+
+async def run_streaming(rounds: int) -> tuple[list[float], list[float]]:
+    compiled_app = get_compiled_workflow()
+    first_events, totals = [], []
+    for state in states("streaming", rounds):
+        start = time.perf_counter()
+        first_event = None
+        async for mode, chunk in compiled_app.astream(
+            state,
+            config={"configurable": {"stream_partials": True}},
+            stream_mode=["updates", "custom"],
+        ):
+            classified = mode == "updates" and any(
+                (update or {}).get("classification") for update in chunk.values()
+            )
+            if first_event is None and classified:
+                first_event = time.perf_counter() - start
+        totals.append(time.perf_counter() - start)
+        first_events.append(first_event)
+    await close_llm_client()
+    return first_events, totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    args = parser.parse_args()
+
+    with MockLLMServer(
+        latency=args.latency, token_latency=args.token_latency
+    ) as server:
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "mock")
+        blocking = asyncio.run(run_blocking(args.rounds))
+        first_events, streaming = asyncio.run(run_streaming(args.rounds))
+
+    print(f"blocking   full response    {statistics.mean(blocking) * 1000:.0f} ms")
+    print(f"streaming  classification   {statistics.mean(first_events) * 1000:.0f} ms")
+    print(f"streaming  full response    {statistics.mean(streaming) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Query latency of the SQLite ticket store at scale: fills a temporary store with
+`--tickets` synthetic tickets spread over the last 30 days, then times the filtered,
+paginated queries served by GET /tickets, including fetching a later page by cursor.
+
+    python -m app.benchmarks.ticket_queries --tickets 1000000
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from app.utils.ticket_store import SQLiteTicketBackend
+
+PRODUCTS = ["MobileApp", "WebApp"]
+KINDS = ["bug_report", "feature_request", "general_inquiry"]
+TEAMS = ["Auth Team", "UI Team", "Payments Team", "Core Team", "Search Team"]
+COMPONENTS = ["Authentication Module", "UI", "Payments", "Sync", "Search"]
+
+
+def synthetic_records(count: int, now: float, rng: random.Random):
+    for n in range(count):
+        kind = rng.choice(KINDS)
+        components = rng.sample(range(len(COMPONENTS)), rng.randint(1, 2))
+        yield {
+            "id": f"T-{n}",
+            "kind": kind,
+            "product": rng.choice(PRODUCTS),
+            "status": rng.choice(["open", "open", "resolved"]),
+            "title": "Synthetic ticket",
+            "customer_id": f"c{n % 5000}",
+            "report_count": 1,
+            "created_at": now - rng.random() * 30 * 86400,
+            "assignments": (
+                [(COMPONENTS[i], TEAMS[i]) for i in components]
+                if kind != "general_inquiry"
+                else []
+            ),
+            "data": {"id": f"T-{n}"},
+        }
+
+
+def fill(backend: SQLiteTicketBackend, count: int, now: float, batch: int = 10000):
+    rng = random.Random(0)
+    records = []
+    for record in synthetic_records(count, now, rng):
+        records.append(record)
+        if len(records) == batch:
+            backend.write(records, {})
+            records = []
+    if records:
+        backend.write(records, {})
+
+
+def time_query(backend: SQLiteTicketBackend, repeats: int, **filters) -> tuple:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        page = backend.query(**filters)
+    return (time.perf_counter() - start) / repeats, page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tickets", type=int, default=1000000)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    now = time.time()
+    with tempfile.TemporaryDirectory() as directory:
+        backend = SQLiteTicketBackend(os.path.join(directory, "tickets.sqlite3"))
+        start = time.perf_counter()
+        fill(backend, args.tickets, now)
+        print(f"wrote {args.tickets} tickets in {time.perf_counter() - start:.1f} s")
+
+        queries = {
+            "newest": {},
+            "open bugs for a team, last hour": {
+                "kind": "bug_report",
+                "status": "open",
+                "team": "Auth Team",
+                "since": now - 3600,
+            },
+            "open bugs for a team": {
+                "kind": "bug_report",
+                "status": "open",
+                "team": "Auth Team",
+            },
+            "component, last day": {"component": "Payments", "since": now - 86400},
+            "product feature requests": {
+                "product": "WebApp",
+                "kind": "feature_request",
+            },
+        }
+        for name, filters in queries.items():
+            elapsed, page = time_query(
+                backend, args.repeats, limit=args.limit, **filters
+            )
+            line = f"{name:<32} {elapsed * 1000:7.2f} ms"
+            pages = 1
+            # Follows the cursor 20 pages further down, then times that page.
+            while pages <= 20 and len(page) == args.limit:
+                last = page[-1]
+                cursor = (last["created_at"], last["id"])
+                page = backend.query(limit=args.limit, after=cursor, **filters)
+                pages += 1
+            if pages > 1:
+                elapsed, _ = time_query(
+                    backend, args.repeats, limit=args.limit, after=cursor, **filters
+                )
+                line += f", page {pages}: {elapsed * 1000:7.2f} ms"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
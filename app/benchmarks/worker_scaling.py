@@ -0,0 +1,176 @@
+"""
+Measures how the API's throughput scales with its number of worker processes: for each
+worker count, starts `python -m app.server --workers N` backed by the local mock LLM
+server and keeps a fixed number of requests in flight from several load generator
+processes, so a single client process is not what limits the throughput.
+
+    python -m app.benchmarks.worker_scaling --workers 1,2,4 --concurrency 64 --duration 10
+
+Workers only add throughput while there are idle cores to run them on; the report
+starts with the number of cores of this machine.
+"""
+
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator
+
+import httpx
+
+from app.benchmarks import load_test
+from app.benchmarks.load_test import LoadGenerator, distribution, number_list
+from app.benchmarks.mock_llm import MockLLMServer
+from app.benchmarks.startup import PROJECT_DIR, _free_port
+from app.config import DATA_ROOT_ENV
+
+
+@contextmanager
+def running_server(
+    workers: int, llm_base_url: str, timeout: float = 60
+) -> Iterator[str]:
+    """
+    Runs the multi-worker server in a new process, with its data files in a temporary
+    directory, and yields its URL once it is ready.
+    """
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    data_root = tempfile.TemporaryDirectory()
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": llm_base_url,
+        "OPENAI_API_KEY": "mock",
+        DATA_ROOT_ENV: data_root.name,
+    }
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "app.server",
+            "--workers",
+            str(workers),
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=PROJECT_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        start = time.perf_counter()
+        with httpx.Client(base_url=url, timeout=timeout) as client:
+            while True:
+                if time.perf_counter() - start > timeout:
+                    raise TimeoutError(f"The server did not start within {timeout}s")
+                if server.poll() is not None:
+                    raise RuntimeError(
+                        f"The server exited with code {server.returncode}"
+                    )
+                try:
+                    if client.get("/ready").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.05)
+        yield url
+    finally:
+        server.terminate()
+        server.wait()
+        data_root.cleanup()
+
+
+def generate_load(
+    base_url: str, generator: int, concurrency: int, duration: float, timeout: float
+) -> dict:
+    """One load generator process: `concurrency` closed-loop users for `duration`."""
+    # Forked generators would otherwise all send the same numbered messages, which the
+    # response cache would then answer.
+    load_test._sequence = itertools.count(generator * 1_000_000)
+
+    async def run() -> LoadGenerator:
+        load = LoadGenerator(base_url, timeout)
+        await load.closed_loop(concurrency, duration)
+        await load.client.aclose()
+        return load
+
+    load = asyncio.run(run())
+    return {"latencies": load.latencies, "statuses": load.statuses}
+
+
+def measure_workers(
+    url: str, concurrency: int, generators: int, duration: float, timeout: float
+) -> dict:
+    # Each generator keeps its share of the in-flight requests.
+    shares = [
+        concurrency // generators + (i < concurrency % generators)
+        for i in range(generators)
+    ]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=generators, mp_context=multiprocessing.get_context("fork")
+    ) as pool:
+        results = list(
+            pool.map(
+                generate_load,
+                [url] * generators,
+                range(generators),
+                shares,
+                [duration] * generators,
+                [timeout] * generators,
+            )
+        )
+    elapsed = time.perf_counter() - start
+    latencies = [latency for result in results for latency in result["latencies"]]
+    requests = sum(sum(result["statuses"].values()) for result in results)
+    return {
+        "requests": requests,
+        "errors": requests - len(latencies),
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_seconds": distribution(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0].replace("\n", " ")
+    )
+    parser.add_argument("--workers", type=number_list, default=[1.0, 2.0, 4.0])
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--generators", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPU cores")
+    baseline = None
+    with MockLLMServer(latency=args.latency) as llm:
+        for workers in map(int, args.workers):
+            with running_server(workers, llm.base_url, args.timeout) as url:
+                # Pays one-off costs (client setup, prompt rendering) in every worker.
+                measure_workers(url, args.concurrency, args.generators, 1, args.timeout)
+                result = measure_workers(
+                    url, args.concurrency, args.generators, args.duration, args.timeout
+                )
+            baseline = baseline or result["throughput_rps"]
+            latency = result["latency_seconds"]
+            print(
+                f"workers={workers:<3} {result['throughput_rps']:7.1f} req/s "
+                f"({result['throughput_rps'] / baseline:.2f}x), "
+                f"p50 {latency['p50'] * 1000:6.0f} ms, "
+                f"p95 {latency['p95'] * 1000:6.0f} ms, {result['errors']} errors"
+            )
+
+
+if __name__ == "__main__":
+    main()
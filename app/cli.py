@@ -0,0 +1,190 @@
+"""
+Offline bulk processing of customer messages through the LangGraph workflow.
+
+Streams a JSONL or CSV file of (customer_id, product, message) rows through the
+compiled graph with bounded concurrency and appends one JSON line per row to the
+output file as soon as it completes. Finished row numbers are recorded in a
+checkpoint file, so re-running the same command after a crash or kill only
+processes the rows that are not done yet (rows that failed are retried).
+
+    python -m app.cli tickets.jsonl --output results.jsonl --concurrency 32
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import time
+from typing import Iterator, Union
+
+from app.agent import create_initial_state, get_compiled_workflow
+from app.utils.LLM import close_llm_client, get_llm_client
+from app.utils.pre_classifier import label_log
+from app.utils.ticket_store import ticket_store
+
+logger = logging.getLogger(__name__)
+
+
+def read_rows(path: str) -> Iterator[tuple[int, Union[dict, ValueError]]]:
+    """
+    Yields (row number, row) pairs one at a time from a JSONL or CSV file. A JSONL line
+    that is not a JSON object yields a ValueError in place of the row, so it is reported
+    as that row's error instead of stopping the run.
+    """
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            yield from enumerate(csv.DictReader(f))
+        else:
+            for row_number, line in enumerate(f):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield row_number, ValueError(f"Malformed JSON: {e}")
+                    continue
+                if not isinstance(row, dict):
+                    row = ValueError(
+                        f"Expected a JSON object, got {type(row).__name__}"
+                    )
+                yield row_number, row
+
+
+def load_checkpoint(path: str) -> set[int]:
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {int(line) for line in f if line.strip()}
+
+
+class BulkRunStats:
+    def __init__(self):
+        self.processed = 0
+        self.skipped = 0
+        self.errors = 0
+        self.started_at = time.perf_counter()
+
+    def summary(self, prompt_tokens: int, completion_tokens: int) -> str:
+        elapsed = time.perf_counter() - self.started_at
+        return (
+            f"Processed {self.processed} messages in {elapsed:.1f}s "
+            f"({self.processed / elapsed if elapsed else 0:.1f} messages/sec), "
+            f"{self.errors} errors, {self.skipped} skipped (already done). "
+            f"Tokens: {prompt_tokens} prompt, {completion_tokens} completion."
+        )
+
+
+async def process_file(
+    input_path: str,
+    output_path: str,
+    checkpoint_path: str,
+    concurrency: int,
+    mode: str = None,
+) -> BulkRunStats:
+    compiled_app = get_compiled_workflow()
+    done = load_checkpoint(checkpoint_path)
+    stats = BulkRunStats()
+    # Bounded, so at most a few rows per worker are held in memory at once.
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    with open(output_path, "a") as output, open(checkpoint_path, "a") as checkpoint:
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                row_number, row = item
+                record = {"row": row_number}
+                try:
+                    if isinstance(row, ValueError):
+                        raise row
+                    record["customer_id"] = row.get("customer_id")
+                    result = await compiled_app.ainvoke(
+                        create_initial_state(
+                            row["customer_id"],
+                            row["message"],
+                            row["product"],
+                            row.get("mode") or mode,
+                        )
+                    )
+                    ticket_store.record(result)
+                    record.update(
+                        {
+                            "message_type": result.get("classification", ""),
+                            "confidence_score": result.get("confidence_score", 0.0),
+                            "response_data": result.get("response_data", {}),
+                            "customer_response": result.get("customer_response", ""),
+                        }
+                    )
+                except Exception as e:
+                    logger.error(f"Row {row_number} failed: {str(e)}")
+                    record["error"] = str(e)
+                    stats.errors += 1
+                output.write(json.dumps(record) + "\n")
+                output.flush()
+                if "error" not in record:
+                    checkpoint.write(f"{row_number}\n")
+                    checkpoint.flush()
+                stats.processed += 1
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        try:
+            for row_number, row in read_rows(input_path):
+                if row_number in done:
+                    stats.skipped += 1
+                    continue
+                await queue.put((row_number, row))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            # Workers must not outlive the files they write to, e.g. when reading the
+            # input fails or the run is cancelled.
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+    return stats
+
+
+async def main_async(args) -> str:
+    try:
+        stats = await process_file(
+            args.input, args.output, args.checkpoint, args.concurrency, args.mode
+        )
+        llm_client = get_llm_client()
+        return stats.summary(llm_client.prompt_tokens, llm_client.completion_tokens)
+    finally:
+        await ticket_store.close()
+        await label_log.close()
+        await close_llm_client()
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[1].replace("\n", " ")
+    )
+    parser.add_argument(
+        "input", help="JSONL or CSV file with customer_id, product, message"
+    )
+    parser.add_argument(
+        "--output", required=True, help="JSONL file results are appended to"
+    )
+    parser.add_argument(
+        "--checkpoint", help="Checkpoint file (default: <output>.checkpoint)"
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mode", choices=["two_step", "fused", "speculative"])
+    args = parser.parse_args()
+    args.checkpoint = args.checkpoint or f"{args.output}.checkpoint"
+    print(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,181 @@
+import asyncio
+import itertools
 import json
+import logging
 import os
+import threading
+from collections.abc import Mapping
+from types import MappingProxyType
+from typing import Optional
 
+logger = logging.getLogger(__name__)
 
-def load_config():
+
+def get_config_path() -> str:
     # Get the path to this config.py file
     base_dir = os.path.dirname(os.path.abspath(__file__))
-    config_path = os.path.join(base_dir, "config.json")
+    return os.path.join(base_dir, "config.json")
+
 
-    with open(config_path, "r") as f:
+def load_config(config_path: str = None):
+    with open(config_path or get_config_path(), "r") as f:
         return json.load(f)
 
 
-config = load_config()
+# Overrides the directory relative config paths are resolved against, e.g. to keep the
+# data files of tests and benchmarks out of the project's data/ directory.
+DATA_ROOT_ENV = "AGENT_DATA_ROOT"
+
+
+def resolve_path(path: str) -> str:
+    # Relative paths in the config (e.g. data files) are relative to the project root
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(os.environ.get(DATA_ROOT_ENV) or project_dir, path)
+
+
+def validate_config(raw: dict):
+    """Raises ValueError if `raw` is missing keys the nodes rely on."""
+    for key in ("model", "products"):
+        if key not in raw:
+            raise ValueError(f"Config is missing '{key}'")
+    for product, product_config in raw["products"].items():
+        for key in ("description", "component_team_mapping", "general_inquiry"):
+            if key not in product_config:
+                raise ValueError(f"Product '{product}' is missing '{key}'")
+        if "resource_dict" not in product_config["general_inquiry"]:
+            raise ValueError(
+                f"Product '{product}' is missing 'general_inquiry.resource_dict'"
+            )
+
+
+class ProductIndex:
+    """Lookups for one product, precomputed from its config."""
+
+    def __init__(self, name: str, product_config: dict):
+        self.name = name
+        self.config = product_config
+        self.description = product_config["description"]
+        self.component_teams = dict(product_config["component_team_mapping"])
+        self._components_by_lower = {
+            component.lower(): component for component in self.component_teams
+        }
+        self.resource_dict = dict(product_config["general_inquiry"]["resource_dict"])
+
+    def resolve_component(self, name: str) -> Optional[str]:
+        """Returns the configured component name matching `name`, ignoring case."""
+        return self._components_by_lower.get(name.strip().lower())
+
+    def team_for(self, component: str, default: str = "TBD") -> str:
+        component = self.resolve_component(component)
+        return self.component_teams[component] if component else default
+
+    def resources_for(self, inquiry_category: str) -> list:
+        return self.resource_dict.get(inquiry_category, [])
+
+
+class ConfigSnapshot(Mapping):
+    """
+    An immutable view of one version of config.json. Top-level sections are exposed
+    read-only (snapshot["model"], snapshot["llm"], ...) and per-product indexes are built on
+    first use, so startup does not slow down with the number of products.
+    """
+
+    def __init__(self, raw: dict, version: int):
+        self._raw = raw
+        self.version = version
+        self.products = frozenset(raw["products"])
+        self._product_indexes = {}
+        self._lock = threading.Lock()
+        # Per-snapshot scratch space for data derived from this config (e.g. rendered
+        # prompts), discarded together with the snapshot on reload.
+        self.derived = {}
+
+    def __getitem__(self, key):
+        value = self._raw[key]
+        return MappingProxyType(value) if isinstance(value, dict) else value
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def has_product(self, product: str) -> bool:
+        return product in self.products
+
+    def product(self, product: str) -> ProductIndex:
+        index = self._product_indexes.get(product)
+        if index is None:
+            with self._lock:
+                index = self._product_indexes.get(product)
+                if index is None:
+                    index = ProductIndex(product, self._raw["products"][product])
+                    self._product_indexes[product] = index
+        return index
+
+
+class ConfigStore:
+    """
+    Holds the current ConfigSnapshot. `reload()` loads and validates config.json and swaps
+    in a new snapshot with a single assignment, so in-flight requests keep using the
+    snapshot they started with.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._versions = itertools.count(1)
+        self._mtime = self._stat()
+        raw = load_config(path)
+        validate_config(raw)
+        self._snapshot = ConfigSnapshot(raw, next(self._versions))
+
+    def snapshot(self) -> ConfigSnapshot:
+        return self._snapshot
+
+    def reload(self) -> ConfigSnapshot:
+        mtime = self._stat()
+        raw = load_config(self.path)
+        validate_config(raw)
+        snapshot = ConfigSnapshot(raw, next(self._versions))
+        self._snapshot, self._mtime = snapshot, mtime
+        logger.info(f"Loaded config version {snapshot.version}")
+        return snapshot
+
+    async def watch(self, poll_interval: float = 2.0):
+        """Reloads the config whenever the file changes. Invalid files are logged and skipped."""
+        while True:
+            await asyncio.sleep(poll_interval)
+            mtime = self._stat()
+            if mtime == self._mtime:
+                continue
+            try:
+                await asyncio.to_thread(self.reload)
+            except Exception as e:
+                self._mtime = mtime
+                logger.error(
+                    f"Config reload failed, keeping version {self._snapshot.version}: {e}"
+                )
+
+    def _stat(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+
+class LiveConfig(Mapping):
+    """Mapping that always reads from the current snapshot of the config store."""
+
+    def __init__(self, store: ConfigStore):
+        self._store = store
+
+    def __getitem__(self, key):
+        return self._store.snapshot()[key]
+
+    def __iter__(self):
+        return iter(self._store.snapshot())
+
+    def __len__(self):
+        return len(self._store.snapshot())
+
+
+config_store = ConfigStore(get_config_path())
+config = LiveConfig(config_store)
@@ -1,15 +1,149 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
-from app.agent import workflow, GraphState
-import uvicorn
+import asyncio
+import hmac
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Literal, Optional
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, HttpUrl
+from app.agent import create_initial_state, get_compiled_workflow
+from app.config import config, config_store
+from app.utils.cache import response_cache
+from app.utils.deadlines import deadline_scope
+from app.utils.jobs import create_job_worker_pool
+from app.utils.ticket_store import ticket_store
+from app.utils.singleflight import single_flight
+from app.utils.pre_classifier import fast_path_stats, label_log
+from app.utils.metrics import collect_timings, http_request_duration, metrics
+from app.utils.streaming import sse_event
+from app.utils.rate_limit import LLMOverloadedError
+from app.utils.shared_state import shared_state
 
-app = FastAPI()
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+def load_workflow():
+    """
+    Imports and compiles the workflow and the parts of the OpenAI SDK the first LLM call
+    would load: seconds of imports, so the warm-up runs this on a worker thread.
+    """
+    get_compiled_workflow()
+    from app.utils.LLM import preload_sdk
+
+    preload_sdk()
+
+
+async def warm_up(app: FastAPI):
+    """
+    Loads what the first request would otherwise wait for (see load_workflow), while the
+    event loop keeps answering, then creates the process-wide LLM client (and optionally
+    warms its connection pool). /ready reports 200 once it has finished.
+    """
+    start = time.perf_counter()
+    try:
+        await asyncio.to_thread(load_workflow)
+        # Already imported by load_workflow.
+        from app.utils.LLM import init_llm_client
+
+        app.state.llm_client = await init_llm_client()
+    except Exception as e:
+        logger.error(f"Warm-up failed: {str(e)}")
+        raise
+    app.state.warm_up_seconds = time.perf_counter() - start
+    logger.info(f"Warmed up in {app.state.warm_up_seconds:.2f}s")
+
+
+async def publish_metrics(interval: float):
+    """Shares this worker's metrics with the other workers every `interval` seconds."""
+    while True:
+        await asyncio.to_thread(shared_state.publish_metrics, metrics.snapshot())
+        await asyncio.sleep(interval)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Serve right away and warm up in the background; requests arriving meanwhile wait
+    # for it, and /ready keeps load balancers from sending them until it is done.
+    app.state.warm_up = asyncio.create_task(warm_up(app))
+    reload_config = config.get("config_reload", {})
+    watcher = None
+    if reload_config.get("watch", False):
+        watcher = asyncio.create_task(
+            config_store.watch(reload_config.get("poll_interval_seconds", 2))
+        )
+    app.state.jobs = create_job_worker_pool(
+        config.get("jobs", {}),
+        lambda payload: run_workflow(CustomerMessageInput(**payload)),
+    )
+    if app.state.jobs is not None:
+        app.state.jobs.start()
+    publisher = None
+    if shared_state is not None:
+        publisher = asyncio.create_task(
+            publish_metrics(
+                config.get("server", {}).get("metrics_publish_interval_seconds", 1)
+            )
+        )
+    yield
+    if publisher is not None:
+        publisher.cancel()
+        # The last counts of a worker that is shutting down still show in the totals.
+        shared_state.publish_metrics(metrics.snapshot())
+    if app.state.jobs is not None:
+        await app.state.jobs.stop()
+    if watcher is not None:
+        watcher.cancel()
+    app.state.warm_up.cancel()
+    await asyncio.gather(app.state.warm_up, return_exceptions=True)
+    await ticket_store.close()
+    await label_log.close()
+    from app.utils.LLM import close_llm_client
+
+    await close_llm_client()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.exception_handler(LLMOverloadedError)
+async def llm_overloaded(request: Request, exc: LLMOverloadedError):
+    # Tells clients (and load balancers) to back off instead of queueing more work.
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Routes as declared (not raw URLs), so the label set stays bounded.
+    route = request.scope.get("route")
+    http_request_duration.observe(
+        time.perf_counter() - start,
+        method=request.method,
+        path=route.path if route else "unmatched",
+        status=response.status_code,
+    )
+    return response
 
 
 class CustomerMessageInput(BaseModel):
     customer_id: str
     message: str
     product: str
+    # Overrides the deployment's graph mode ("graph.mode" in config) for this request.
+    mode: Optional[Literal["two_step", "fused", "speculative"]] = None
+    # Adds a per-stage timing breakdown to the response (if "metrics.debug_timings" allows it).
+    debug: bool = False
 
 
 class CustomerServiceResponse(BaseModel):
@@ -17,26 +151,74 @@ class CustomerServiceResponse(BaseModel):
     confidence_score: float
     response_data: dict
     customer_response: str
+    timings: Optional[dict] = None
 
 
-compiled_app = workflow.compile()
+class JobInput(CustomerMessageInput):
+    # Higher priorities are run first, e.g. 9 for live chat and 0 for email backfill.
+    priority: int = Field(default=0, ge=0, le=9)
+    # Receives a POST with the JobStatus once the job has finished. Its host must be in
+    # "jobs.callback_allowed_hosts".
+    callback_url: Optional[HttpUrl] = None
 
 
-@app.post("/process-customer-message", response_model=CustomerServiceResponse)
-async def process_customer_message(input_data: CustomerMessageInput):
-    # Initialize the workflow state.
-    initial_state: GraphState = {
-        "customer_id": input_data.customer_id,
-        "message": input_data.message,
-        "product": input_data.product,
-        "classification": None,
-        "confidence_score": None,
-        "extraction_data": {},
-        "customer_response": None,
-        "response_data": {},
-    }
-    # Await the compiled workflow instance's async invoke.
-    result = await compiled_app.ainvoke(initial_state)
+class JobStatus(BaseModel):
+    job_id: str
+    status: Literal["queued", "running", "done", "failed"]
+    priority: int
+    result: Optional[CustomerServiceResponse] = None
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+
+class TicketRecord(BaseModel):
+    id: str
+    kind: Literal["bug_report", "feature_request", "general_inquiry"]
+    product: str
+    status: str
+    title: Optional[str] = None
+    customer_id: Optional[str] = None
+    report_count: int
+    created_at: float
+    # The ticket, product requirement or inquiry as returned in response_data.
+    data: dict
+    # The customer's message as received, before preprocessing.
+    message: Optional[str] = None
+
+
+class TicketPage(BaseModel):
+    tickets: list[TicketRecord]
+    # Pass as `cursor` to get the next page; None on the last page.
+    next_cursor: Optional[str] = None
+
+
+class BatchCustomerMessageInput(BaseModel):
+    messages: list[CustomerMessageInput]
+
+
+class BatchItemResult(BaseModel):
+    index: int
+    status: Literal["ok", "error"]
+    result: Optional[CustomerServiceResponse] = None
+    error: Optional[str] = None
+
+
+class BatchCustomerServiceResponse(BaseModel):
+    results: list[BatchItemResult]
+
+
+async def compiled_workflow():
+    """The compiled workflow, once the warm-up has built it."""
+    warm_up_task = getattr(app.state, "warm_up", None)
+    if warm_up_task is not None:
+        # Shielded, so a request that gives up does not cancel the warm-up.
+        await asyncio.shield(warm_up_task)
+    return get_compiled_workflow()
+
+
+def build_response(result: dict) -> dict:
     return {
         "message_type": result.get("classification", ""),
         "confidence_score": result.get("confidence_score", 0.0),
@@ -45,5 +227,343 @@ async def process_customer_message(input_data: CustomerMessageInput):
     }
 
 
+def request_timeout(requested: Optional[float] = None) -> Optional[float]:
+    """
+    The deadline for answering a request, in seconds: the client's X-Request-Timeout,
+    capped by "deadlines.request_timeout_seconds" (which is also the default).
+    """
+    limit = config.get("deadlines", {}).get("request_timeout_seconds")
+    if requested is None or requested <= 0:
+        return limit
+    return requested if limit is None else min(requested, limit)
+
+
+async def run_workflow(
+    input_data: CustomerMessageInput, timeout: Optional[float] = None
+) -> dict:
+    initial_state = create_initial_state(
+        input_data.customer_id, input_data.message, input_data.product, input_data.mode
+    )
+    debug = input_data.debug and config.get("metrics", {}).get("debug_timings", False)
+    with collect_timings(enabled=debug) as stages, deadline_scope(
+        request_timeout(timeout)
+    ):
+        start = time.perf_counter()
+        # Await the compiled workflow instance's async invoke.
+        result = await (await compiled_workflow()).ainvoke(initial_state)
+        elapsed = time.perf_counter() - start
+    ticket_store.record(result)
+    response = build_response(result)
+    if debug:
+        response["timings"] = {"total_seconds": round(elapsed, 6), "stages": stages}
+    return response
+
+
+@app.post(
+    "/process-customer-message",
+    response_model=CustomerServiceResponse,
+    response_model_exclude_none=True,
+)
+async def process_customer_message(
+    input_data: CustomerMessageInput,
+    x_request_timeout: Optional[float] = Header(default=None),
+):
+    return await run_workflow(input_data, timeout=x_request_timeout)
+
+
+@app.post("/process-customer-message:stream")
+async def process_customer_message_stream(
+    input_data: CustomerMessageInput,
+    x_request_timeout: Optional[float] = Header(default=None),
+):
+    """
+    Streams the workflow as Server-Sent Events, so clients can show progress before the
+    extraction finishes:
+    - `classification`: {message_type, confidence_score}, as soon as the message is classified
+    - `partial`: {node, fields}, the partially generated LLM output while tokens arrive
+    - `result`: the final CustomerServiceResponse
+    - `error`: {detail}, if the workflow fails
+    """
+    initial_state = create_initial_state(
+        input_data.customer_id, input_data.message, input_data.product, input_data.mode
+    )
+
+    async def events():
+        state = dict(initial_state)
+        try:
+            compiled_app = await compiled_workflow()
+            with deadline_scope(request_timeout(x_request_timeout)):
+                async for mode, chunk in compiled_app.astream(
+                    initial_state,
+                    config={"configurable": {"stream_partials": True}},
+                    stream_mode=["updates", "custom"],
+                ):
+                    if mode == "custom":
+                        yield sse_event("partial", chunk)
+                        continue
+                    for update in chunk.values():
+                        if not update:
+                            continue
+                        state.update(update)
+                        if update.get("classification"):
+                            yield sse_event(
+                                "classification",
+                                {
+                                    "message_type": update["classification"],
+                                    "confidence_score": update.get(
+                                        "confidence_score", 0.0
+                                    ),
+                                },
+                            )
+        except Exception as e:
+            logger.error(f"Streaming workflow failed: {str(e)}")
+            yield sse_event("error", {"detail": str(e)})
+            return
+        ticket_store.record(state)
+        yield sse_event("result", build_response(state))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the stream.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post(
+    "/process-customer-messages:batch", response_model=BatchCustomerServiceResponse
+)
+async def process_customer_messages_batch(
+    input_data: BatchCustomerMessageInput, stream: bool = False
+):
+    """
+    Runs every message through the workflow concurrently, with at most
+    "batch.max_concurrency" graph runs in flight. A failing message is reported in its
+    own item instead of failing the batch. Results are returned in input order, or with
+    `?stream=true` as NDJSON lines (one BatchItemResult each) in completion order.
+    """
+    batch_config = config.get("batch", {})
+    max_items = batch_config.get("max_items", 1000)
+    if len(input_data.messages) > max_items:
+        raise HTTPException(
+            status_code=413, detail=f"A batch can contain at most {max_items} messages"
+        )
+    semaphore = asyncio.Semaphore(batch_config.get("max_concurrency", 16))
+
+    async def run_item(index: int, message: CustomerMessageInput) -> BatchItemResult:
+        async with semaphore:
+            try:
+                result = await run_workflow(message)
+                return BatchItemResult(index=index, status="ok", result=result)
+            except Exception as e:
+                logger.error(f"Batch item {index} failed: {str(e)}")
+                return BatchItemResult(index=index, status="error", error=str(e))
+
+    tasks = [
+        asyncio.create_task(run_item(index, message))
+        for index, message in enumerate(input_data.messages)
+    ]
+    if not stream:
+        return {"results": await asyncio.gather(*tasks)}
+
+    async def ndjson_lines():
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                item = await next_result
+                yield item.model_dump_json() + "\n"
+        finally:
+            # No-op once all items are done; stops the remaining runs if the client disconnects.
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+def job_pool():
+    if app.state.jobs is None:
+        raise HTTPException(status_code=503, detail="The job queue is disabled")
+    return app.state.jobs
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(input_data: JobInput):
+    """
+    Queues a message for the job workers and returns its job ID right away. Poll
+    `GET /jobs/{job_id}` for the result, or pass a `callback_url` to have it POSTed.
+    """
+    pool = job_pool()
+    callback_url = input_data.callback_url and str(input_data.callback_url)
+    if callback_url and not pool.callback_allowed(callback_url):
+        raise HTTPException(
+            status_code=422, detail="callback_url host is not in the allowed hosts"
+        )
+    payload = input_data.model_dump(exclude={"priority", "callback_url"})
+    job_id = await pool.submit(payload, input_data.priority, callback_url)
+    return {"job_id": job_id, "status": "queued"}
+
+
+@app.get("/jobs/stats")
+async def job_stats():
+    return await asyncio.to_thread(job_pool().queue.stats)
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatus, response_model_exclude_none=True)
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(job_pool().queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+
+def ticket_backend():
+    if not ticket_store.enabled:
+        raise HTTPException(status_code=503, detail="The ticket store is disabled")
+    return ticket_store.backend
+
+
+@app.get("/tickets", response_model=TicketPage)
+async def list_tickets(
+    product: Optional[str] = None,
+    kind: Optional[Literal["bug_report", "feature_request", "general_inquiry"]] = None,
+    status: Optional[str] = None,
+    team: Optional[str] = None,
+    component: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=50, ge=1, le=500),
+):
+    """
+    Stored tickets and inquiries matching all given filters, newest first, e.g. open bugs
+    of a team in the last hour: `?kind=bug_report&status=open&team=Auth%20Team&since=<unix
+    time>`. `since` and `until` are Unix timestamps. Recently created tickets appear once
+    the ticket store has written them (within "ticket_store.flush_interval_seconds").
+    """
+    after = None
+    if cursor is not None:
+        created_at, _, ticket_id = cursor.partition(":")
+        try:
+            after = (float(created_at), ticket_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    tickets = await asyncio.to_thread(
+        ticket_backend().query,
+        product=product,
+        kind=kind,
+        status=status,
+        team=team,
+        component=component,
+        since=since,
+        until=until,
+        after=after,
+        limit=limit,
+    )
+    next_cursor = None
+    if len(tickets) == limit:
+        next_cursor = f"{tickets[-1]['created_at']!r}:{tickets[-1]['id']}"
+    return {"tickets": tickets, "next_cursor": next_cursor}
+
+
+@app.get("/tickets/{ticket_id}", response_model=TicketRecord)
+async def get_ticket(ticket_id: str):
+    ticket = await asyncio.to_thread(ticket_backend().get, ticket_id)
+    if ticket is None:
+        raise HTTPException(status_code=404, detail="Unknown ticket")
+    return ticket
+
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe: 503 while the warm-up (see warm_up) is still importing and compiling
+    the workflow and creating the LLM client, or if it failed; 200 with the config version
+    being served once requests are answered without that delay.
+    """
+    warm_up_task = app.state.warm_up
+    if not warm_up_task.done():
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    if warm_up_task.cancelled() or warm_up_task.exception() is not None:
+        detail = (
+            "cancelled" if warm_up_task.cancelled() else str(warm_up_task.exception())
+        )
+        return JSONResponse(
+            status_code=503, content={"status": "failed", "detail": detail}
+        )
+    snapshot = config_store.snapshot()
+    return {
+        "status": "ready",
+        "warm_up_seconds": round(app.state.warm_up_seconds, 3),
+        "config_version": snapshot.version,
+        "products": len(snapshot.products),
+    }
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {**response_cache.stats(), "single_flight": single_flight.stats()}
+
+
+@app.get("/fast-path/stats")
+async def fast_path_statistics():
+    return fast_path_stats.stats()
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Prometheus text-format metrics. Under the multi-worker launcher, they are the totals of
+    all workers: this one's current values plus the others' last published snapshots.
+    """
+    others = []
+    if shared_state is not None:
+        others = await asyncio.to_thread(shared_state.other_workers_metrics)
+    return PlainTextResponse(
+        metrics.render(others), media_type="text/plain; version=0.0.4"
+    )
+
+
+# Without it, admin endpoints only answer clients on the same host.
+ADMIN_TOKEN_ENV = "ADMIN_TOKEN"
+LOCAL_HOSTS = ("127.0.0.1", "::1")
+
+
+def require_admin(request: Request, authorization: Optional[str] = Header(None)):
+    """
+    Admin endpoints need "Authorization: Bearer <token>" matching the ADMIN_TOKEN
+    environment variable; when it is not set, only local clients may call them.
+    """
+    token = os.environ.get(ADMIN_TOKEN_ENV)
+    if token:
+        if not hmac.compare_digest(
+            (authorization or "").encode(), f"Bearer {token}".encode()
+        ):
+            raise HTTPException(
+                status_code=401,
+                detail="Invalid admin token",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+    elif request.client is None or request.client.host not in LOCAL_HOSTS:
+        raise HTTPException(
+            status_code=403,
+            detail=f"Admin endpoints need {ADMIN_TOKEN_ENV} to be set for remote clients",
+        )
+
+
+@app.post("/admin/reload-config", dependencies=[Depends(require_admin)])
+async def reload_config():
+    """
+    Reloads config.json and atomically swaps in the new snapshot. In-flight requests finish
+    with the snapshot they started with; an invalid file leaves the current config in place.
+    """
+    try:
+        snapshot = await asyncio.to_thread(config_store.reload)
+    except ValueError as e:
+        # Also covers malformed JSON (json.JSONDecodeError is a ValueError)
+        raise HTTPException(status_code=400, detail=f"Invalid config: {e}")
+    return {"version": snapshot.version, "products": len(snapshot.products)}
+
+
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -1,10 +1,14 @@
+from typing import Optional
 from pydantic import BaseModel
 import logging
-from app.config import config
-from app.utils.LLM import LLMClient
-
-# Global counter for bug IDs.
-BUG_COUNTER = 1
+from app.config import ConfigSnapshot, config_store
+from app.utils.deadlines import DeadlineExceeded
+from app.utils.dedup import bug_report_index
+from app.utils.LLM import get_llm_client
+from app.utils.cache import response_cache
+from app.utils.prompts import prompt_registry
+from app.utils.ticket_ids import ticket_ids
+from app.utils.preprocessing import prompt_message
 
 
 class BugReportModel(BaseModel):
@@ -13,31 +17,16 @@ class BugReportModel(BaseModel):
     affected_components: list[str]
 
 
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
 logger = logging.getLogger(__name__)
 
 
-async def bug_report_extraction_node(state: dict) -> dict:
-    """
-    Uses ChatGPT via a synchronous LLM call (inside an async function) to extract bug report details.
-    Expected fields: 'title', 'reproduction_steps' (list), and 'affected_components'.
-    For any field that cannot be extracted from the customer message, return "UNKNOWN_VALUE" for that field.
-    Then, constructs a ticket with default values for severity, priority, and assigned_team (all set to "TBD"),
-    and assigns a unique bug ID in the format: BUG-<BUG_COUNTER>.
-    """
-    message = state.get("message", "")
-    product = state.get("product", "")
-
-    if product not in config["products"]:
-        logger.error("Invalid Product")
-        return {"customer_response": "Invalid Product Name", "response_data": {}}
+SYSTEM_PROMPT = "You are an expert at extracting structured bug report details."
 
-    component_team_mapping = config["products"][product]["component_team_mapping"]
-    components_list = component_team_mapping.keys()
 
-    prompt = (
+def render_prompt_prefix(product_config: dict) -> str:
+    # The static, per-product part of the prompt; the customer message is appended per request.
+    components_list = product_config["component_team_mapping"].keys()
+    return (
         "You are an expert at extracting bug report details from customer messages. "
         "Extract the following fields from the message: 'title', 'reproduction_steps' (as a list), "
         "and 'affected_components'. For 'affected_components', choose the most appropriate one from the following list: "
@@ -47,42 +36,123 @@ async def bug_report_extraction_node(state: dict) -> dict:
         "If a field cannot be determined from the message, use the value 'UNKNOWN_VALUE' for that field. "
         "Do not hallucinate or make assumptions."
         "Return your answer as a JSON object with these keys.\n\n"
-        f'Customer message: "{message}"'
     )
 
-    messages = [
-        {
-            "role": "system",
-            "content": "You are an expert at extracting structured bug report details.",
-        },
-        {"role": "user", "content": prompt},
-    ]
 
-    llm_client = LLMClient()
-    response = llm_client.parse(
-        model=config["model"],
-        messages=messages,
-        response_format=BugReportModel,
-    )
+prompt_registry.register("bug_extraction", SYSTEM_PROMPT, render_prompt_prefix)
+
+
+async def bug_report_extraction_node(state: dict) -> dict:
+    """
+    Uses ChatGPT via an asynchronous LLM call to extract bug report details.
+    Expected fields: 'title', 'reproduction_steps' (list), and 'affected_components'.
+    For any field that cannot be extracted from the customer message, return "UNKNOWN_VALUE" for that field.
+    Then, constructs a ticket with default values for severity, priority, and assigned_team (all set to "TBD"),
+    and assigns a unique bug ID in the format: BUG-<n> from the ticket ID service.
+    """
+    message = prompt_message(state)
+    product = state.get("product", "")
+
+    snapshot = config_store.snapshot()
+    if not snapshot.has_product(product):
+        logger.error("Invalid Product")
+        return {"customer_response": "Invalid Product Name", "response_data": {}}
+
+    # Another report of a recent problem needs no extraction or new ticket.
+    duplicate = attach_to_recent_ticket(product, message)
+    if duplicate is not None:
+        return duplicate
+
+    data = await extract_bug_report(message, product, snapshot)
+    return await build_bug_report_response(data, product, snapshot, message)
+
+
+async def extract_bug_report(
+    message: str, product: str, snapshot: ConfigSnapshot
+) -> dict:
+    """
+    The bug report details extracted from the message by the LLM, with "UNKNOWN_VALUE"
+    for all of them if the call fails or the deadline passes.
+    """
+    prompt = prompt_registry.get("bug_extraction", product, snapshot)
+
+    llm_client = get_llm_client()
+    try:
+        response = await llm_client.parse_routed(
+            node="bug_extraction",
+            product=product,
+            message=message,
+            messages=prompt.messages(message),
+            response_format=BugReportModel,
+            cache_key=lambda model: response_cache.make_key(
+                "bug_extraction", product, message, model, prompt.version
+            ),
+            snapshot=snapshot,
+        )
+    except DeadlineExceeded:
+        # Out of time: still file the ticket, with the unknown details below.
+        logger.warning("Deadline passed, filing bug report without extracted details")
+        response = None
     try:
         data = response.model_dump()
     except Exception as e:
         logger.error(str(e))
+        data = {
+            "title": "UNKNOWN_VALUE",
+            "reproduction_steps": ["UNKNOWN_VALUE"],
+            "affected_components": ["UNKNOWN_VALUE"],
+        }
+    return data
+
+
+def attach_to_recent_ticket(product: str, message: str) -> Optional[dict]:
+    """
+    Attaches the report to a recent ticket of the same problem (see BugReportIndex) and
+    returns the response for it, or None if the report is not a duplicate.
+    """
+    ticket = bug_report_index.attach(product, message)
+    if ticket is None:
+        return None
+    customer_response = (
+        "Thank you for your bug report. This problem has already been reported "
+        f"and is being tracked with ID {ticket['id']}."
+    )
+    return {
+        "customer_response": customer_response,
+        "response_data": {"ticket": ticket, "duplicate": True},
+    }
+
+
+async def build_bug_report_response(
+    data: dict, product: str, snapshot: ConfigSnapshot = None, message: str = None
+) -> dict:
+    """
+    Builds the bug ticket and customer response from extracted bug report details.
+    Shared by the bug report extraction node and the fused classify+extract node.
+    With the customer `message`, the new ticket is indexed for deduplication, unless a
+    similar report created a ticket while this one was being extracted.
+    """
+    if message is not None:
+        duplicate = attach_to_recent_ticket(product, message)
+        if duplicate is not None:
+            return duplicate
+    product_index = (snapshot or config_store.snapshot()).product(product)
     assigned_teams = [
-        component_team_mapping.get(affected_component, "TBD")
+        product_index.team_for(affected_component)
         for affected_component in data["affected_components"]
     ]
-    global BUG_COUNTER
     ticket = {
-        "id": f"BUG-{BUG_COUNTER}",
+        "id": await ticket_ids.next_id("BUG"),
         "title": data.get("title", ""),
         "reproduction_steps": data.get("reproduction_steps"),
         "affected_components": data.get("affected_components"),
         "severity": "Medium",
         "priority": "High",
         "assigned_team": assigned_teams,
+        "report_count": 1,
     }
-    BUG_COUNTER += 1
+    if message is not None:
+        bug_report_index.add(product, message, ticket)
 
     customer_response = f"Thank you for your bug report. Your report has been recorded with ID {ticket['id']}."
     return {"customer_response": customer_response, "response_data": {"ticket": ticket}}
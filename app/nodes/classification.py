@@ -1,7 +1,17 @@
+from typing import Optional
 from pydantic import BaseModel
 import logging
-from app.utils.LLM import LLMClient
-from app.config import config
+from app.utils.batching import create_micro_batcher
+from app.utils.deadlines import DeadlineExceeded
+from app.utils.LLM import get_llm_client
+from app.utils.cache import response_cache
+from app.utils.metrics import current_node
+from app.utils.model_router import PARSE_ERRORS, plan_route
+from app.utils.prompts import RenderedPrompt, prompt_registry
+from app.utils.pre_classifier import log_llm_label
+from app.utils.speculation import class_priors
+from app.config import ConfigSnapshot, config, config_store
+from app.utils.preprocessing import prompt_message
 
 
 class ClassificationModel(BaseModel):
@@ -9,63 +19,195 @@ class ClassificationModel(BaseModel):
     confidence_score: float
 
 
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
+class ClassificationBatchItem(ClassificationModel):
+    id: int
+
+
+class ClassificationBatchModel(BaseModel):
+    results: list[ClassificationBatchItem]
+
+
 logger = logging.getLogger(__name__)
 
 
+SYSTEM_PROMPT = "You are a helpful assistant that classifies customer messages."
+
+
+def render_prompt_prefix(product_config: dict) -> str:
+    # The static, per-product part of the prompt; the customer message is appended per request.
+    return (
+        "You are an expert at customer service message classification. "
+        "Based on the following customer message, determine whether the message is a "
+        "'bug_report', 'feature_request', or 'general_inquiry'. Errors and bugs count towards bug_report, "
+        "any requests for new features count as feature_request, and general comments or questions count towards general_inquiry. "
+        "Also, provide a confidence score between 0 and 1 indicating your confidence in this classification. "
+        "Return your answer as a JSON object with the keys 'classification' and 'confidence_score'.\n\n"
+    )
+
+
+prompt_registry.register("classify_input", SYSTEM_PROMPT, render_prompt_prefix)
+
+
+BATCH_SYSTEM_PROMPT = (
+    "You are a helpful assistant that classifies batches of customer messages."
+)
+
+
+def render_batch_prompt_prefix(product_config: dict) -> str:
+    # The static part of the prompt; the numbered customer messages are appended per batch.
+    return (
+        "You are an expert at customer service message classification. "
+        "For each of the following numbered customer messages, determine whether the message is a "
+        "'bug_report', 'feature_request', or 'general_inquiry'. Errors and bugs count towards bug_report, "
+        "any requests for new features count as feature_request, and general comments or questions count towards general_inquiry. "
+        "Also, provide a confidence score between 0 and 1 indicating your confidence in each classification. "
+        "Return your answer as a JSON object with the key 'results': a list with one object per message, "
+        "with the keys 'id' (the number of the message), 'classification' and 'confidence_score'.\n\n"
+    )
+
+
+prompt_registry.register(
+    "classify_batch", BATCH_SYSTEM_PROMPT, render_batch_prompt_prefix
+)
+
+
+async def classify_batch(key: tuple, messages: list) -> list:
+    """
+    Classifies the messages of one micro-batch of a product in a single LLM call on
+    `model`, returning a ClassificationModel per message (None for any the output left
+    out). A batch of one is sent with the regular, single-message prompt.
+    """
+    product, model = key
+    current_node.set("classify_input")
+    snapshot = config_store.snapshot()
+    llm_client = get_llm_client()
+    if len(messages) == 1:
+        prompt = prompt_registry.get("classify_input", product, snapshot)
+        response = await llm_client.parse(
+            model=model,
+            messages=prompt.messages(messages[0]),
+            response_format=ClassificationModel,
+        )
+        return [response]
+    prompt = prompt_registry.get("classify_batch", product, snapshot)
+    response = await llm_client.parse(
+        model=model,
+        messages=prompt.batch_messages(messages),
+        response_format=ClassificationBatchModel,
+    )
+    results = {item.id: item for item in (response.results if response else [])}
+    return [
+        (
+            ClassificationModel(
+                classification=results[i].classification,
+                confidence_score=results[i].confidence_score,
+            )
+            if i in results
+            else None
+        )
+        for i in range(len(messages))
+    ]
+
+
+classification_batcher = create_micro_batcher(
+    "classify_input", config.get("classification_batching", {}), classify_batch
+)
+
+
+async def classify_in_batch(
+    product: str, message: str, snapshot: ConfigSnapshot, prompt: RenderedPrompt
+) -> Optional[ClassificationModel]:
+    """
+    Classifies the message together with other requests' messages (see MicroBatcher) on
+    the first model of its route, through the response cache. Returns None if the
+    batch output left it out or could not be parsed, or if its confidence calls for a
+    stronger tier, so that the caller makes the routed call for it alone.
+    """
+    route = plan_route(snapshot, "classify_input", product, message)
+    model = route.models[0]
+    cache_key = response_cache.make_key(
+        "classify_input", product, message, model, prompt.version
+    )
+    cached = await response_cache.get(cache_key)
+    if cached is not None:
+        response = ClassificationModel.model_validate(cached)
+    else:
+        try:
+            response = await classification_batcher.submit((product, model), message)
+        except PARSE_ERRORS as e:
+            logger.info(f"Batched classification could not be parsed ({str(e)})")
+            return None
+        if response is None:
+            return None
+        # Also lets the routed call start from this output when it escalates.
+        await response_cache.set(cache_key, response.model_dump())
+    if (
+        len(route.models) > 1
+        and route.min_confidence is not None
+        and response.confidence_score < route.min_confidence
+    ):
+        return None
+    return response
+
+
 async def classify_input_node(state: dict) -> dict:
     """
     Uses ChatGPT via an asynchronous LLM call to classify the customer message
     into one of three types and generate a confidence score, returning structured output.
     """
-    message = state.get("message", "")
+    message = prompt_message(state)
     product = state.get("product", "")
 
-    if product not in config["products"]:
+    snapshot = config_store.snapshot()
+    if not snapshot.has_product(product):
         logger.error("Invalid Product")
         return {
             "classification": "",
             "confidence_score": 0,
             "customer_id": state.get("customer_id"),
-            "message": message,
+            "message": state.get("message"),
             "product": state.get("product"),
         }
 
-    prompt = (
-        "You are an expert at customer service message classification. "
-        "Based on the following customer message, determine whether the message is a "
-        "'bug_report', 'feature_request', or 'general_inquiry'. Errors and bugs count towards bug_report, "
-        "any requests for new features count as feature_request, and general comments or questions count towards general_inquiry. "
-        "Also, provide a confidence score between 0 and 1 indicating your confidence in this classification. "
-        "Return your answer as a JSON object with the keys 'classification' and 'confidence_score'.\n\n"
-        f'Customer message: "{message}"'
-    )
-
-    messages = [
-        {
-            "role": "system",
-            "content": "You are a helpful assistant that classifies customer messages.",
-        },
-        {"role": "user", "content": prompt},
-    ]
-    llm_client = LLMClient()
-    response = llm_client.parse(
-        model=config["model"],
-        messages=messages,
-        response_format=ClassificationModel,
-    )
+    prompt = prompt_registry.get("classify_input", product, snapshot)
+    llm_client = get_llm_client()
+    try:
+        response = None
+        if classification_batcher is not None:
+            response = await classify_in_batch(product, message, snapshot, prompt)
+        if response is None:
+            response = await llm_client.parse_routed(
+                node="classify_input",
+                product=product,
+                message=message,
+                messages=prompt.messages(message),
+                response_format=ClassificationModel,
+                cache_key=lambda model: response_cache.make_key(
+                    "classify_input", product, message, model, prompt.version
+                ),
+                snapshot=snapshot,
+            )
+    except DeadlineExceeded:
+        # Out of time: fall back to a zero-confidence general inquiry below.
+        logger.warning("Deadline passed, skipping classification")
+        response = None
     try:
         data = response.model_dump()
     except Exception as e:
         logger.error(e)
         data = {"classification": "general_inquiry", "confidence_score": 0}
+    else:
+        # Labels for fitting the local pre-classifier.
+        log_llm_label(
+            product, message, data["classification"], data["confidence_score"]
+        )
+        # Class frequencies for guessing what to extract speculatively.
+        class_priors.observe(product, data["classification"])
 
     return {
         "classification": data.get("classification", "general_inquiry"),
         "confidence_score": data.get("confidence_score", 0),
         "customer_id": state.get("customer_id"),
-        "message": message,
+        "message": state.get("message"),
         "product": state.get("product"),
     }
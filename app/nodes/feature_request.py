@@ -1,10 +1,12 @@
 from pydantic import BaseModel
 import logging
-from app.config import config
-from app.utils.LLM import LLMClient
-
-# Global counter for Feature Requests.
-FR_COUNTER = 1
+from app.config import ConfigSnapshot, config_store
+from app.utils.deadlines import DeadlineExceeded
+from app.utils.LLM import get_llm_client
+from app.utils.cache import response_cache
+from app.utils.prompts import prompt_registry
+from app.utils.ticket_ids import ticket_ids
+from app.utils.preprocessing import prompt_message
 
 
 class FeatureRequestModel(BaseModel):
@@ -16,65 +18,88 @@ class FeatureRequestModel(BaseModel):
     missing_fields: list[str]
 
 
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
 logger = logging.getLogger(__name__)
 
 
+SYSTEM_PROMPT = "You are an expert at extracting structured feature request details."
+
+
+def render_prompt_prefix(product_config: dict) -> str:
+    # The static, per-product part of the prompt; the customer message is appended per request.
+    components_list = product_config["component_team_mapping"].keys()
+    description = product_config["description"]
+    return (
+        "You are an expert at extracting feature request details from customer messages. "
+        "Extract the following fields from the message: 'title', 'description', 'user_story', and 'affected_components' (as a list). "
+        "Come up with a relevant title based on the message provided by the user. "
+        "For 'affected_components', choose the most appropriate ones from the following list: "
+        f"{components_list}. "
+        "The 'business_value' should be set to High/Medium/Low based on the feature request with respect to the description for the application provided"
+        f"Description for the application: {description}."
+        "Strictly fill in the only the details that can be inferred from the customer message other than this."
+        "If a field cannot be determined from the message, use the value 'UNKNOWN_VALUE' for that field. "
+        "Do not hallucinate or make assumptions."
+        "If any field is missing, include a 'missing_fields' list in your JSON output containing the names of the missing fields. "
+        "Return your answer as a JSON object with these keys.\n\n"
+    )
+
+
+prompt_registry.register("feature_extraction", SYSTEM_PROMPT, render_prompt_prefix)
+
+
 async def feature_request_extraction_node(state: dict) -> dict:
     """
-    Uses ChatGPT via a synchronous LLM call (inside an async function) to extract feature request details.
+    Uses ChatGPT via an asynchronous LLM call to extract feature request details.
     Expected fields: 'title', 'description', 'user_story', and 'affected_components' (list).
     If a field cannot be extracted from the customer message, return "UNKNOWN_VALUE" for that field.
     If any required fields are missing, include a 'missing_fields' list in the response.
     Returns the answer as a JSON object matching the FeatureRequestModel.
-    Then, constructs a product requirement ticket with a global counter and default values:
+    Then, constructs a product requirement ticket with an ID from the ticket ID service and default values:
       - business_value: "TBD"
       - complexity_estimate: "TBD"
       - status: "TBD"
     """
-    message = state.get("message", "")
+    message = prompt_message(state)
 
     product = state.get("product", "")
 
-    if product not in config["products"]:
+    snapshot = config_store.snapshot()
+    if not snapshot.has_product(product):
         logger.error("Invalid Product")
         return {"customer_response": "Invalid Product Name", "response_data": {}}
 
-    components_list = config["products"][product]["component_team_mapping"].keys()
-    description = config["products"][product]["description"]
+    data = await extract_feature_request(message, product, snapshot)
+    return await build_feature_request_response(data, product, snapshot)
 
-    prompt = (
-        "You are an expert at extracting feature request details from customer messages. "
-        "Extract the following fields from the message: 'title', 'description', 'user_story', and 'affected_components' (as a list). "
-        "Come up with a relevant title based on the message provided by the user. "
-        "For 'affected_components', choose the most appropriate ones from the following list: "
-        f"{components_list}. "
-        "The 'business_value' should be set to High/Medium/Low based on the feature request with respect to the description for the application provided"
-        f"Description for the application: {description}."
-        "Strictly fill in the only the details that can be inferred from the customer message other than this."
-        "If a field cannot be determined from the message, use the value 'UNKNOWN_VALUE' for that field. "
-        "Do not hallucinate or make assumptions."
-        "If any field is missing, include a 'missing_fields' list in your JSON output containing the names of the missing fields. "
-        "Return your answer as a JSON object with these keys.\n\n"
-        f'Customer message: "{message}"'
-    )
 
-    messages = [
-        {
-            "role": "system",
-            "content": "You are an expert at extracting structured feature request details.",
-        },
-        {"role": "user", "content": prompt},
-    ]
-
-    llm_client = LLMClient()
-    response = llm_client.parse(
-        model=config["model"],
-        messages=messages,
-        response_format=FeatureRequestModel,
-    )
+async def extract_feature_request(
+    message: str, product: str, snapshot: ConfigSnapshot
+) -> dict:
+    """
+    The feature request details extracted from the message by the LLM, with
+    "UNKNOWN_VALUE" (and all fields missing) if the call fails or the deadline passes.
+    """
+    prompt = prompt_registry.get("feature_extraction", product, snapshot)
+
+    llm_client = get_llm_client()
+    try:
+        response = await llm_client.parse_routed(
+            node="feature_extraction",
+            product=product,
+            message=message,
+            messages=prompt.messages(message),
+            response_format=FeatureRequestModel,
+            cache_key=lambda model: response_cache.make_key(
+                "feature_extraction", product, message, model, prompt.version
+            ),
+            snapshot=snapshot,
+        )
+    except DeadlineExceeded:
+        # Out of time: record the request with the unknown details below.
+        logger.warning(
+            "Deadline passed, recording feature request without extracted details"
+        )
+        response = None
     try:
         data = response.model_dump()
     except Exception as e:
@@ -91,10 +116,18 @@ async def feature_request_extraction_node(state: dict) -> dict:
                 "affected_components",
             ],
         }
+    return data
+
 
-    global FR_COUNTER
+async def build_feature_request_response(
+    data: dict, product: str, snapshot: ConfigSnapshot = None
+) -> dict:
+    """
+    Builds the product requirement ticket and customer response from extracted feature
+    request details. Shared by the feature request extraction node and the fused node.
+    """
     product_requirement = {
-        "id": f"FR-{FR_COUNTER}",
+        "id": await ticket_ids.next_id("FR"),
         "title": data.get("title", "UNKNOWN_VALUE"),
         "description": data.get("description", "UNKNOWN_VALUE"),
         "user_story": data.get("user_story", "UNKNOWN_VALUE"),
@@ -103,7 +136,6 @@ async def feature_request_extraction_node(state: dict) -> dict:
         "affected_components": data.get("affected_components", []),
         "status": "Under Review",
     }
-    FR_COUNTER += 1
 
     customer_response = f"Thank you for your feature request. Your request has been recorded with ID {product_requirement['id']}."
     return {
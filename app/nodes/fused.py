@@ -0,0 +1,150 @@
+from typing import Literal, Union
+from pydantic import BaseModel
+import logging
+from app.config import config_store
+from app.utils.deadlines import DeadlineExceeded
+from app.utils.LLM import get_llm_client
+from app.utils.cache import response_cache
+from app.utils.prompts import prompt_registry
+from app.utils.preprocessing import prompt_message
+from app.nodes.classification import ClassificationModel
+from app.nodes.bug_report import BugReportModel, build_bug_report_response
+from app.nodes.feature_request import (
+    FeatureRequestModel,
+    build_feature_request_response,
+)
+from app.nodes.general_inquiry import (
+    GeneralInquiryModel,
+    build_general_inquiry_response,
+)
+
+
+# Each variant narrows `classification` to a literal, which acts as the discriminator
+# of the union and selects which extraction model `details` holds.
+class FusedBugReport(ClassificationModel):
+    classification: Literal["bug_report"]
+    details: BugReportModel
+
+
+class FusedFeatureRequest(ClassificationModel):
+    classification: Literal["feature_request"]
+    details: FeatureRequestModel
+
+
+class FusedGeneralInquiry(ClassificationModel):
+    classification: Literal["general_inquiry"]
+    details: GeneralInquiryModel
+
+
+class FusedModel(BaseModel):
+    result: Union[FusedBugReport, FusedFeatureRequest, FusedGeneralInquiry]
+
+
+RESPONSE_BUILDERS = {
+    "bug_report": build_bug_report_response,
+    "feature_request": build_feature_request_response,
+    "general_inquiry": build_general_inquiry_response,
+}
+
+
+logger = logging.getLogger(__name__)
+
+
+SYSTEM_PROMPT = "You are a helpful assistant that classifies customer messages and extracts structured details."
+
+
+def render_prompt_prefix(product_config: dict) -> str:
+    # The static, per-product part of the prompt; the customer message is appended per request.
+    components_list = product_config["component_team_mapping"].keys()
+    description = product_config["description"]
+    inquiry_categories = product_config["general_inquiry"]["resource_dict"].keys()
+    return (
+        "You are an expert at customer service message classification and extraction. "
+        "First, determine whether the following customer message is a "
+        "'bug_report', 'feature_request', or 'general_inquiry'. Errors and bugs count towards bug_report, "
+        "any requests for new features count as feature_request, and general comments or questions count towards general_inquiry. "
+        "Also, provide a confidence score between 0 and 1 indicating your confidence in this classification. "
+        "Then, fill in 'details' with the fields for that classification only:\n"
+        "- bug_report: 'title', 'reproduction_steps' (as a list, inferred from the customer message) and "
+        f"'affected_components', choosing the most appropriate ones from the following list: {components_list}.\n"
+        "- feature_request: a relevant 'title', 'description', 'user_story', 'affected_components' (as a list) "
+        f"chosen from {components_list}, and 'business_value' set to High/Medium/Low with respect to the "
+        f"description for the application: {description}. "
+        "If any field is missing, include its name in the 'missing_fields' list.\n"
+        f"- general_inquiry: 'inquiry_category', which should be one of the following: {inquiry_categories}, "
+        "and 'requires_human_review', marked as True if the category cannot be identified.\n"
+        "Strictly fill in the only the details that can be inferred from the customer message. "
+        "If a field cannot be determined from the message, use the value 'UNKNOWN_VALUE' for that field. "
+        "Do not hallucinate or make assumptions."
+        "Return your answer as a JSON object with the key 'result'.\n\n"
+    )
+
+
+prompt_registry.register("fused_extraction", SYSTEM_PROMPT, render_prompt_prefix)
+
+
+async def fused_extraction_node(state: dict) -> dict:
+    """
+    Uses ChatGPT via a single asynchronous LLM call to both classify the customer message
+    and extract the details for that class, returning a FusedModel.
+    If the confidence score is at least "graph.fused_min_confidence", the ticket/response is
+    built directly. Otherwise nothing is returned, so the graph falls back to the two-step
+    classify_input -> extraction path.
+    """
+    message = prompt_message(state)
+    product = state.get("product", "")
+
+    snapshot = config_store.snapshot()
+    if not snapshot.has_product(product):
+        logger.error("Invalid Product")
+        return {
+            "classification": "",
+            "confidence_score": 0,
+            "customer_response": "Invalid Product Name",
+            "response_data": {},
+        }
+
+    prompt = prompt_registry.get("fused_extraction", product, snapshot)
+
+    llm_client = get_llm_client()
+    try:
+        response = await llm_client.parse_routed(
+            node="fused_extraction",
+            product=product,
+            message=message,
+            messages=prompt.messages(message),
+            response_format=FusedModel,
+            cache_key=lambda model: response_cache.make_key(
+                "fused_extraction", product, message, model, prompt.version
+            ),
+            confidence=lambda output: output.result.confidence_score,
+            snapshot=snapshot,
+        )
+    except DeadlineExceeded:
+        # Out of time: let the two-step path answer with its fallbacks.
+        logger.warning("Deadline passed, skipping fused extraction")
+        return {}
+    try:
+        result = FusedModel.model_validate(response.model_dump()).result
+    except Exception as e:
+        logger.error(e)
+        return {}
+
+    min_confidence = snapshot.get("graph", {}).get("fused_min_confidence", 0.8)
+    if result.confidence_score < min_confidence:
+        logger.info(
+            f"Fused confidence {result.confidence_score} below {min_confidence}, "
+            "falling back to two-step classification"
+        )
+        return {}
+
+    # Bug reports also pass the message, so duplicates are attached to existing tickets.
+    extra = {"message": message} if result.classification == "bug_report" else {}
+    node_output = await RESPONSE_BUILDERS[result.classification](
+        result.details.model_dump(), product, snapshot, **extra
+    )
+    return {
+        "classification": result.classification,
+        "confidence_score": result.confidence_score,
+        **node_output,
+    }
@@ -1,7 +1,11 @@
 from pydantic import BaseModel
 import logging
-from app.config import config
-from app.utils.LLM import LLMClient
+from app.config import ConfigSnapshot, config_store
+from app.utils.deadlines import DeadlineExceeded
+from app.utils.LLM import get_llm_client
+from app.utils.cache import response_cache
+from app.utils.prompts import prompt_registry
+from app.utils.preprocessing import prompt_message
 
 
 class GeneralInquiryModel(BaseModel):
@@ -9,68 +13,99 @@ class GeneralInquiryModel(BaseModel):
     requires_human_review: bool
 
 
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
 logger = logging.getLogger(__name__)
 
 
+SYSTEM_PROMPT = "You are an expert at extracting structured general inquiry details."
+
+
+def render_prompt_prefix(product_config: dict) -> str:
+    # The static, per-product part of the prompt; the customer message is appended per request.
+    inquiry_categories = product_config["general_inquiry"]["resource_dict"].keys()
+    return (
+        "You are an expert at determining inquiry categories from customer messages. "
+        "Based on the following customer message, determine the inquiry category. "
+        f"The 'inquiry_category' should be one of the following: {inquiry_categories}"
+        "The 'requires_human_review' should be marked as True if the category cannot be identified or if the user was"
+        " not able to solve their problem using the resources provided by the system"
+        "Strictly fill in the only the details that can be inferred from the customer message other than this."
+        "If a field cannot be determined from the message, use the value 'UNKNOWN_VALUE' for that field. "
+        "Do not hallucinate or make assumptions."
+        "Return your answer as a JSON object with the keys 'inquiry_category' and 'requires_human_review'.\n\n"
+    )
+
+
+prompt_registry.register("inquiry_extraction", SYSTEM_PROMPT, render_prompt_prefix)
+
+
 async def general_inquiry_extraction_node(state: dict) -> dict:
     """
-    Uses ChatGPT via a synchronous LLM call (inside an async function) to extract general inquiry details.
+    Uses ChatGPT via an asynchronous LLM call to extract general inquiry details.
     Expected output: a JSON object with the key 'inquiry_category' (which should be one of:
     'Account Management', 'Billing', 'Usage Question', or 'Other').
     Then, using a pre-defined resource dictionary, the function determines the suggested resources and whether
     human review is required.
     """
-    message = state.get("message", "")
+    message = prompt_message(state)
 
     product = state.get("product", "")
 
-    if product not in config["products"]:
+    snapshot = config_store.snapshot()
+    if not snapshot.has_product(product):
         logger.error("Invalid Product")
         return {"customer_response": "Invalid Product Name", "response_data": {}}
 
-    resource_dict = config["products"][product]["general_inquiry"]["resource_dict"]
-    inquiry_categories = resource_dict.keys()
+    data = await extract_general_inquiry(message, product, snapshot)
+    return await build_general_inquiry_response(data, product, snapshot)
 
-    prompt = (
-        "You are an expert at determining inquiry categories from customer messages. "
-        "Based on the following customer message, determine the inquiry category. "
-        f"The 'inquiry_category' should be one of the following: {inquiry_categories}"
-        "The 'requires_human_review' should be marked as True if the category cannot be identified or if the user was"
-        " not able to solve their problem using the resources provided by the system"
-        "Strictly fill in the only the details that can be inferred from the customer message other than this."
-        "If a field cannot be determined from the message, use the value 'UNKNOWN_VALUE' for that field. "
-        "Do not hallucinate or make assumptions."
-        "Return your answer as a JSON object with the keys 'inquiry_category' and 'requires_human_review'.\n\n"
-        f'Customer message: "{message}"'
-    )
 
-    messages = [
-        {
-            "role": "system",
-            "content": "You are an expert at extracting structured general inquiry details.",
-        },
-        {"role": "user", "content": prompt},
-    ]
-
-    llm_client = LLMClient()
-    response = llm_client.parse(
-        model=config["model"],
-        messages=messages,
-        response_format=GeneralInquiryModel,
-    )
+async def extract_general_inquiry(
+    message: str, product: str, snapshot: ConfigSnapshot
+) -> dict:
+    """
+    The general inquiry details extracted from the message by the LLM, or category
+    "Other" with human review if the call fails or the deadline passes.
+    """
+    prompt = prompt_registry.get("inquiry_extraction", product, snapshot)
+
+    llm_client = get_llm_client()
+    try:
+        response = await llm_client.parse_routed(
+            node="inquiry_extraction",
+            product=product,
+            message=message,
+            messages=prompt.messages(message),
+            response_format=GeneralInquiryModel,
+            cache_key=lambda model: response_cache.make_key(
+                "inquiry_extraction", product, message, model, prompt.version
+            ),
+            snapshot=snapshot,
+        )
+    except DeadlineExceeded:
+        # Out of time: hand the inquiry to a human instead of failing the request.
+        logger.warning("Deadline passed, routing inquiry to human review")
+        response = None
     try:
         data = response.model_dump()
     except Exception as e:
         logger.error(e)
-        data = {"inquiry_category": "Other"}
+        data = {"inquiry_category": "Other", "requires_human_review": True}
+    return data
+
+
+async def build_general_inquiry_response(
+    data: dict, product: str, snapshot: ConfigSnapshot = None
+) -> dict:
+    """
+    Builds the suggested resources and customer response from extracted general inquiry
+    details. Shared by the general inquiry extraction node and the fused node.
+    """
+    product_index = (snapshot or config_store.snapshot()).product(product)
 
     # Use the extracted inquiry_category and include the resource dictionary logic.
     inquiry_category = data.get("inquiry_category", "Other")
 
-    suggested_resources = resource_dict.get(inquiry_category, [])
+    suggested_resources = product_index.resources_for(inquiry_category)
     requires_human_review = data.get("requires_human_review", False)
     if inquiry_category != "Other":
         customer_response = "Thank you for your inquiry. Please refer to the following resources or wait for further assistance."
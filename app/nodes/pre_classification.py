@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import random
+from app.config import config, config_store
+from app.nodes.classification import classify_input_node
+from app.utils.pre_classifier import pre_classifier, fast_path_stats
+from app.utils.preprocessing import prompt_message
+
+logger = logging.getLogger(__name__)
+
+# Keeps references to running shadow checks so they are not garbage collected.
+_shadow_checks = set()
+
+
+async def _shadow_check(state: dict, classification: str):
+    """
+    Asks the LLM about a fast-path answer to measure how often the two agree. A failed
+    call is not a disagreement: classify_input_node falls back to a zero-confidence
+    answer, which is not recorded.
+    """
+    try:
+        result = await classify_input_node(state)
+    except Exception as e:
+        logger.warning(f"Fast-path shadow check failed: {str(e)}")
+        return
+    if not result["confidence_score"]:
+        logger.warning("Fast-path shadow check got no LLM answer, not recording it")
+        return
+    fast_path_stats.shadow_checked += 1
+    fast_path_stats.shadow_agreed += result["classification"] == classification
+    pre_classifier.record_agreement(prompt_message(state), result["classification"])
+
+
+async def pre_classify_node(state: dict) -> dict:
+    """
+    Classifies obvious messages locally using the configured pre-classifier (keyword/regex
+    rules or a TF-IDF + logistic regression model) to skip the LLM classification call.
+    Returns a classification and confidence score only if the confidence reaches
+    "fast_path.min_confidence"; otherwise returns nothing so the graph falls through to the LLM.
+    A sample ("fast_path.shadow_sample_rate") of fast-path answers is re-checked by the LLM
+    in the background to measure the agreement rate.
+    """
+    message = prompt_message(state)
+    product = state.get("product", "")
+    fast_path_config = config.get("fast_path", {})
+
+    if pre_classifier is None or not config_store.snapshot().has_product(product):
+        return {}
+
+    fast_path_stats.lookups += 1
+    prediction = pre_classifier.predict(message)
+    if prediction is None:
+        return {}
+    classification, confidence_score = prediction
+    if confidence_score < fast_path_config.get("min_confidence", 0.9):
+        return {}
+
+    fast_path_stats.hits += 1
+    if random.random() < fast_path_config.get("shadow_sample_rate", 0.0):
+        task = asyncio.create_task(_shadow_check(dict(state), classification))
+        _shadow_checks.add(task)
+        task.add_done_callback(_shadow_checks.discard)
+
+    return {"classification": classification, "confidence_score": confidence_score}
@@ -0,0 +1,41 @@
+import logging
+import time
+from app.config import config_store
+from app.utils.metrics import message_tokens, preprocess_tokens_saved, record_stage
+from app.utils.preprocessing import preprocess_message
+
+logger = logging.getLogger(__name__)
+
+
+async def preprocess_node(state: dict) -> dict:
+    """
+    Trims the customer message before any LLM sees it (see preprocess_message) and
+    stores the result as "clean_message", which the other nodes put in their prompts.
+    The original "message" is left untouched for the ticket and the response.
+    Does nothing if "preprocessing.enabled" is off or the product is unknown.
+    """
+    message = state.get("message") or ""
+    product = state.get("product", "")
+
+    snapshot = config_store.snapshot()
+    settings = snapshot.get("preprocessing", {})
+    if not settings.get("enabled", False) or not snapshot.has_product(product):
+        return {}
+
+    start = time.perf_counter()
+    cleaned = preprocess_message(message, product, snapshot)
+    record_stage(
+        "preprocess",
+        time.perf_counter() - start,
+        original_tokens=cleaned.original_tokens,
+        clean_tokens=cleaned.tokens,
+        truncated=cleaned.truncated,
+    )
+    message_tokens.observe(cleaned.original_tokens, product=product, stage="original")
+    message_tokens.observe(cleaned.tokens, product=product, stage="clean")
+    preprocess_tokens_saved.observe(cleaned.tokens_saved, product=product)
+    if cleaned.truncated:
+        logger.info(
+            f"Message of {cleaned.original_tokens} tokens cut to the {product} budget"
+        )
+    return {"clean_message": cleaned.text}
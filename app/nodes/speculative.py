@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from app.config import config_store
+from app.nodes.classification import classify_input_node
+from app.nodes.bug_report import extract_bug_report
+from app.nodes.feature_request import extract_feature_request
+from app.nodes.general_inquiry import extract_general_inquiry
+from app.nodes.fused import RESPONSE_BUILDERS
+from app.utils.metrics import (
+    current_node,
+    instrument_node,
+    speculation_cancelled_tokens,
+    speculation_wasted_tokens,
+    speculations,
+    track_llm_usage,
+)
+from app.utils.streaming import llm_partials
+from app.utils.speculation import class_priors
+from app.utils.preprocessing import prompt_message
+
+# The extraction node of each class, and the LLM call it makes.
+EXTRACTIONS = {
+    "bug_report": ("bug_extraction", extract_bug_report),
+    "feature_request": ("feature_extraction", extract_feature_request),
+    "general_inquiry": ("inquiry_extraction", extract_general_inquiry),
+}
+
+logger = logging.getLogger(__name__)
+
+# Timed and labelled as its own node, although it runs within this one.
+classify = instrument_node("classify_input", classify_input_node)
+
+
+async def _extract(classification: str, message: str, product: str, snapshot) -> dict:
+    node, extract = EXTRACTIONS[classification]
+    current_node.set(node)
+    # Not token-streamed, as the output may be discarded.
+    llm_partials.set(None)
+    return await extract(message, product, snapshot)
+
+
+async def speculative_extraction_node(state: dict) -> dict:
+    """
+    Classifies the customer message while already extracting the details of its most
+    likely class (see ClassPriors.guess), if that class is at least
+    "graph.speculation.min_probability" likely. When the classification agrees, the
+    ticket/response is built from the speculative extraction; otherwise the extraction
+    is cancelled and only the classification is returned, so the graph runs the right
+    extraction node. Only the LLM call is speculative: tickets are built after the
+    classification is known.
+    """
+    message = prompt_message(state)
+    product = state.get("product", "")
+
+    snapshot = config_store.snapshot()
+    if not snapshot.has_product(product):
+        return await classify(state)
+
+    guessed, probability = class_priors.guess(product, message)
+    min_probability = (
+        snapshot.get("graph", {}).get("speculation", {}).get("min_probability", 0.5)
+    )
+    if probability < min_probability:
+        speculations.inc(product=product, outcome="skipped")
+        return await classify(state)
+
+    # The extraction task inherits the usage tracking, so its tokens are counted apart.
+    with track_llm_usage() as usage:
+        extraction = asyncio.create_task(_extract(guessed, message, product, snapshot))
+    try:
+        classified = await classify(state)
+    except BaseException:
+        extraction.cancel()
+        raise
+
+    if classified["classification"] == guessed:
+        speculations.inc(product=product, outcome="hit")
+        data = await extraction
+        # Bug reports also pass the message, so duplicates are attached to existing tickets.
+        extra = {"message": message} if guessed == "bug_report" else {}
+        node_output = await RESPONSE_BUILDERS[guessed](data, product, snapshot, **extra)
+        return {**classified, **node_output}
+
+    extraction.cancel()
+    await asyncio.gather(extraction, return_exceptions=True)
+    speculations.inc(product=product, outcome="miss")
+    speculation_wasted_tokens.inc(
+        usage["prompt_tokens"], product=product, kind="prompt"
+    )
+    speculation_cancelled_tokens.inc(usage["cancelled_prompt_tokens"], product=product)
+    speculation_wasted_tokens.inc(
+        usage["completion_tokens"], product=product, kind="completion"
+    )
+    logger.info(
+        f"Speculated {guessed} but classified {classified['classification']}, "
+        "running the right extraction"
+    )
+    return classified
@@ -0,0 +1,203 @@
+"""
+Pre-fork multi-worker server: binds the listening socket once and forks `--workers`
+uvicorn worker processes that all accept connections from it, so one container uses
+every core. A worker that dies is restarted; SIGTERM or SIGINT stops them all, giving
+in-flight requests up to "server.graceful_timeout_seconds" to finish.
+
+    python -m app.server --workers 4 --host 0.0.0.0 --port 8000
+
+What the workers must agree on lives in local SQLite files: ticket IDs, the ticket store
+and the job queue, the response cache (with "cache.backend" set to "sqlite"), and the
+LLM rate limits and metrics (app.utils.shared_state).
+"""
+
+import argparse
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from multiprocessing.connection import wait
+
+from app.config import config_store
+from app.utils import shared_state
+from app.utils.shared_state import WORKER_ID_ENV, SharedStateStore, shared_state_path
+
+logger = logging.getLogger(__name__)
+
+# Imported once by the launcher and shared copy-on-write by the workers it forks. Only
+# third-party modules: the app's own modules open SQLite connections on import, and a
+# connection must not be carried across a fork.
+PRELOAD_MODULES = (
+    "fastapi",
+    "pydantic",
+    "uvicorn",
+    "httpx",
+    "openai",
+    "langgraph.graph",
+)
+# A worker that exits sooner than this after it started is restarted only after this
+# long, so a deployment that cannot start does not fork in a tight loop.
+MIN_WORKER_UPTIME = 1.0
+
+
+def check_shared_state(snapshot, workers: int) -> list[str]:
+    """
+    Checks that `workers` processes can share the configured state. Raises ValueError
+    for state that would go wrong, and returns warnings for state kept per worker.
+    """
+    if workers < 2:
+        return []
+    if snapshot.get("ticket_ids", {}).get("backend", "memory") != "sqlite":
+        raise ValueError(
+            'Several workers need "ticket_ids.backend": "sqlite", '
+            "or they hand out the same ticket IDs"
+        )
+    warnings = []
+    cache = snapshot.get("cache", {})
+    if cache.get("enabled", False) and cache.get("backend", "memory") == "memory":
+        warnings.append(
+            'Each worker keeps its own response cache; set "cache.backend" to "sqlite" '
+            "to share it"
+        )
+    if snapshot.get("bug_dedup", {}).get("enabled", False):
+        warnings.append(
+            "Duplicate bug reports are only detected among those one worker has seen"
+        )
+    if not snapshot.get("config_reload", {}).get("watch", False):
+        warnings.append(
+            "POST /admin/reload-config reloads only the worker that answers it; "
+            'set "config_reload.watch" to reload every worker'
+        )
+    return warnings
+
+
+def preload():
+    for module in PRELOAD_MODULES:
+        importlib.import_module(module)
+    # Imported by the SDK on the first structured output call (see preload_sdk).
+    from openai.resources.beta import AsyncBeta  # noqa: F401
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    return sock
+
+
+def run_worker(sock: socket.socket, worker: int, workers: int, log_level: str):
+    # Until uvicorn installs its own handlers, a signal must not reach the launcher's.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    # A single worker has nothing to share, and keeps its rate limits in process.
+    if workers > 1:
+        os.environ[WORKER_ID_ENV] = str(worker)
+        # Imported by the launcher, which is not a worker and so has no store.
+        shared_state.shared_state = shared_state.create_shared_state_store(
+            config_store.snapshot().get("server", {})
+        )
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config("app.main:app", log_level=log_level))
+    server.run(sockets=[sock])
+    if not server.started:
+        sys.exit(3)
+
+
+def serve(workers: int, host: str, port: int, log_level: str = "info"):
+    snapshot = config_store.snapshot()
+    for warning in check_shared_state(snapshot, workers):
+        logger.warning(warning)
+    server_config = snapshot.get("server", {})
+    if workers > 1:
+        # Closed again before forking, like every other connection the launcher opens.
+        store = SharedStateStore(shared_state_path(server_config))
+        store.reset()
+        store.close()
+    preload()
+    sock = bind_socket(host, port)
+    context = multiprocessing.get_context("fork")
+    processes = {}
+    stopping = False
+
+    def start(worker: int):
+        process = context.Process(
+            target=run_worker,
+            args=(sock, worker, workers, log_level),
+            name=f"worker-{worker}",
+        )
+        process.start()
+        processes[worker] = (process, time.monotonic())
+        logger.info(f"Started worker {worker} (pid {process.pid})")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info(f"Serving on http://{host}:{port} with {workers} workers")
+    for worker in range(workers):
+        start(worker)
+
+    while not stopping:
+        wait([process.sentinel for process, _ in processes.values()], timeout=0.5)
+        for worker, (process, started) in list(processes.items()):
+            if stopping or process.is_alive():
+                continue
+            logger.error(
+                f"Worker {worker} (pid {process.pid}) exited with code "
+                f"{process.exitcode}, restarting it"
+            )
+            if time.monotonic() - started < MIN_WORKER_UPTIME:
+                time.sleep(MIN_WORKER_UPTIME)
+            start(worker)
+
+    logger.info("Shutting down workers")
+    for process, _ in processes.values():
+        if process.is_alive():
+            process.terminate()
+    deadline = time.monotonic() + server_config.get("graceful_timeout_seconds", 30)
+    for process, _ in processes.values():
+        process.join(max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            logger.warning(f"Worker pid {process.pid} did not stop in time, killing it")
+            process.kill()
+            process.join()
+    sock.close()
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0].replace("\n", " ")
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help='Worker processes (default: "server.workers"; 0 for one per CPU core)',
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    workers = args.workers
+    if workers is None:
+        workers = config_store.snapshot().get("server", {}).get("workers", 1)
+    try:
+        serve(workers or os.cpu_count() or 1, args.host, args.port, args.log_level)
+    except ValueError as e:
+        parser.exit(2, f"{parser.prog}: error: {e}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,92 @@
 import sys
 import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import json
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+import httpx
 import pytest
 from pydantic import BaseModel
 from fastapi.testclient import TestClient
 
 # Ensure the project root is on PYTHONPATH so `main` can be imported
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+# Stores created when the app is imported keep their files in a scratch directory, not
+# data/ (see also isolate_data_files).
+os.environ["AGENT_DATA_ROOT"] = tempfile.mkdtemp(prefix="agent-tests-")
 
+import app.main as app_main
 from app.main import app
-from app.utils.LLM import LLMClient
-from app.nodes.classification import classify_input_node
+from app.utils.LLM import LLMClient, close_llm_client, get_llm_client
+from app.nodes.classification import (
+    classify_batch,
+    classify_input_node,
+    ClassificationModel,
+)
+from app.nodes.bug_report import BugReportModel
+from app.nodes.fused import FusedModel
+from app.benchmarks.mock_llm import (
+    LATENCY_DISTRIBUTIONS,
+    MockLLMServer,
+    create_mock_app,
+    sample_latency,
+)
+from app.benchmarks.startup import measure_first_request, measure_import
+from app.benchmarks.worker_scaling import running_server
+from app.cli import process_file
+from app.nodes.pre_classification import _shadow_checks, pre_classify_node
+from app.utils.pre_classifier import (
+    FastPathStats,
+    LabelLog,
+    RuleBasedPreClassifier,
+    log_llm_label,
+)
+from app.utils.prompts import PromptRegistry
+from app.config import ConfigSnapshot, ConfigStore, config, config_store, load_config
+from app.utils.ticket_ids import (
+    BlockLeasingTicketIdAllocator,
+    SQLiteTicketIdAllocator,
+    TicketIdService,
+    create_ticket_id_service,
+)
+from app.utils.singleflight import SingleFlight
+from app.utils.jobs import JobWorkerPool, SQLiteJobQueue
+from app.utils.dedup import BugReportIndex
+from app.utils.ticket_store import (
+    SQLiteTicketBackend,
+    TicketStore,
+    build_record,
+    create_ticket_store,
+)
+from app.utils.metrics import (
+    Counter,
+    Histogram,
+    MetricsRegistry,
+    llm_deadline_exceeded,
+    llm_escalations,
+    llm_hedges,
+    speculation_cancelled_tokens,
+    speculation_wasted_tokens,
+    speculations,
+    tickets_dropped,
+    track_llm_usage,
+)
+from app.utils.speculation import ClassPriors
+from app.utils.rate_limit import SharedRateLimiter
+from app.utils.shared_state import SharedStateStore
+from app.utils.batching import MicroBatcher
+from app.utils.preprocessing import preprocess_message
+from app.utils.cache import (
+    InMemoryLRUCache,
+    ResponseCache,
+    SQLiteCache,
+    normalize_message,
+)
 
 
 # Dummy classification model for testing
@@ -30,7 +107,7 @@ class DummyBugReport(BaseModel):
 def patch_llm(monkeypatch):
     """Always return a predictable model from LLMClient.parse"""
 
-    def fake_parse(*args, **kwargs):
+    async def fake_parse(*args, **kwargs):
         # Ensure that the 'messages' argument is passed in correctly
         messages = kwargs.get("messages", [])
         model = kwargs.get("model", None)
@@ -62,6 +139,33 @@ def patch_llm(monkeypatch):
     monkeypatch.setattr(LLMClient, "parse", fake_parse)
 
 
+@pytest.fixture(autouse=True)
+def isolate_data_files(tmp_path, monkeypatch):
+    """
+    Points the ticket store, ticket IDs and job queue at files in tmp_path, so tests never
+    touch the real data/ files (or run jobs queued there).
+    """
+    ticket_store_config = {
+        **config.get("ticket_store", {}),
+        "sqlite_path": str(tmp_path / "tickets.sqlite3"),
+    }
+    store = create_ticket_store(ticket_store_config)
+    monkeypatch.setattr("app.main.ticket_store", store)
+    monkeypatch.setattr("app.cli.ticket_store", store)
+    ticket_ids = create_ticket_id_service(
+        {**config.get("ticket_ids", {}), "sqlite_path": str(tmp_path / "ids.sqlite3")}
+    )
+    monkeypatch.setattr("app.nodes.bug_report.ticket_ids", ticket_ids)
+    monkeypatch.setattr("app.nodes.feature_request.ticket_ids", ticket_ids)
+    create_job_worker_pool = app_main.create_job_worker_pool
+    monkeypatch.setattr(
+        "app.main.create_job_worker_pool",
+        lambda jobs_config, run: create_job_worker_pool(
+            {**jobs_config, "sqlite_path": str(tmp_path / "jobs.sqlite3")}, run
+        ),
+    )
+
+
 @pytest.mark.asyncio
 async def test_classify_node():
     state = {
@@ -107,6 +211,1596 @@ def test_invalid_product():
     assert response.json()["customer_response"] == "Invalid Product Name"
 
 
+@pytest.mark.asyncio
+async def test_llm_client_runs_calls_concurrently(monkeypatch):
+    # Exercise the real client against the in-process mock LLM server.
+    monkeypatch.undo()
+    monkeypatch.setenv("OPENAI_API_KEY", "mock")
+    llm_client = mock_llm_client(create_mock_app(latency=0.2), max_concurrency=10)
+    messages = [{"role": "user", "content": 'Customer message: "It crashes"'}]
+    # The first call pays one-off client initialisation, keep it out of the timing.
+    await llm_client.parse(
+        model="mock", messages=messages, response_format=ClassificationModel
+    )
+
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(
+            llm_client.parse(
+                model="mock", messages=messages, response_format=ClassificationModel
+            )
+            for _ in range(10)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    await llm_client.aclose()
+
+    assert all(r.classification == "bug_report" for r in results)
+    # Ten sequential calls would take at least 2 seconds.
+    assert elapsed < 1.0
+
+
+@pytest.mark.parametrize("distribution", LATENCY_DISTRIBUTIONS)
+def test_mock_latency_distributions_keep_the_configured_mean(distribution):
+    rng = random.Random(0)
+    samples = [sample_latency(rng, 0.2, distribution, 0.5) for _ in range(20000)]
+    assert min(samples) >= 0
+    assert statistics.mean(samples) == pytest.approx(0.2, rel=0.05)
+
+
+def mock_llm_client(mock_app, **kwargs) -> LLMClient:
+    """Builds a real LLMClient that talks to the in-process mock LLM server."""
+    http_client = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=mock_app), base_url="http://mock"
+    )
+    llm_client = LLMClient(http_client=http_client, **kwargs)
+    llm_client.client = llm_client.client.with_options(base_url="http://mock/v1")
+    return llm_client
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("client_limit", [None, 360])
+async def test_llm_client_retries_and_paces_rate_limited_calls(
+    monkeypatch, client_limit
+):
+    monkeypatch.undo()
+    monkeypatch.setenv("OPENAI_API_KEY", "mock")
+    mock_app = create_mock_app(latency=0, requests_per_second=10)
+    rate_limits = (
+        {"mock": {"requests_per_minute": client_limit, "burst_seconds": 0.5}}
+        if client_limit
+        else {}
+    )
+    llm_client = mock_llm_client(mock_app, max_retries=5, rate_limits=rate_limits)
+    llm_client.backoff_base = 0.05
+    messages = [{"role": "user", "content": 'Customer message: "It crashes"'}]
+
+    results = await asyncio.gather(
+        *(
+            llm_client.parse(
+                model="mock", messages=messages, response_format=ClassificationModel
+            )
+            for _ in range(14)
+        )
+    )
+    await llm_client.aclose()
+
+    assert all(r.classification == "bug_report" for r in results)
+    if client_limit:
+        # Paced below the provider's limit, so nothing is rejected.
+        assert mock_app.state.rate_limited == 0
+    else:
+        # Rejected calls waited for Retry-After and succeeded on retry.
+        assert mock_app.state.rate_limited > 0
+
+
+def test_saturated_llm_queue_returns_503(monkeypatch):
+    monkeypatch.undo()
+    monkeypatch.setenv("OPENAI_API_KEY", "mock")
+    monkeypatch.setattr(
+        "app.utils.LLM.response_cache", ResponseCache(InMemoryLRUCache())
+    )
+
+    def saturated_client():
+        llm_client = mock_llm_client(create_mock_app(latency=0))
+        llm_client.max_queued_calls = 0
+        return llm_client
+
+    monkeypatch.setattr("app.utils.LLM.LLMClient", saturated_client)
+    payload = {"customer_id": "u1", "message": "It crashes", "product": "MobileApp"}
+
+    with TestClient(app) as client:
+        response = client.post("/process-customer-message", json=payload)
+
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_request_deadline_degrades_to_human_review(monkeypatch):
+    monkeypatch.undo()
+    monkeypatch.setenv("OPENAI_API_KEY", "mock")
+    monkeypatch.setattr(
+        "app.utils.LLM.response_cache", ResponseCache(InMemoryLRUCache())
+    )
+    monkeypatch.setattr(
+        "app.utils.LLM.LLMClient", lambda: mock_llm_client(create_mock_app(latency=2))
+    )
+    payload = {
+        "customer_id": "u1",
+        "message": "Where can I see my invoices?",
+        "product": "MobileApp",
+    }
+    exceeded = llm_deadline_exceeded.value(node="inquiry_extraction")
+
+    with TestClient(app) as client:
+        start = time.perf_counter()
+        response = client.post(
+            "/process-customer-message",
+            json=payload,
+            headers={"X-Request-Timeout": "0.2"},
+        )
+        elapsed = time.perf_counter() - start
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["message_type"] == "general_inquiry"
+    assert body["response_data"]["inquiry_category"] == "Other"
+    assert body["response_data"]["requires_human_review"] is True
+    assert llm_deadline_exceeded.value(node="inquiry_extraction") == exceeded + 1
+    assert elapsed < 1.5
+
+
+@pytest.mark.asyncio
+async def test_slow_llm_call_is_hedged(monkeypatch):
+    monkeypatch.undo()
+    monkeypatch.setenv("OPENAI_API_KEY", "mock")
+    mock_app = create_mock_app(latency=0)
+    llm_client = mock_llm_client(
+        mock_app, hedging={"enabled": True, "percentile": 95, "min_samples": 5}
+    )
+    messages = [{"role": "user", "content": 'Customer message: "It crashes"'}]
+    for _ in range(5):
+        await llm_client.parse(
+            model="mock", messages=messages, response_format=ClassificationModel
+        )
+
+    # The next request stalls before reaching the provider; its hedge does not.
+    call = llm_client._call
+    stalled = [True]
+
+    async def stall_once(*args):
+        if stalled:
+            stalled.pop()
+            await asyncio.sleep(5)
+        return await call(*args)
+
+    llm_client._call = stall_once
+    won = llm_hedges.value(model="mock", outcome="won")
+    start = time.perf_counter()
+    result = await llm_client.parse(
+        model="mock", messages=messages, response_format=ClassificationModel
+    )
+    elapsed = time.perf_counter() - start
+    await llm_client.aclose()
+
+    assert result.classification == "bug_report"
+    assert elapsed < 1.0
+    assert llm_hedges.value(model="mock", outcome="won") == won + 1
+    assert mock_app.state.requests == 6
+
+
+@pytest.mark.asyncio
+async def test_model_router_escalates_low_confidence_and_parse_failures(monkeypatch):
+    raw = load_config()
+    raw["model_routing"]["enabled"] = True
+    raw["model_routing"]["rules"]["products"] = {
+        "WebApp": {"classify_input": {"start_tier": "strong"}}
+    }
+    snapshot = ConfigSnapshot(raw, version=0)
+    fast, strong = (tier["model"] for tier in raw["model_routing"]["tiers"])
+    answers = {}
+    calls = []
+
+    async def fake_parse(self, model, messages, response_format, cache_key=None):
+        calls.append((model, cache_key))
+        answer = answers[model]
+        if isinstance(answer, Exception):
+            raise answer
+        return DummyClassification(classification="bug_report", confidence_score=answer)
+
+    monkeypatch.setattr(LLMClient, "parse", fake_parse)
+
+    async def route(message, product="MobileApp"):
+        calls.clear()
+        await LLMClient().parse_routed(
+            node="classify_input",
+            product=product,
+            message=message,
+            messages=[],
+            response_format=DummyClassification,
+            cache_key=lambda model: f"key-{model}",
+            snapshot=snapshot,
+        )
+        return [model for model, _ in calls]
+
+    answers.update({fast: 0.95, strong: 0.99})
+    assert await route("It crashes") == [fast]
+    assert calls == [(fast, f"key-{fast}")]
+    # Long messages and per-product rules start on the strong tier.
+    assert await route("It crashes. " * 100) == [strong]
+    assert await route("It crashes", product="WebApp") == [strong]
+
+    escalations = llm_escalations.value(
+        node="classify_input", from_tier="fast", reason="low_confidence"
+    )
+    answers[fast] = 0.5
+    assert await route("It crashes") == [fast, strong]
+    assert (
+        llm_escalations.value(
+            node="classify_input", from_tier="fast", reason="low_confidence"
+        )
+        == escalations + 1
+    )
+    answers[fast] = ValueError("invalid JSON")
+    assert await route("It crashes") == [fast, strong]
+
+
+def wait_until_ready(client: TestClient, timeout: float = 30) -> dict:
+    deadline = time.monotonic() + timeout
+    while (response := client.get("/ready")).status_code != 200:
+        assert response.json()["status"] == "starting"
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return response.json()
+
+
+def test_lifespan_shares_one_llm_client():
+    async def current_client():
+        return get_llm_client()
+
+    with TestClient(app) as client:
+        wait_until_ready(client)
+        llm_client = app.state.llm_client
+        assert client.portal.call(current_client) is llm_client
+        client.post(
+            "/process-customer-message",
+            json={"customer_id": "u1", "message": "Hi", "product": "MobileApp"},
+        )
+        assert client.portal.call(current_client) is llm_client
+
+
+def test_cold_start_defers_heavy_imports_to_the_warm_up():
+    imported = measure_import("app.main")
+    # The graph, the nodes and the OpenAI SDK (seconds of imports) are not loaded yet;
+    # checked in sys.modules rather than timed, which would depend on the machine.
+    assert imported["loaded"] == []
+
+    with MockLLMServer(latency=0) as llm:
+        startup = measure_first_request(llm.base_url)
+    # The server accepts connections before the warm-up is done; the first message
+    # waits for it instead of failing.
+    assert startup["listening"] < startup["first_response"] <= startup["ready"]
+    assert startup["warm_up"] > 0
+
+
+def test_fused_mode_single_call(monkeypatch):
+    calls = []
+
+    async def fake_fused_parse(*args, **kwargs):
+        calls.append(kwargs["response_format"])
+        return FusedModel.model_validate(
+            {
+                "result": {
+                    "classification": "general_inquiry",
+                    "confidence_score": 0.95,
+                    "details": {
+                        "inquiry_category": "Billing",
+                        "requires_human_review": False,
+                    },
+                }
+            }
+        )
+
+    monkeypatch.setattr(LLMClient, "parse", fake_fused_parse)
+    payload = {
+        "customer_id": "u1",
+        "message": "How much does the premium plan cost?",
+        "product": "MobileApp",
+        "mode": "fused",
+    }
+
+    with TestClient(app) as client:
+        response = client.post("/process-customer-message", json=payload)
+
+    body = response.json()
+    assert calls == [FusedModel]
+    assert body["message_type"] == "general_inquiry"
+    assert body["response_data"]["inquiry_category"] == "Billing"
+
+
+def test_fused_mode_falls_back_to_two_step():
+    # The default fake LLM cannot answer the fused schema, which must fall back.
+    payload = {
+        "customer_id": "u1",
+        "message": "I can't log in to the application",
+        "product": "MobileApp",
+        "mode": "fused",
+    }
+
+    with TestClient(app) as client:
+        response = client.post("/process-customer-message", json=payload)
+
+    body = response.json()
+    assert body["message_type"] == "bug_report"
+    assert "ticket" in body["response_data"]
+
+
+def test_class_priors_learn_from_classifications(monkeypatch):
+    monkeypatch.setattr("app.utils.speculation.pre_classifier", None)
+    priors = ClassPriors(
+        {"MobileApp": {"bug_report": 0.7, "general_inquiry": 0.3}},
+        window_size=50,
+        prior_weight=10,
+    )
+    assert priors.guess("MobileApp", "Hello") == ("bug_report", 0.7)
+
+    for _ in range(50):
+        priors.observe("MobileApp", "feature_request")
+    label, probability = priors.guess("MobileApp", "Hello")
+    assert label == "feature_request" and probability == pytest.approx(50 / 60)
+    assert priors.guess("WebApp", "Hello")[1] == pytest.approx(1 / 3)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_llm_calls_are_counted_apart(monkeypatch):
+    monkeypatch.undo()
+    monkeypatch.setenv("OPENAI_API_KEY", "mock")
+    llm_client = mock_llm_client(create_mock_app(latency=1))
+    messages = [{"role": "user", "content": 'Customer message: "It crashes"'}]
+
+    with track_llm_usage() as usage:
+        call = asyncio.create_task(
+            llm_client.parse(
+                model="mock", messages=messages, response_format=ClassificationModel
+            )
+        )
+    await asyncio.sleep(0.1)
+    call.cancel()
+    await asyncio.gather(call, return_exceptions=True)
+    await llm_client.aclose()
+
+    assert usage["cancelled_prompt_tokens"] > 0
+    assert usage["prompt_tokens"] == usage["completion_tokens"] == 0
+
+
+def test_speculative_mode_uses_right_guesses_and_cancels_wrong_ones(monkeypatch):
+    monkeypatch.undo()
+    monkeypatch.setenv("OPENAI_API_KEY", "mock")
+    monkeypatch.setattr(
+        "app.utils.LLM.response_cache", ResponseCache(InMemoryLRUCache())
+    )
+    monkeypatch.setattr(
+        "app.nodes.bug_report.bug_report_index", BugReportIndex(enabled=False)
+    )
+    monkeypatch.setattr("app.utils.speculation.pre_classifier", None)
+    monkeypatch.setattr(
+        "app.nodes.speculative.class_priors",
+        ClassPriors({"MobileApp": {"bug_report": 1.0}}),
+    )
+    mock_app = create_mock_app(latency=0.05)
+    monkeypatch.setattr("app.utils.LLM.LLMClient", lambda: mock_llm_client(mock_app))
+    payload = {"customer_id": "u1", "product": "MobileApp", "mode": "speculative"}
+    hits = speculations.value(product="MobileApp", outcome="hit")
+    misses = speculations.value(product="MobileApp", outcome="miss")
+
+    def wasted_prompt_tokens():
+        return speculation_wasted_tokens.value(
+            product="MobileApp", kind="prompt"
+        ) + speculation_cancelled_tokens.value(product="MobileApp")
+
+    wasted = wasted_prompt_tokens()
+
+    with TestClient(app) as client:
+        bug = client.post(
+            "/process-customer-message",
+            json={**payload, "message": "The app crashes when I open my profile"},
+        ).json()
+        calls_for_bug = mock_app.state.requests
+        inquiry = client.post(
+            "/process-customer-message",
+            json={**payload, "message": "Where can I see my invoices?"},
+        ).json()
+
+    assert bug["message_type"] == "bug_report" and "ticket" in bug["response_data"]
+    assert calls_for_bug == 2
+    assert inquiry["message_type"] == "general_inquiry"
+    assert "inquiry_category" in inquiry["response_data"]
+    assert speculations.value(product="MobileApp", outcome="hit") == hits + 1
+    assert speculations.value(product="MobileApp", outcome="miss") == misses + 1
+    assert wasted_prompt_tokens() > wasted
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_flushes_on_size_and_wait():
+    batches = []
+
+    async def run_batch(key, items):
+        batches.append((key, list(items)))
+        if "bad" in items:
+            raise RuntimeError("batch failed")
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher("test", run_batch, max_batch_size=3, max_wait=0.01)
+    results = await asyncio.gather(
+        *(batcher.submit("k", item) for item in "abcd"), batcher.submit("other", "e")
+    )
+    failed = await asyncio.gather(
+        batcher.submit("k", "bad"), batcher.submit("k", "f"), return_exceptions=True
+    )
+
+    assert results == ["A", "B", "C", "D", "E"]
+    assert batches[:3] == [("k", ["a", "b", "c"]), ("k", ["d"]), ("other", ["e"])]
+    assert all(isinstance(result, RuntimeError) for result in failed)
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_never_leaves_a_waiter_hanging():
+    started = asyncio.Event()
+
+    async def run_batch(key, items):
+        if key == "short":
+            return items[:1]
+        started.set()
+        await asyncio.sleep(60)
+
+    batcher = MicroBatcher("test", run_batch, max_wait=0.01)
+    short = await asyncio.wait_for(
+        asyncio.gather(
+            batcher.submit("short", "a"),
+            batcher.submit("short", "b"),
+            return_exceptions=True,
+        ),
+        5,
+    )
+    waiters = asyncio.gather(
+        batcher.submit("slow", "a"), batcher.submit("slow", "b"), return_exceptions=True
+    )
+    await asyncio.wait_for(started.wait(), 5)
+    for task in list(batcher._running):
+        task.cancel()
+    interrupted = await asyncio.wait_for(waiters, 5)
+
+    assert all(isinstance(result, RuntimeError) for result in short)
+    assert all(isinstance(result, RuntimeError) for result in interrupted)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_classifications_share_one_batched_call(monkeypatch):
+    monkeypatch.undo()
+    monkeypatch.setenv("OPENAI_API_KEY", "mock")
+    monkeypatch.setattr(
+        "app.utils.LLM.response_cache", ResponseCache(InMemoryLRUCache())
+    )
+    monkeypatch.setattr(
+        "app.nodes.classification.response_cache", ResponseCache(InMemoryLRUCache())
+    )
+    monkeypatch.setattr(
+        "app.nodes.classification.classification_batcher",
+        MicroBatcher("classify_input", classify_batch, max_wait=0.05),
+    )
+    mock_app = create_mock_app(latency=0.01)
+    monkeypatch.setattr("app.utils.LLM.LLMClient", lambda: mock_llm_client(mock_app))
+    messages = [
+        "The app crashes when I open my profile",
+        "Could you add a dark mode?",
+        "Where can I see my invoices?",
+    ] * 3
+
+    results = await asyncio.gather(
+        *(
+            classify_input_node({"message": message, "product": "MobileApp"})
+            for message in messages
+        )
+    )
+    await close_llm_client()
+
+    assert [result["classification"] for result in results] == [
+        "bug_report",
+        "feature_request",
+        "general_inquiry",
+    ] * 3
+    assert mock_app.state.requests == 1
+
+
+def test_preprocess_message_drops_history_signature_and_log_noise():
+    raw = load_config()
+    raw["preprocessing"] = {
+        "max_message_tokens": 20,
+        "log_head_lines": 2,
+        "log_tail_lines": 1,
+        "products": {"WebApp": {"max_message_tokens": 1000}},
+    }
+    snapshot = ConfigSnapshot(raw, version=0)
+    trace = "\n".join(f"    at com.app.Sync.run(Sync.java:{n})" for n in range(40))
+    message = (
+        "Sync fails every time I open the app:\n"
+        f"{trace}\n\n"
+        "Best regards,\nJane Doe\nACME Corp\n\n"
+        "On Mon, Jan 6, 2025 at 9:00 AM Support <support@example.com> wrote:\n"
+        "> Could you send us the error?\n> Thanks"
+    )
+
+    cleaned = preprocess_message(message, "WebApp", snapshot)
+    assert cleaned.text.startswith("Sync fails every time I open the app:")
+    assert "Sync.java:0)" in cleaned.text and "Sync.java:39)" in cleaned.text
+    assert "[... 37 log lines omitted ...]" in cleaned.text
+    assert "Jane Doe" not in cleaned.text and "send us the error" not in cleaned.text
+    assert not cleaned.truncated
+    assert cleaned.tokens_saved > 0
+
+    truncated = preprocess_message(message, "MobileApp", snapshot)
+    assert truncated.truncated and truncated.text.endswith("[... truncated]")
+    assert truncated.tokens <= 20 + 5
+    # Nothing left after cleaning: the message is kept as it is.
+    assert preprocess_message("> quoted", "WebApp", snapshot).text == "> quoted"
+
+
+def test_preprocess_message_keeps_content_after_sign_off_like_lines():
+    snapshot = ConfigSnapshot(load_config(), version=0)
+    kept = [
+        "The app closes itself.\nThis message is shown: E500",
+        "I tap login, then it fails.\nThanks,\nSteps: tap login",
+        "Sync fails.\nRegards,\nJane\nIt also fails on the web app.",
+    ]
+    for message in kept:
+        assert preprocess_message(message, "WebApp", snapshot).text == message
+
+    stripped = [
+        "Sync fails.\n\nBest regards,\nJane Doe\nHead of IT, ACME Corp\n+1 (555) 010-0199",
+        "Sync fails.\nThanks!\nJane\n\nSent from my iPhone",
+        "Sync fails.\n-- \nJane Doe | ACME\njane@acme.example\n\n"
+        "This email and any attachments are intended solely for the addressee. "
+        "If you received it in error, delete it.",
+    ]
+    for message in stripped:
+        assert preprocess_message(message, "WebApp", snapshot).text == "Sync fails."
+
+
+def test_prompts_get_the_clean_message_and_tickets_the_original(tmp_path, monkeypatch):
+    store = TicketStore(SQLiteTicketBackend(str(tmp_path / "tickets.sqlite3")))
+    monkeypatch.setattr("app.main.ticket_store", store)
+    monkeypatch.setattr(
+        "app.nodes.bug_report.bug_report_index", BugReportIndex(enabled=False)
+    )
+    original_parse = LLMClient.parse
+    prompts = []
+
+    async def recording_parse(self, **kwargs):
+        prompts.append(kwargs["messages"][-1]["content"])
+        return await original_parse(self, **kwargs)
+
+    monkeypatch.setattr(LLMClient, "parse", recording_parse)
+    message = (
+        "I can't log in to the application since the update.\n\n"
+        "-----Original Message-----\nFrom: Support\nPlease describe the problem."
+    )
+
+    with TestClient(app) as client:
+        body = client.post(
+            "/process-customer-message",
+            json={"customer_id": "u1", "message": message, "product": "MobileApp"},
+        ).json()
+        client.portal.call(store.flush)
+        ticket_id = body["response_data"]["ticket"]["id"]
+        stored = client.get(f"/tickets/{ticket_id}").json()
+
+    assert prompts
+    assert all("since the update" in prompt for prompt in prompts)
+    assert not any("Original Message" in prompt for prompt in prompts)
+    assert stored["message"] == message
+
+
+def test_in_memory_cache_evicts_lru_and_expired():
+    cache = InMemoryLRUCache(max_size=2, ttl_seconds=60)
+    cache.set("a", {"v": 1})
+    cache.set("b", {"v": 2})
+    assert cache.get("a") == {"v": 1}
+    cache.set("c", {"v": 3})
+    # "b" was the least recently used entry.
+    assert cache.get("b") is None
+    assert cache.get("a") == {"v": 1}
+
+    expired = InMemoryLRUCache(max_size=2, ttl_seconds=-1)
+    expired.set("a", {"v": 1})
+    assert expired.get("a") is None
+
+
+def test_sqlite_cache_persists_and_evicts(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = SQLiteCache(path, max_size=2, ttl_seconds=60)
+    cache.set("a", {"v": 1})
+    cache.set("b", {"v": 2})
+    cache.set("c", {"v": 3})
+    assert len(cache) == 2
+
+    reopened = SQLiteCache(path, max_size=2, ttl_seconds=60)
+    assert reopened.get("c") == {"v": 3}
+    assert reopened.get("a") is None
+
+
+def test_cache_key_normalizes_message():
+    assert normalize_message("  Login is BROKEN!! ") == "login is broken"
+    key = ResponseCache.make_key(
+        "classify_input", "MobileApp", "Login is broken", "m", "1"
+    )
+    assert key == ResponseCache.make_key(
+        "classify_input", "MobileApp", "login  is broken!", "m", "1"
+    )
+    assert key != ResponseCache.make_key(
+        "classify_input", "WebApp", "Login is broken", "m", "1"
+    )
+    assert key != ResponseCache.make_key(
+        "classify_input", "MobileApp", "Login is broken", "m", "2"
+    )
+
+
+@pytest.mark.asyncio
+async def test_llm_client_serves_repeated_calls_from_cache(monkeypatch):
+    monkeypatch.undo()
+    monkeypatch.setenv("OPENAI_API_KEY", "mock")
+    cache = ResponseCache(InMemoryLRUCache())
+    monkeypatch.setattr("app.utils.LLM.response_cache", cache)
+    mock_app = create_mock_app(latency=0)
+    llm_client = mock_llm_client(mock_app)
+    messages = [{"role": "user", "content": 'Customer message: "It crashes"'}]
+    key = ResponseCache.make_key("classify_input", "MobileApp", "It crashes", "m", "1")
+
+    for _ in range(3):
+        result = await llm_client.parse(
+            model="m",
+            messages=messages,
+            response_format=ClassificationModel,
+            cache_key=key,
+        )
+        assert result.classification == "bug_report"
+    await llm_client.aclose()
+
+    assert mock_app.state.requests == 1
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_duplicate_calls_are_coalesced(monkeypatch):
+    monkeypatch.undo()
+    monkeypatch.setenv("OPENAI_API_KEY", "mock")
+    # Without a cache backend every duplicate would otherwise reach the LLM.
+    monkeypatch.setattr("app.utils.LLM.response_cache", ResponseCache())
+    flight = SingleFlight()
+    monkeypatch.setattr("app.utils.LLM.single_flight", flight)
+    mock_app = create_mock_app(latency=0.1)
+    llm_client = mock_llm_client(mock_app)
+    messages = [{"role": "user", "content": 'Customer message: "Login is broken"'}]
+    key = ResponseCache.make_key(
+        "classify_input", "MobileApp", "Login is broken", "m", "1"
+    )
+
+    results = await asyncio.gather(
+        *(
+            llm_client.parse(
+                model="m",
+                messages=messages,
+                response_format=ClassificationModel,
+                cache_key=key,
+            )
+            for _ in range(20)
+        )
+    )
+    await llm_client.aclose()
+
+    assert all(r.classification == "bug_report" for r in results)
+    assert mock_app.state.requests == 1
+    assert flight.stats() == {"calls": 1, "coalesced": 19, "in_flight": 0}
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_exceptions():
+    flight = SingleFlight()
+
+    async def failing_call():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("rate limited")
+
+    results = await asyncio.gather(
+        *(flight.do("key", failing_call) for _ in range(3)), return_exceptions=True
+    )
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert flight.stats()["calls"] == 1
+
+
+def test_bug_ticket_ids_are_fresh_on_cache_hit(monkeypatch):
+    monkeypatch.undo()
+    monkeypatch.setenv("OPENAI_API_KEY", "mock")
+    cache = ResponseCache(InMemoryLRUCache())
+    monkeypatch.setattr("app.utils.LLM.response_cache", cache)
+    # Repeated reports would otherwise be attached to the first ticket.
+    monkeypatch.setattr(
+        "app.nodes.bug_report.bug_report_index", BugReportIndex(enabled=False)
+    )
+    mock_app = create_mock_app(latency=0)
+    monkeypatch.setattr("app.utils.LLM.LLMClient", lambda: mock_llm_client(mock_app))
+    payload = {
+        "customer_id": "u1",
+        "message": "The app crashes when I log in",
+        "product": "MobileApp",
+    }
+
+    with TestClient(app) as client:
+        first = client.post("/process-customer-message", json=payload).json()
+        second = client.post("/process-customer-message", json=payload).json()
+
+    assert mock_app.state.requests == 2
+    assert cache.stats()["hits"] == 2
+    assert (
+        first["response_data"]["ticket"]["id"]
+        != second["response_data"]["ticket"]["id"]
+    )
+
+
+def test_bug_report_index_matches_near_duplicates_within_window():
+    index = BugReportIndex(window_size=2)
+    index.add("MobileApp", "The app crashes when I open my profile", {"id": "BUG-1"})
+
+    duplicate = index.attach(
+        "MobileApp", "the app crashes when I open my profile!! (order #4711)"
+    )
+    assert duplicate == {"id": "BUG-1", "report_count": 2}
+    assert index.attach("MobileApp", "Photo upload fails with an error") is None
+    assert index.attach("WebApp", "The app crashes when I open my profile") is None
+
+    index.add("MobileApp", "Photo upload fails with an error", {"id": "BUG-2"})
+    index.add("MobileApp", "Notifications arrive twice", {"id": "BUG-3"})
+    # Only the last `window_size` tickets are kept.
+    assert len(index) == 2
+    assert index.attach("MobileApp", "The app crashes when I open my profile") is None
+
+
+def test_bug_report_index_keeps_error_codes_apart():
+    index = BugReportIndex()
+    index.add("WebApp", "Login fails with error 500 on Android", {"id": "BUG-1"})
+    # Same wording, but another error code and platform: another bug.
+    assert index.attach("WebApp", "Login fails with error 401 on iOS") is None
+    assert index.attach("WebApp", "Login fails with error 500 on Android 14") == {
+        "id": "BUG-1",
+        "report_count": 2,
+    }
+
+
+def test_duplicate_bug_reports_skip_extraction(monkeypatch):
+    monkeypatch.setattr("app.nodes.bug_report.bug_report_index", BugReportIndex())
+    calls = []
+
+    async def fake_parse(self, model, messages, response_format, cache_key=None):
+        calls.append(response_format)
+        if response_format is ClassificationModel:
+            return ClassificationModel(classification="bug_report", confidence_score=1)
+        return DummyBugReport(
+            title="Crash", reproduction_steps=["Open"], affected_components=["UI"]
+        )
+
+    monkeypatch.setattr(LLMClient, "parse", fake_parse)
+    payload = {"customer_id": "u1", "product": "MobileApp"}
+
+    with TestClient(app) as client:
+        first = client.post(
+            "/process-customer-message",
+            json={**payload, "message": "The app crashes when I open my profile"},
+        ).json()
+        second = client.post(
+            "/process-customer-message",
+            json={**payload, "message": "the app crashes when i open my profile again"},
+        ).json()
+
+    ticket = first["response_data"]["ticket"]
+    # The first customer's ticket details are not shown to the second.
+    assert second["response_data"]["ticket"] == {"id": ticket["id"], "report_count": 2}
+    # Both were classified, but only the first report was extracted.
+    assert calls.count(BugReportModel) == 1
+
+
+def test_ticket_backend_filters_and_paginates(tmp_path):
+    backend = SQLiteTicketBackend(str(tmp_path / "tickets.sqlite3"))
+    records = []
+    for n in range(5):
+        ticket = {
+            "id": f"BUG-{n}",
+            "title": "Crash",
+            "affected_components": ["Authentication Module", "UI"],
+            "assigned_team": ["Auth Team", "UI Team"] if n % 2 else ["Core", "UI Team"],
+        }
+        record = build_record("u1", "MobileApp", {"ticket": ticket})
+        record["created_at"] = 1000.0 + n
+        records.append(record)
+    inquiry = build_record(
+        "u2", "WebApp", {"inquiry_category": "Billing", "requires_human_review": False}
+    )
+    backend.write(records + [inquiry], {"BUG-3": 4})
+
+    auth = backend.query(kind="bug_report", status="open", team="Auth Team")
+    assert [t["id"] for t in auth] == ["BUG-3", "BUG-1"]
+    assert auth[0]["report_count"] == 4
+    assert [t["id"] for t in backend.query(team="UI Team", since=1003)] == [
+        "BUG-4",
+        "BUG-3",
+    ]
+    assert backend.query(kind="general_inquiry")[0]["status"] == "resolved"
+
+    first = backend.query(product="MobileApp", limit=3)
+    last = first[-1]
+    rest = backend.query(
+        product="MobileApp", after=(last["created_at"], last["id"]), limit=3
+    )
+    assert [t["id"] for t in first + rest] == [f"BUG-{n}" for n in range(4, -1, -1)]
+    assert backend.get("BUG-2")["data"]["assigned_team"] == ["Core", "UI Team"]
+
+
+def test_tickets_endpoint_serves_stored_tickets(tmp_path, monkeypatch):
+    store = TicketStore(SQLiteTicketBackend(str(tmp_path / "tickets.sqlite3")))
+    monkeypatch.setattr("app.main.ticket_store", store)
+    monkeypatch.setattr(
+        "app.nodes.bug_report.bug_report_index", BugReportIndex(enabled=False)
+    )
+    payload = {
+        "customer_id": "u1",
+        "message": "I can't log in to the application",
+        "product": "MobileApp",
+    }
+
+    with TestClient(app) as client:
+        created = client.post("/process-customer-message", json=payload).json()
+        client.portal.call(store.flush)
+        page = client.get(
+            "/tickets", params={"kind": "bug_report", "team": "Auth Team"}
+        ).json()
+        ticket_id = created["response_data"]["ticket"]["id"]
+        stored = client.get(f"/tickets/{ticket_id}").json()
+        assert client.get("/tickets", params={"cursor": "x"}).status_code == 400
+
+    assert [t["id"] for t in page["tickets"]] == [ticket_id]
+    assert page["next_cursor"] is None
+    assert stored["customer_id"] == "u1"
+    assert stored["data"] == created["response_data"]["ticket"]
+
+
+@pytest.mark.asyncio
+async def test_ticket_store_bounds_the_buffer_while_writes_fail():
+    class FlakyBackend:
+        failing = True
+        written = []
+
+        def write(self, records, report_counts):
+            if self.failing:
+                raise sqlite3.OperationalError("disk I/O error")
+            self.written.extend(record["title"] for record in records)
+
+    backend = FlakyBackend()
+    store = TicketStore(backend, flush_interval=60, max_buffered=3)
+    dropped = tickets_dropped.value(kind="general_inquiry")
+    try:
+        for n in range(5):
+            store.record(
+                {"product": "MobileApp", "response_data": {"inquiry_category": str(n)}}
+            )
+        await store.flush()
+        await store.flush()
+        backend.failing = False
+        await store.flush()
+    finally:
+        await store.close()
+
+    assert backend.written == ["2", "3", "4"]
+    assert tickets_dropped.value(kind="general_inquiry") == dropped + 2
+
+
+@pytest.mark.asyncio
+async def test_ticket_store_keeps_flushing_after_unexpected_errors():
+    class BrokenOnceBackend:
+        calls = 0
+        written = []
+
+        def write(self, records, report_counts):
+            self.calls += 1
+            if self.calls == 1:
+                raise ValueError("not a storage error")
+            self.written.extend(record["title"] for record in records)
+
+    backend = BrokenOnceBackend()
+    store = TicketStore(backend, batch_size=1, flush_interval=60)
+
+    def inquiry(category):
+        return {"product": "MobileApp", "response_data": {"inquiry_category": category}}
+
+    try:
+        store.record(inquiry("lost"))
+        async with asyncio.timeout(5):
+            while backend.calls == 0:
+                await asyncio.sleep(0.01)
+        store.record(inquiry("kept"))
+        async with asyncio.timeout(5):
+            while backend.written != ["kept"]:
+                await asyncio.sleep(0.01)
+        # A flusher that ended anyway is started again by the next record.
+        store._flusher.cancel()
+        await asyncio.gather(store._flusher, return_exceptions=True)
+        store.record(inquiry("after"))
+        async with asyncio.timeout(5):
+            while backend.written != ["kept", "after"]:
+                await asyncio.sleep(0.01)
+    finally:
+        await store.close()
+
+
+def test_debug_timings_and_metrics(monkeypatch):
+    monkeypatch.undo()
+    monkeypatch.setenv("OPENAI_API_KEY", "mock")
+    monkeypatch.setattr(
+        "app.utils.LLM.response_cache", ResponseCache(InMemoryLRUCache())
+    )
+    mock_app = create_mock_app(latency=0)
+    monkeypatch.setattr("app.utils.LLM.LLMClient", lambda: mock_llm_client(mock_app))
+    payload = {
+        "customer_id": "u1",
+        "message": "The app crashes when I open the settings page",
+        "product": "MobileApp",
+    }
+
+    with TestClient(app) as client:
+        debug = client.post(
+            "/process-customer-message", json={**payload, "debug": True}
+        ).json()
+        cached = client.post(
+            "/process-customer-message", json={**payload, "debug": True}
+        ).json()
+        plain = client.post("/process-customer-message", json=payload).json()
+        exposition = client.get("/metrics").text
+
+    assert "timings" not in plain
+    stages = {stage["stage"]: stage for stage in debug["timings"]["stages"]}
+    assert {"node:pre_classify", "node:classify_input", "node:bug_extraction"} <= set(
+        stages
+    )
+    llm_stage = stages["llm:classify_input"]
+    assert llm_stage["prompt_tokens"] > 0 and llm_stage["retries"] == 0
+    assert debug["timings"]["total_seconds"] >= stages["node:classify_input"]["seconds"]
+    cached_stages = [stage["stage"] for stage in cached["timings"]["stages"]]
+    assert "cache:classify_input" in cached_stages
+    assert not any(stage.startswith("llm:") for stage in cached_stages)
+    assert (
+        'agent_node_duration_seconds_count{node="classify_input",product="MobileApp",'
+        'classification="bug_report"}' in exposition
+    )
+    assert 'agent_llm_tokens_total{node="bug_extraction"' in exposition
+    assert 'path="/process-customer-message",status="200"' in exposition
+
+
+def parse_sse(text: str) -> list:
+    events = []
+    for block in text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_stream_endpoint_emits_classification_before_extraction(monkeypatch):
+    monkeypatch.undo()
+    monkeypatch.setenv("OPENAI_API_KEY", "mock")
+    monkeypatch.setattr(
+        "app.utils.LLM.response_cache", ResponseCache(InMemoryLRUCache())
+    )
+    mock_app = create_mock_app(latency=0)
+    monkeypatch.setattr("app.utils.LLM.LLMClient", lambda: mock_llm_client(mock_app))
+    payload = {
+        "customer_id": "u1",
+        "message": "The app crashes when I upload a photo",
+        "product": "MobileApp",
+    }
+
+    with TestClient(app) as client:
+        response = client.post("/process-customer-message:stream", json=payload)
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    names = [name for name, _ in events]
+    assert names[-1] == "result"
+    classification = names.index("classification")
+    partials = [data for name, data in events if name == "partial"]
+    assert {data["node"] for data in partials} == {"classify_input", "bug_extraction"}
+    first_extraction_partial = names.index("partial", classification)
+    assert classification < first_extraction_partial
+    assert events[classification][1]["message_type"] == "bug_report"
+    # Partial outputs grow towards the final extraction.
+    bug_partials = [
+        data["fields"] for data in partials if data["node"] == "bug_extraction"
+    ]
+    assert len(bug_partials) > 1 and "title" in bug_partials[-1]
+    result = events[-1][1]
+    assert result["message_type"] == "bug_report"
+    assert result["response_data"]["ticket"]["title"] == bug_partials[-1]["title"]
+
+
+def test_batch_endpoint_reports_per_item_results_in_order(monkeypatch):
+    original_parse = LLMClient.parse
+
+    async def failing_parse(self, **kwargs):
+        if "boom" in kwargs["messages"][1]["content"]:
+            raise RuntimeError("LLM unavailable")
+        return await original_parse(self, **kwargs)
+
+    monkeypatch.setattr(LLMClient, "parse", failing_parse)
+    messages = [
+        {"customer_id": "u1", "message": "I can't log in", "product": "MobileApp"},
+        {"customer_id": "u2", "message": "boom", "product": "MobileApp"},
+        {"customer_id": "u3", "message": "Test", "product": "NotARealProduct"},
+    ]
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/process-customer-messages:batch", json={"messages": messages}
+        )
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["index"] for r in results] == [0, 1, 2]
+    assert [r["status"] for r in results] == ["ok", "error", "ok"]
+    assert results[0]["result"]["message_type"] == "bug_report"
+    assert "LLM unavailable" in results[1]["error"]
+    assert results[2]["result"]["customer_response"] == "Invalid Product Name"
+
+
+def test_batch_endpoint_streams_ndjson():
+    messages = [
+        {"customer_id": f"u{i}", "message": "I can't log in", "product": "MobileApp"}
+        for i in range(5)
+    ]
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/process-customer-messages:batch?stream=true", json={"messages": messages}
+        )
+
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(line["index"] for line in lines) == list(range(5))
+    assert all(line["status"] == "ok" for line in lines)
+
+
+def test_job_queue_claims_by_priority_and_reclaims_stale_jobs(tmp_path):
+    queue = SQLiteJobQueue(str(tmp_path / "jobs.sqlite3"), visibility_timeout=60)
+    backfill = queue.submit({"message": "old email"}, priority=0)
+    chat = queue.submit({"message": "live chat"}, priority=9)
+
+    stale = queue.claim()
+    assert stale["job_id"] == chat
+    claimed = queue.claim()
+    assert claimed["job_id"] == backfill
+    assert claimed["payload"] == {"message": "old email"}
+    assert queue.claim() is None
+
+    # A worker that died never finishes its job, so it is handed out again...
+    queue.visibility_timeout = 0
+    reclaimed = queue.claim()
+    assert reclaimed["job_id"] == chat
+    queue.visibility_timeout = 60
+    assert queue.finish(reclaimed, result={"message_type": "bug_report"})
+    # ...and the first claim, if it finishes after all, does not overwrite the result.
+    assert not queue.finish(stale, error="late")
+    assert queue.finish(queue.claim(), error="boom")
+    assert queue.get(chat)["result"] == {"message_type": "bug_report"}
+    assert queue.get(backfill)["status"] == "failed"
+    assert queue.stats() == {"queued": 0, "running": 0, "done": 1, "failed": 1}
+
+
+def test_job_endpoints_run_submitted_messages(tmp_path, monkeypatch):
+    raw = load_config()
+    raw["jobs"].update(concurrency=2, poll_interval_seconds=0.01)
+    monkeypatch.setattr("app.main.config", raw)
+    payload = {
+        "customer_id": "u1",
+        "message": "I can't log in to the application",
+        "product": "MobileApp",
+        "priority": 5,
+    }
+
+    with TestClient(app) as client:
+        submitted = client.post("/jobs", json=payload)
+        assert submitted.status_code == 202
+        job_id = submitted.json()["job_id"]
+        # Only a guard against hanging: the job waits for the warm-up, then runs.
+        deadline = time.monotonic() + 60
+        while (job := client.get(f"/jobs/{job_id}").json())["status"] in (
+            "queued",
+            "running",
+        ):
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        assert client.get("/jobs/unknown").status_code == 404
+
+    assert job["status"] == "done"
+    assert job["priority"] == 5
+    assert job["result"]["message_type"] == "bug_report"
+    assert "ticket" in job["result"]["response_data"]
+
+
+class SlowEmptyJobQueue(SQLiteJobQueue):
+    def claim(self):
+        job = super().claim()
+        if job is None:
+            # Leaves time for a job to be submitted after the queue was found empty.
+            time.sleep(0.2)
+        return job
+
+
+@pytest.mark.asyncio
+async def test_job_workers_wake_on_submit(tmp_path):
+    started = asyncio.Queue()
+
+    async def run(payload):
+        await started.put(payload["n"])
+        return {}
+
+    # Never polls during the test: every job has to wake the worker.
+    pool = JobWorkerPool(
+        SlowEmptyJobQueue(str(tmp_path / "jobs.sqlite3")), run, 1, poll_interval=3600
+    )
+    pool.start()
+    try:
+        for n in range(3):
+            # While the worker is finding the queue empty.
+            await asyncio.sleep(0.1)
+            await pool.submit({"n": n})
+            assert await asyncio.wait_for(started.get(), 5) == n
+    finally:
+        await pool.stop()
+
+
+class LockedJobQueue(SQLiteJobQueue):
+    def finish(self, job, result=None, error=None):
+        if job["payload"]["n"] == 0:
+            raise sqlite3.OperationalError("database is locked")
+        return super().finish(job, result, error)
+
+    def purge(self, older_than):
+        raise sqlite3.OperationalError("database is locked")
+
+
+@pytest.mark.asyncio
+async def test_job_workers_survive_queue_errors(tmp_path):
+    queue = LockedJobQueue(str(tmp_path / "jobs.sqlite3"))
+
+    async def run(payload):
+        return {"n": payload["n"]}
+
+    pool = JobWorkerPool(queue, run, 1, poll_interval=0.01)
+    pool.start()
+    try:
+        await pool.submit({"n": 0})
+        job_id = await pool.submit({"n": 1})
+        async with asyncio.timeout(5):
+            while queue.get(job_id)["status"] != "done":
+                await asyncio.sleep(0.01)
+        assert not any(worker.done() for worker in pool._workers)
+    finally:
+        await pool.stop()
+    assert queue.stats()["running"] == 1
+
+
+def test_job_callbacks_only_go_to_allowed_hosts(tmp_path, monkeypatch):
+    raw = load_config()
+    raw["jobs"].update(callback_allowed_hosts=["hooks.example.com"])
+    monkeypatch.setattr("app.main.config", raw)
+    payload = {"customer_id": "u1", "message": "Hi", "product": "MobileApp"}
+
+    with TestClient(app) as client:
+        statuses = {
+            url: client.post("/jobs", json={**payload, "callback_url": url}).status_code
+            for url in (
+                "https://hooks.example.com/done",
+                "https://eu.hooks.example.com/done",
+                "http://169.254.169.254/latest/meta-data",
+                "http://localhost:8000/admin/reload-config",
+                "https://hooks.example.com.evil.io/done",
+                "file:///etc/passwd",
+            )
+        }
+
+    assert statuses == {
+        "https://hooks.example.com/done": 202,
+        "https://eu.hooks.example.com/done": 202,
+        "http://169.254.169.254/latest/meta-data": 422,
+        "http://localhost:8000/admin/reload-config": 422,
+        "https://hooks.example.com.evil.io/done": 422,
+        "file:///etc/passwd": 422,
+    }
+
+
+@pytest.mark.asyncio
+async def test_bulk_cli_resumes_from_checkpoint(tmp_path):
+    input_path = tmp_path / "messages.csv"
+    input_path.write_text(
+        "customer_id,product,message\n"
+        + "".join(f"c{i},MobileApp,I can't log in {i}\n" for i in range(10))
+    )
+    output_path = tmp_path / "results.jsonl"
+    checkpoint_path = tmp_path / "results.jsonl.checkpoint"
+    # Pretend a previous run was killed after finishing rows 0-3.
+    checkpoint_path.write_text("0\n1\n2\n3\n")
+
+    stats = await process_file(
+        str(input_path), str(output_path), str(checkpoint_path), concurrency=3
+    )
+
+    assert (stats.processed, stats.skipped, stats.errors) == (6, 4, 0)
+    records = [json.loads(line) for line in output_path.read_text().splitlines()]
+    assert sorted(r["row"] for r in records) == [4, 5, 6, 7, 8, 9]
+    assert all(r["message_type"] == "bug_report" for r in records)
+    assert len(checkpoint_path.read_text().split()) == 10
+
+
+@pytest.mark.asyncio
+async def test_bulk_cli_reports_malformed_rows_and_keeps_going(tmp_path):
+    row = {"customer_id": "c1", "product": "MobileApp", "message": "I can't log in"}
+    input_path = tmp_path / "messages.jsonl"
+    input_path.write_text(
+        f"{json.dumps(row)}\n"
+        '{"customer_id": "c2", "product": \n'
+        "[1, 2]\n"
+        f"{json.dumps(row)}\n"
+    )
+    output_path = tmp_path / "results.jsonl"
+    checkpoint_path = tmp_path / "results.jsonl.checkpoint"
+
+    stats = await process_file(
+        str(input_path), str(output_path), str(checkpoint_path), concurrency=2
+    )
+
+    assert (stats.processed, stats.errors) == (4, 2)
+    records = {
+        r["row"]: r for r in map(json.loads, output_path.read_text().splitlines())
+    }
+    assert records[1]["error"].startswith("Malformed JSON")
+    assert records[2]["error"] == "Expected a JSON object, got list"
+    assert records[0]["message_type"] == records[3]["message_type"] == "bug_report"
+    assert sorted(checkpoint_path.read_text().split()) == ["0", "3"]
+
+
+def test_fast_path_skips_llm_classification(monkeypatch):
+    original_parse = LLMClient.parse
+    response_formats = []
+
+    async def recording_parse(self, **kwargs):
+        response_formats.append(kwargs["response_format"].__name__)
+        return await original_parse(self, **kwargs)
+
+    monkeypatch.setattr(LLMClient, "parse", recording_parse)
+    # A sampled shadow check would ask the LLM to classify after all.
+    raw = load_config()
+    raw["fast_path"]["shadow_sample_rate"] = 0
+    monkeypatch.setattr("app.nodes.pre_classification.config", raw)
+    payload = {
+        "customer_id": "u1",
+        "message": "Login fails with:\nTraceback (most recent call last):\n"
+        '  File "auth.py", line 3\nKeyError: token',
+        "product": "MobileApp",
+    }
+
+    with TestClient(app) as client:
+        body = client.post("/process-customer-message", json=payload).json()
+        stats = client.get("/fast-path/stats").json()
+
+    assert body["message_type"] == "bug_report"
+    assert "ticket" in body["response_data"]
+    assert "ClassificationModel" not in response_formats
+    assert stats["hits"] >= 1
+
+
+@pytest.mark.asyncio
+async def test_fast_path_shadow_checks_calibrate_only_on_llm_answers(monkeypatch):
+    rules = RuleBasedPreClassifier(
+        [
+            {
+                "pattern": "(?i)dark mode",
+                "classification": "feature_request",
+                "confidence": 0.99,
+            }
+        ]
+    )
+    stats = FastPathStats()
+    raw = load_config()
+    raw["fast_path"]["shadow_sample_rate"] = 1
+    monkeypatch.setattr("app.nodes.pre_classification.config", raw)
+    monkeypatch.setattr("app.nodes.pre_classification.pre_classifier", rules)
+    monkeypatch.setattr("app.nodes.pre_classification.fast_path_stats", stats)
+    answers = [
+        {"classification": "bug_report", "confidence_score": 0.9},
+        # What classify_input_node returns when the LLM call fails.
+        {"classification": "general_inquiry", "confidence_score": 0},
+    ]
+
+    async def llm_classification(state):
+        return answers.pop(0)
+
+    monkeypatch.setattr(
+        "app.nodes.pre_classification.classify_input_node", llm_classification
+    )
+    state = {"customer_id": "u1", "message": "Add dark mode", "product": "MobileApp"}
+    for _ in range(2):
+        assert (await pre_classify_node(state))["classification"] == "feature_request"
+        await asyncio.gather(*_shadow_checks)
+
+    assert (stats.shadow_checked, stats.shadow_agreed) == (1, 0)
+    assert [(rule["checked"], rule["agreed"]) for rule in rules.rules] == [(1, 0)]
+
+
+@pytest.mark.asyncio
+async def test_llm_labels_are_appended_off_the_event_loop(tmp_path, monkeypatch):
+    raw = load_config()
+    raw["fast_path"]["label_log_path"] = str(tmp_path / "labels" / "llm.jsonl")
+    monkeypatch.setattr("app.utils.pre_classifier.config", raw)
+    label_log = LabelLog()
+    monkeypatch.setattr("app.utils.pre_classifier.label_log", label_log)
+
+    log_llm_label("MobileApp", "It crashes", "bug_report", 0.9)
+    log_llm_label("MobileApp", "Add dark mode", "feature_request", 0.8)
+    # Only buffered so far: the file is written on a worker thread.
+    assert not (tmp_path / "labels").exists()
+    await label_log.close()
+
+    lines = (tmp_path / "labels" / "llm.jsonl").read_text().splitlines()
+    assert [json.loads(line)["classification"] for line in lines] == [
+        "bug_report",
+        "feature_request",
+    ]
+
+
+def test_rule_confidence_is_calibrated_by_llm_agreement():
+    pre_classifier = RuleBasedPreClassifier(
+        [
+            {
+                "pattern": "(?i)dark mode",
+                "classification": "feature_request",
+                "confidence": 0.95,
+            }
+        ]
+    )
+    assert pre_classifier.predict("How do I log in?") is None
+    classification, confidence = pre_classifier.predict("Add dark mode")
+    assert classification == "feature_request"
+    assert confidence == pytest.approx(0.95)
+
+    for _ in range(20):
+        pre_classifier.record_agreement("dark mode is broken", "bug_report")
+
+    _, calibrated = pre_classifier.predict("Add dark mode")
+    assert calibrated < 0.5
+
+
+def allocate_ticket_ids(path: str, block_size: int, count: int) -> list[int]:
+    """Allocates IDs from a fresh allocator, from several threads, in a worker process."""
+    allocator = SQLiteTicketIdAllocator(path)
+    if block_size > 1:
+        allocator = BlockLeasingTicketIdAllocator(allocator, block_size)
+    with ThreadPoolExecutor(max_workers=4) as threads:
+        return list(threads.map(lambda _: allocator.allocate("BUG"), range(count)))
+
+
+def test_ticket_ids_are_unique_across_processes(tmp_path):
+    path = str(tmp_path / "ticket_ids.sqlite3")
+    # Mix leasing and non-leasing workers sharing one counter file.
+    block_sizes = [1, 7, 7, 50, 50, 1]
+    with ProcessPoolExecutor(
+        max_workers=len(block_sizes), mp_context=multiprocessing.get_context("fork")
+    ) as pool:
+        results = pool.map(
+            allocate_ticket_ids,
+            [path] * len(block_sizes),
+            block_sizes,
+            [300] * len(block_sizes),
+        )
+        ids = [ticket_id for result in results for ticket_id in result]
+
+    assert len(ids) == 300 * len(block_sizes)
+    assert len(set(ids)) == len(ids)
+
+
+@pytest.mark.asyncio
+async def test_ticket_ids_survive_restart(tmp_path):
+    path = str(tmp_path / "ticket_ids.sqlite3")
+    service = TicketIdService(SQLiteTicketIdAllocator(path))
+    assert await service.next_id("BUG") == "BUG-1"
+    assert await service.next_id("FR") == "FR-1"
+    assert await service.next_id("BUG") == "BUG-2"
+
+    restarted = TicketIdService(SQLiteTicketIdAllocator(path))
+    assert await restarted.next_id("BUG") == "BUG-3"
+
+
+def take_shared_requests(path: str, attempts: int) -> int:
+    """Takes what it can of a shared 60 requests/min limit, in a worker process."""
+    limiter = SharedRateLimiter(
+        SharedStateStore(path, "test"), "mock", 60, burst_seconds=10
+    )
+
+    async def take() -> int:
+        return sum([await limiter.try_acquire(1) for _ in range(attempts)])
+
+    return asyncio.run(take())
+
+
+def test_shared_rate_limiter_holds_across_processes(tmp_path):
+    path = str(tmp_path / "shared_state.sqlite3")
+    with ProcessPoolExecutor(
+        max_workers=4, mp_context=multiprocessing.get_context("fork")
+    ) as pool:
+        taken = sum(pool.map(take_shared_requests, [path] * 4, [10] * 4))
+    # One burst of 10 for all four processes together (plus a refill per second),
+    # where per-process limiters would have let all 40 through.
+    assert 10 <= taken <= 12
+
+    # A 429 seen by one worker pauses the model for the others too.
+    first = SharedRateLimiter(SharedStateStore(path, "0"), "mock", 600)
+    second = SharedRateLimiter(SharedStateStore(path, "1"), "mock", 600)
+    asyncio.run(first.pause(5))
+    assert not asyncio.run(second.try_acquire(1))
+    assert asyncio.run(second.wait_time()) > 4
+
+
+def test_metrics_render_the_totals_of_all_workers(tmp_path):
+    def registry():
+        metrics = MetricsRegistry()
+        calls = metrics.register(Counter("calls_total", "Calls", ("model",)))
+        latency = metrics.register(Histogram("latency_seconds", "Latency", (), (1,)))
+        return metrics, calls, latency
+
+    path = str(tmp_path / "shared_state.sqlite3")
+    workers = [SharedStateStore(path, str(worker)) for worker in range(2)]
+    this_worker, calls, latency = registry()
+    calls.inc(model="a")
+    latency.observe(0.5)
+    other_worker, other_calls, other_latency = registry()
+    other_calls.inc(2, model="a")
+    other_calls.inc(model="b")
+    other_latency.observe(3)
+    workers[1].publish_metrics(other_worker.snapshot())
+
+    text = this_worker.render(workers[0].other_workers_metrics())
+
+    assert 'calls_total{model="a"} 3' in text
+    assert 'calls_total{model="b"} 1' in text
+    assert 'latency_seconds_bucket{le="1"} 1' in text
+    assert "latency_seconds_count 2" in text
+    assert workers[1].other_workers_metrics() == []
+
+
+def test_multi_worker_server_serves_the_metrics_of_all_workers():
+    messages = [f"The app crashes when I open screen {i}" for i in range(8)]
+    with MockLLMServer(latency=0) as llm, running_server(2, llm.base_url) as url:
+        responses = [
+            # A new connection each, so any worker may answer it.
+            httpx.post(
+                f"{url}/process-customer-message",
+                json={"customer_id": "u1", "message": message, "product": "MobileApp"},
+                timeout=30,
+            )
+            for message in messages
+        ]
+        # Longer than "server.metrics_publish_interval_seconds".
+        time.sleep(1.5)
+        text = httpx.get(f"{url}/metrics").text
+
+    assert all(response.status_code == 200 for response in responses)
+    assert (
+        'agent_http_request_duration_seconds_count{method="POST",'
+        'path="/process-customer-message",status="200"} 8'
+    ) in text
+
+
+def write_config(path, products):
+    raw = load_config()
+    raw["products"] = products
+    path.write_text(json.dumps(raw))
+
+
+def make_product(description, component_team_mapping=None):
+    return {
+        "description": description,
+        "component_team_mapping": component_team_mapping or {},
+        "general_inquiry": {"resource_dict": {"Other": []}},
+    }
+
+
+def test_prompt_registry_renders_once_per_product(tmp_path, monkeypatch):
+    path = tmp_path / "config.json"
+    write_config(path, {"A": make_product("a"), "B": make_product("b")})
+    store = ConfigStore(str(path))
+    monkeypatch.setattr("app.utils.prompts.config_store", store)
+    renders = []
+
+    def render_prefix(product_config):
+        renders.append(product_config["description"])
+        return f"Describe {product_config['description']}.\n\n"
+
+    registry = PromptRegistry()
+    registry.register("node", "system", render_prefix)
+    prompt = registry.get("node", "A")
+    for _ in range(3):
+        messages = registry.get("node", "A").messages("hello")
+
+    assert renders == ["a"]
+    assert messages == [
+        {"role": "system", "content": "system"},
+        {"role": "user", "content": 'Describe a.\n\nCustomer message: "hello"'},
+    ]
+    assert prompt.version != registry.get("node", "B").version
+    assert renders == ["a", "b"]
+
+    old_snapshot = store.snapshot()
+    write_config(path, {"A": make_product("changed")})
+    store.reload()
+    assert registry.get("node", "A").version != prompt.version
+    assert renders == ["a", "b", "changed"]
+    # Requests still holding the old snapshot keep its prompts.
+    assert registry.get("node", "A", old_snapshot) is prompt
+
+
+def test_config_reload_swaps_snapshot_and_keeps_it_on_invalid_file(tmp_path):
+    path = tmp_path / "config.json"
+    write_config(path, {"A": make_product("a", {"Authentication Module": "Auth"})})
+    store = ConfigStore(str(path))
+    snapshot = store.snapshot()
+    product = snapshot.product("A")
+
+    assert product.team_for("authentication module") == "Auth"
+    assert product.team_for("  AUTHENTICATION MODULE ") == "Auth"
+    assert product.team_for("Payments") == "TBD"
+    with pytest.raises(TypeError):
+        snapshot["products"]["B"] = {}
+
+    write_config(path, {"A": make_product("a"), "B": make_product("b")})
+    reloaded = store.reload()
+    assert store.snapshot() is reloaded
+    assert reloaded.products == {"A", "B"}
+    assert reloaded.version > snapshot.version
+    # The old snapshot is untouched for requests still using it.
+    assert snapshot.products == {"A"}
+
+    path.write_text('{"model": "gpt-4o", "products": {"C": {}}}')
+    with pytest.raises(ValueError):
+        store.reload()
+    path.write_text("{not json")
+    with pytest.raises(ValueError):
+        store.reload()
+    assert store.snapshot() is reloaded
+
+
+def test_config_reload_endpoint_needs_the_admin_token(monkeypatch):
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    with TestClient(app) as remote:
+        assert remote.post("/admin/reload-config").status_code == 403
+    with TestClient(app, client=("127.0.0.1", 50000)) as local:
+        assert local.post("/admin/reload-config").status_code == 200
+
+    monkeypatch.setenv("ADMIN_TOKEN", "s3cret")
+    with TestClient(app, client=("127.0.0.1", 50000)) as client:
+        assert client.post("/admin/reload-config").status_code == 401
+        wrong = {"Authorization": "Bearer guess"}
+        assert client.post("/admin/reload-config", headers=wrong).status_code == 401
+        right = {"Authorization": "Bearer s3cret"}
+        response = client.post("/admin/reload-config", headers=right)
+        assert response.status_code == 200
+        assert response.json()["products"] == len(config_store.snapshot().products)
+
+
 def test_deterministic_output(monkeypatch):
     # Undo the patch for this test only by restoring the original method
     monkeypatch.undo()
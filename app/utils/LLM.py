@@ -1,28 +1,524 @@
-from openai import OpenAI
+import asyncio
 import logging
+import time
+from typing import Callable, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+from app.config import ConfigSnapshot, config, config_store
+from app.utils.cache import response_cache
+from app.utils.deadlines import DeadlineExceeded, LatencyTracker, remaining
+from app.utils.singleflight import single_flight
+from app.utils.streaming import llm_partials
+from app.utils.metrics import (
+    current_node,
+    llm_call_duration,
+    llm_cost,
+    llm_deadline_exceeded,
+    llm_errors,
+    llm_escalations,
+    llm_hedges,
+    llm_parse_duration,
+    llm_queue_wait,
+    llm_rate_limited,
+    llm_retries,
+    llm_shed,
+    llm_tier_calls,
+    llm_tokens,
+    record_llm_usage,
+    record_stage,
+    routed_call_duration,
+)
+from app.utils.model_router import PARSE_ERRORS, call_cost, plan_route, tier_name
+from app.utils.rate_limit import (
+    LLMOverloadedError,
+    RateLimiter,
+    backoff_delay,
+    create_rate_limiter,
+    is_rate_limited,
+    is_retryable,
+    retry_after_seconds,
+)
 
 logger = logging.getLogger(__name__)
 
 
 class LLMClient:
-    def __init__(self):
-        self.client = OpenAI()
+    def __init__(
+        self,
+        max_concurrency: int = None,
+        timeout: float = None,
+        http_client: httpx.AsyncClient = None,
+        max_retries: int = None,
+        rate_limits: dict = None,
+        hedging: dict = None,
+    ):
+        """
+        Wraps a single AsyncOpenAI client backed by one long-lived, connection-pooled
+        httpx.AsyncClient. At most `max_concurrency` calls are in flight at once and
+        every call is bounded by `timeout` seconds. Failed calls are retried up to
+        `max_retries` times with jittered backoff, calls to models listed in
+        `rate_limits` are paced client-side, and slow calls are hedged as set by
+        `hedging` (all default to the "llm" config).
+        """
+        llm_config = config.get("llm", {})
+        self.max_concurrency = max_concurrency or llm_config.get("max_concurrency", 64)
+        self.timeout = timeout or llm_config.get("timeout_seconds", 30)
+        self.max_retries = (
+            max_retries if max_retries is not None else llm_config.get("max_retries", 2)
+        )
+        self.backoff_base = llm_config.get("backoff_base_seconds", 0.5)
+        self.backoff_max = llm_config.get("backoff_max_seconds", 20)
+        # Calls waiting for a rate limit or concurrency slot beyond this are shed.
+        self.max_queued_calls = llm_config.get("max_queued_calls", 1000)
+        self.expected_completion_tokens = llm_config.get(
+            "expected_completion_tokens", 256
+        )
+        self.rate_limits = (
+            rate_limits
+            if rate_limits is not None
+            else llm_config.get("rate_limits", {})
+        )
+        self.hedging = hedging if hedging is not None else llm_config.get("hedging", {})
+        self.http_client = http_client or httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=llm_config.get("max_connections", 100),
+                max_keepalive_connections=llm_config.get(
+                    "max_keepalive_connections", 20
+                ),
+            ),
+            timeout=self.timeout,
+        )
+        self.client = AsyncOpenAI(
+            http_client=self.http_client,
+            timeout=self.timeout,
+            # Retries are done here, so they respect the rate limits and backoff.
+            max_retries=0,
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._limiters = {}
+        self._latencies = {}
+        self._queued = 0
+        # Token usage of all calls made through this client.
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
 
-    def parse(self, model: str, messages: list, response_format=None):
+    async def parse(
+        self,
+        model: str,
+        messages: list,
+        response_format=None,
+        timeout: float = None,
+        cache_key: str = None,
+    ):
         """
         Makes an API call to OpenAI's chat completions endpoint with the given parameters.
-        Returns the parsed output (assumed to have a .json() method that returns a JSON-formatted string).
+        Returns the parsed output (an instance of `response_format`).
+        If `cache_key` is given (see ResponseCache.make_key), the output is served from and
+        stored in the response cache, and concurrent calls with the same key share a single
+        in-flight request.
+        Within a request deadline (see deadline_scope), raises DeadlineExceeded once it
+        passes instead of waiting for the call any longer.
+        """
+        budget = remaining()
+        if budget is None:
+            return await self._load(
+                model, messages, response_format, timeout, cache_key
+            )
+        try:
+            # An already passed deadline expires on the first await.
+            async with asyncio.timeout(budget):
+                return await self._load(
+                    model, messages, response_format, timeout, cache_key
+                )
+        except TimeoutError as e:
+            llm_deadline_exceeded.inc(node=current_node.get())
+            raise DeadlineExceeded("Request deadline passed before the LLM call") from e
+
+    async def _load(
+        self, model: str, messages: list, response_format, timeout: float, cache_key
+    ):
+        if cache_key is None:
+            return await self._parse(model, messages, response_format, timeout)
+
+        async def load():
+            start = time.perf_counter()
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                output = response_format.model_validate(cached)
+                record_stage(f"cache:{current_node.get()}", time.perf_counter() - start)
+                return output
+            output = await self._parse(model, messages, response_format, timeout)
+            if output is not None:
+                await response_cache.set(cache_key, output.model_dump())
+            return output
+
+        if not config.get("cache", {}).get("coalesce_requests", True):
+            return await load()
+        return await single_flight.do(cache_key, load)
+
+    async def parse_routed(
+        self,
+        node: str,
+        product: str,
+        message: str,
+        messages: list,
+        response_format,
+        cache_key: Callable[[str], str] = None,
+        confidence: Callable = None,
+        snapshot: ConfigSnapshot = None,
+    ):
         """
+        Makes the call on the model tiers planned by the "model_routing" config for this
+        node, product and message (see plan_route): starting on a cheaper tier, it moves
+        to the next tier when the output cannot be parsed or its `confidence(output)`
+        (default: its confidence_score, if any) is below the rule's `min_confidence`.
+        `cache_key(model)` returns the response cache key for a call on `model`.
+        If the request deadline passes while escalating, the cheaper tier's output is
+        returned rather than nothing.
+        """
+        snapshot = snapshot or config_store.snapshot()
+        route = plan_route(snapshot, node, product, message)
+        confidence = confidence or (
+            lambda output: getattr(output, "confidence_score", None)
+        )
+        start = time.perf_counter()
+        fallback = None
+        for attempt, model in enumerate(route.models):
+            tier = tier_name(model, snapshot)
+            last = attempt == len(route.models) - 1
+            llm_tier_calls.inc(node=node, tier=tier)
+            try:
+                output = await self.parse(
+                    model=model,
+                    messages=messages,
+                    response_format=response_format,
+                    cache_key=cache_key(model) if cache_key else None,
+                )
+            except DeadlineExceeded:
+                if fallback is None:
+                    raise
+                logger.info(
+                    f"{node}: deadline passed on {tier}, keeping cheaper output"
+                )
+                return fallback
+            except PARSE_ERRORS as e:
+                if last:
+                    raise
+                logger.info(f"{node}: {tier} output could not be parsed ({str(e)})")
+                reason = "parse_error"
+            else:
+                reason = None
+                if output is None:
+                    reason = "refusal"
+                elif not last and route.min_confidence is not None:
+                    score = confidence(output)
+                    if score is not None and score < route.min_confidence:
+                        reason = "low_confidence"
+                if last or reason is None:
+                    routed_call_duration.observe(
+                        time.perf_counter() - start,
+                        node=node,
+                        tier=tier,
+                        escalated=str(attempt > 0).lower(),
+                    )
+                    return output
+                fallback = output
+            llm_escalations.inc(node=node, from_tier=tier, reason=reason)
+
+    def _limiter_for(self, model: str) -> Optional[RateLimiter]:
+        if model not in self._limiters:
+            self._limiters[model] = create_rate_limiter(
+                self.rate_limits.get(model) or self.rate_limits.get("default"), model
+            )
+        return self._limiters[model]
+
+    async def _admit(self, model: str, limiter: RateLimiter, tokens: int):
+        """Waits for the model's rate limit and a concurrency slot, or sheds the call."""
+        if self._queued >= self.max_queued_calls:
+            llm_shed.inc(model=model)
+            retry_after = await limiter.wait_time() if limiter else 0.0
+            raise LLMOverloadedError(
+                f"Too many queued LLM calls ({self._queued})",
+                retry_after=max(1.0, retry_after),
+            )
+        self._queued += 1
         try:
-            response = self.client.beta.chat.completions.parse(
+            if limiter is not None:
+                await limiter.acquire(tokens)
+            await self._semaphore.acquire()
+        finally:
+            self._queued -= 1
+
+    async def _parse(self, model: str, messages: list, response_format, timeout: float):
+        node = current_node.get()
+        limiter = self._limiter_for(model)
+        estimated_prompt_tokens = (
+            sum(len(str(m.get("content", ""))) for m in messages) // 4
+        )
+        estimated_tokens = estimated_prompt_tokens + self.expected_completion_tokens
+        queued = time.perf_counter()
+        queue_wait = 0.0
+        retries = 0
+        while True:
+            waiting = time.perf_counter()
+            await self._admit(model, limiter, estimated_tokens)
+            queue_wait += time.perf_counter() - waiting
+            try:
+                try:
+                    response, received = await self._hedged_call(
+                        model,
+                        messages,
+                        response_format,
+                        timeout,
+                        limiter,
+                        estimated_tokens,
+                    )
+                finally:
+                    self._semaphore.release()
+                break
+            except asyncio.CancelledError:
+                # E.g. a wrong speculative extraction; the request may already be billed.
+                record_llm_usage(cancelled_prompt_tokens=estimated_prompt_tokens)
+                raise
+            except Exception as e:
+                retry_after = retry_after_seconds(e)
+                if is_rate_limited(e):
+                    llm_rate_limited.inc(model=model)
+                    if limiter is not None:
+                        await limiter.pause(retry_after or self.backoff_base)
+                if retries >= self.max_retries or not is_retryable(e):
+                    llm_errors.inc(node=node, model=model)
+                    logger.error(f"LLM API call failed: {str(e)}")
+                    if is_rate_limited(e):
+                        raise LLMOverloadedError(
+                            f"LLM provider rate limit: {str(e)}",
+                            retry_after=retry_after or self.backoff_base,
+                        ) from e
+                    raise
+                delay = backoff_delay(
+                    retries, self.backoff_base, self.backoff_max, retry_after
+                )
+                retries += 1
+                llm_retries.inc(node=node, model=model)
+                logger.warning(
+                    f"LLM API call failed ({str(e)}), retry {retries} in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+        parsed = time.perf_counter()
+
+        llm_queue_wait.observe(queue_wait, node=node, model=model)
+        llm_call_duration.observe(
+            received - queued - queue_wait, node=node, model=model
+        )
+        llm_parse_duration.observe(parsed - received, node=node, model=model)
+        usage = response.usage
+        record_llm_usage(
+            prompt_tokens=usage.prompt_tokens if usage else 0,
+            completion_tokens=usage.completion_tokens if usage else 0,
+        )
+        if usage is not None:
+            self.prompt_tokens += usage.prompt_tokens
+            self.completion_tokens += usage.completion_tokens
+            llm_tokens.inc(usage.prompt_tokens, node=node, model=model, kind="prompt")
+            llm_tokens.inc(
+                usage.completion_tokens, node=node, model=model, kind="completion"
+            )
+            llm_cost.inc(
+                call_cost(model, usage.prompt_tokens, usage.completion_tokens),
+                node=node,
                 model=model,
-                messages=messages,
-                response_format=response_format,
-                temperature=0,
             )
-            # Retrieve the parsed output from the response.
-            output = response.choices[0].message.parsed
-            return output
-        except Exception as e:
-            logger.error(f"LLM API call failed: {str(e)}")
-            raise
+            if limiter is not None:
+                await limiter.record_usage(estimated_tokens, usage.total_tokens)
+        record_stage(
+            f"llm:{node}",
+            parsed - queued,
+            queue_wait_seconds=round(queue_wait, 6),
+            network_seconds=round(received - queued - queue_wait, 6),
+            parse_seconds=round(parsed - received, 6),
+            prompt_tokens=usage.prompt_tokens if usage else 0,
+            completion_tokens=usage.completion_tokens if usage else 0,
+            retries=retries,
+        )
+        # Retrieve the parsed output from the response.
+        return response.choices[0].message.parsed
+
+    def _hedge_delay(self, model: str) -> Optional[float]:
+        """
+        How long to wait for a call before hedging it: the "percentile" of the model's
+        recent latencies, once there are "min_samples" of them. None if not hedging.
+        """
+        if not self.hedging.get("enabled", False) or llm_partials.get() is not None:
+            return None
+        latencies = self._latencies.get(model)
+        if latencies is None or len(latencies) < self.hedging.get("min_samples", 20):
+            return None
+        return max(
+            self.hedging.get("min_delay_seconds", 0.05),
+            latencies.percentile(self.hedging.get("percentile", 95)),
+        )
+
+    async def _hedged_call(
+        self,
+        model: str,
+        messages: list,
+        response_format,
+        timeout: float,
+        limiter: Optional[RateLimiter],
+        tokens: int,
+    ):
+        """
+        Makes the call and, if it is slower than the hedge delay, a duplicate of it when
+        a concurrency slot and rate limit capacity are free right away. Returns the first
+        successful response and cancels the other request.
+        """
+        delay = self._hedge_delay(model)
+        if delay is None:
+            return await self._call(model, messages, response_format, timeout)
+
+        async def hedge():
+            async with self._semaphore:
+                return await self._call(model, messages, response_format, timeout)
+
+        first = asyncio.create_task(
+            self._call(model, messages, response_format, timeout)
+        )
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return first.result()
+            if self._semaphore.locked() or (
+                limiter is not None and not await limiter.try_acquire(tokens)
+            ):
+                return await first
+            llm_hedges.inc(model=model, outcome="fired")
+            second = asyncio.create_task(hedge())
+            tasks.add(second)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            llm_hedges.inc(model=model, outcome="won")
+                        return task.result()
+            # Both failed: retry (or raise) on the original call's error.
+            return first.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _call(self, model: str, messages: list, response_format, timeout: float):
+        """Makes one API call. Returns the response and when it was received."""
+        on_partial = llm_partials.get()
+        if on_partial is not None:
+            response = await self._stream(
+                model, messages, response_format, timeout, on_partial
+            )
+            # Streamed outputs are parsed as tokens arrive, within the network time.
+            return response, time.perf_counter()
+        start = time.perf_counter()
+        raw = await self.client.beta.chat.completions.with_raw_response.parse(
+            model=model,
+            messages=messages,
+            response_format=response_format,
+            temperature=0,
+            timeout=timeout or self.timeout,
+        )
+        received = time.perf_counter()
+        if model not in self._latencies:
+            self._latencies[model] = LatencyTracker()
+        self._latencies[model].record(received - start)
+        return raw.parse(), received
+
+    async def _stream(
+        self,
+        model: str,
+        messages: list,
+        response_format,
+        timeout: float,
+        on_partial: Callable[[dict], None],
+    ):
+        """Token-streams a call, passing each partially parsed output to `on_partial`."""
+        async with self.client.beta.chat.completions.stream(
+            model=model,
+            messages=messages,
+            response_format=response_format,
+            temperature=0,
+            timeout=timeout or self.timeout,
+            stream_options={"include_usage": True},
+        ) as stream:
+            async for event in stream:
+                if event.type == "content.delta" and event.parsed:
+                    on_partial(event.parsed)
+            return await stream.get_final_completion()
+
+    async def warm_up(self, connections: int):
+        """
+        Opens up to `connections` pooled connections (TCP + TLS) ahead of the first request
+        by issuing concurrent lightweight `models.list` calls. Failures are only logged.
+        """
+        results = await asyncio.gather(
+            *(self.client.models.list() for _ in range(connections)),
+            return_exceptions=True,
+        )
+        failures = [r for r in results if isinstance(r, Exception)]
+        if failures:
+            logger.warning(
+                f"LLM warm-up failed for {len(failures)} connection(s): {failures[0]}"
+            )
+
+    async def aclose(self):
+        await self.client.close()
+
+
+def preload_sdk():
+    """
+    Imports the parts of the OpenAI SDK it would otherwise load on the first call:
+    `client.beta` alone imports for over a second, blocking the event loop. Meant to run
+    on a worker thread during warm-up.
+    """
+    # What `AsyncOpenAI.beta` imports on first access.
+    from openai.resources.beta import AsyncBeta  # noqa: F401
+
+
+# One client per event loop: pooled connections and the semaphore are bound to the
+# loop that first uses them, so they cannot be shared across loops.
+_clients = {}
+
+
+def get_llm_client() -> LLMClient:
+    """Returns the shared LLMClient for the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        for stale_loop in [l for l in _clients if l.is_closed()]:
+            del _clients[stale_loop]
+        client = _clients[loop] = LLMClient()
+    return client
+
+
+async def init_llm_client(warm_up_connections: int = None) -> LLMClient:
+    """
+    Creates the process-wide LLMClient on the server's event loop at startup and,
+    if `warm_up_connections` (default: "llm.warm_up_connections" in config) is set,
+    opens that many pooled connections before the first request arrives.
+    """
+    client = get_llm_client()
+    if warm_up_connections is None:
+        warm_up_connections = config.get("llm", {}).get("warm_up_connections", 0)
+    if warm_up_connections:
+        await client.warm_up(warm_up_connections)
+    return client
+
+
+async def close_llm_client():
+    """Closes the shared LLMClient of the running event loop, if one was created."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
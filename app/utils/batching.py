@@ -0,0 +1,114 @@
+import asyncio
+import contextvars
+from typing import Awaitable, Callable, Hashable, Optional
+
+from app.utils.deadlines import DeadlineExceeded, remaining
+from app.utils.metrics import llm_batch_size
+
+
+class _Batch:
+    __slots__ = ("items", "futures", "timer")
+
+    def __init__(self):
+        self.items = []
+        self.futures = []
+        self.timer = None
+
+
+class MicroBatcher:
+    """
+    Collects the items submitted under the same key within `max_wait` seconds of the
+    first one, or until `max_batch_size` are waiting, and passes them to
+    `run_batch(key, items)` in one go. It returns one result per item, in order, and
+    each submitter gets its own result (or the batch's exception).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run_batch: Callable[[Hashable, list], Awaitable[list]],
+        max_batch_size: int = 16,
+        max_wait: float = 0.005,
+    ):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = {}
+        self._running = set()
+
+    async def submit(self, key: Hashable, item):
+        """
+        Adds `item` to the next batch for `key` and waits for its result. Within a
+        request deadline, raises DeadlineExceeded once it passes.
+        """
+        loop = asyncio.get_running_loop()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _Batch()
+            batch.timer = loop.call_later(self.max_wait, self._flush, key, batch)
+        future = loop.create_future()
+        batch.items.append(item)
+        batch.futures.append(future)
+        if len(batch.items) >= self.max_batch_size:
+            self._flush(key, batch)
+        try:
+            # A waiter that gives up leaves the batch running for the others.
+            async with asyncio.timeout(remaining()):
+                return await future
+        except TimeoutError as e:
+            raise DeadlineExceeded("Request deadline passed in a batch") from e
+
+    def _flush(self, key: Hashable, batch: _Batch):
+        if self._pending.get(key) is not batch:
+            return
+        del self._pending[key]
+        batch.timer.cancel()
+        # Runs in a context of its own, so it is not bound by the deadline (or labelled
+        # with the timings) of whichever request happened to fill the batch.
+        task = asyncio.get_running_loop().create_task(
+            self._run(key, batch), context=contextvars.Context()
+        )
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, key: Hashable, batch: _Batch):
+        llm_batch_size.observe(len(batch.items), batcher=self.name)
+        try:
+            results = await self.run_batch(key, batch.items)
+            if len(results) != len(batch.items):
+                raise RuntimeError(
+                    f"{self.name} returned {len(results)} results "
+                    f"for a batch of {len(batch.items)}"
+                )
+        except BaseException as e:
+            # No waiter is left hanging, even when the batch itself is cancelled.
+            error = e
+            if not isinstance(e, Exception):
+                error = RuntimeError(f"{self.name} batch was interrupted")
+                error.__cause__ = e
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(error)
+            if error is not e:
+                raise
+            return
+        for future, result in zip(batch.futures, results):
+            if not future.done():
+                future.set_result(result)
+
+
+def create_micro_batcher(
+    name: str,
+    batching_config: dict,
+    run_batch: Callable[[Hashable, list], Awaitable[list]],
+) -> Optional[MicroBatcher]:
+    """Builds a MicroBatcher from a batching section of the config, if it is enabled."""
+    if not batching_config.get("enabled", False):
+        return None
+    return MicroBatcher(
+        name,
+        run_batch,
+        max_batch_size=batching_config.get("max_batch_size", 16),
+        max_wait=batching_config.get("max_wait_seconds", 0.005),
+    )
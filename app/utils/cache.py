@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import config, resolve_path
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_message(message: str) -> str:
+    """
+    Normalizes a customer message so that near-identical messages share a cache entry:
+    unicode normalization, lowercasing, dropping punctuation and collapsing whitespace.
+    """
+    message = unicodedata.normalize("NFKC", message or "").lower()
+    message = re.sub(r"[^\w\s]", " ", message)
+    return " ".join(message.split())
+
+
+class InMemoryLRUCache:
+    """In-process LRU cache with a per-entry TTL and a maximum number of entries."""
+
+    blocking = False
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+
+    def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: dict):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """
+    Persistent cache stored in a SQLite file, so entries survive restarts and can be
+    shared by every worker on the host. Expired entries are ignored on read and the
+    least recently used entries are evicted once `max_size` is exceeded.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, max_size: int = 100000, ttl_seconds: float = 600):
+        self.path = path
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS response_cache_accessed_at "
+                "ON response_cache (accessed_at)"
+            )
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value FROM response_cache WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE response_cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+        return json.loads(row[0])
+
+    def set(self, key: str, value: dict):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + self.ttl_seconds, now),
+            )
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE expires_at <= ? OR key IN ("
+                "SELECT key FROM response_cache ORDER BY accessed_at DESC "
+                "LIMIT -1 OFFSET ?)",
+                (now, self.max_size),
+            )
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM response_cache"
+            ).fetchone()
+        return count
+
+
+class ResponseCache:
+    """
+    Caches parsed LLM outputs in front of classification and extraction, keyed on
+    (node, product, normalized message, model, prompt version), and counts hits/misses.
+    Only LLM outputs are cached, so ticket IDs are still allocated for every request.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    @staticmethod
+    def make_key(
+        node: str, product: str, message: str, model: str, prompt_version: str
+    ) -> str:
+        raw = json.dumps(
+            [node, product, normalize_message(message), model, prompt_version]
+        )
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        try:
+            if self.backend.blocking:
+                value = await asyncio.to_thread(self.backend.get, key)
+            else:
+                value = self.backend.get(key)
+        except Exception as e:
+            logger.error(f"Response cache read failed: {str(e)}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: dict):
+        if not self.enabled:
+            return
+        try:
+            if self.backend.blocking:
+                await asyncio.to_thread(self.backend.set, key, value)
+            else:
+                self.backend.set(key, value)
+        except Exception as e:
+            logger.error(f"Response cache write failed: {str(e)}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "backend": type(self.backend).__name__ if self.enabled else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def create_response_cache(cache_config: dict) -> ResponseCache:
+    """Builds the ResponseCache described by the "cache" section of the config."""
+    if not cache_config.get("enabled", False):
+        return ResponseCache()
+    max_size = cache_config.get("max_size", 10000)
+    ttl_seconds = cache_config.get("ttl_seconds", 600)
+    backend = cache_config.get("backend", "memory")
+    if backend == "memory":
+        return ResponseCache(InMemoryLRUCache(max_size, ttl_seconds))
+    if backend == "sqlite":
+        path = resolve_path(
+            cache_config.get("sqlite_path", "data/response_cache.sqlite3")
+        )
+        return ResponseCache(SQLiteCache(path, max_size, ttl_seconds))
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+response_cache = create_response_cache(config.get("cache", {}))
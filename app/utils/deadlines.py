@@ -0,0 +1,58 @@
+import collections
+import contextvars
+import math
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+# time.monotonic() by which the current request must be answered, if it has a deadline.
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a request's deadline passes before an LLM call returns."""
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]):
+    """
+    Gives the code in this context (and the tasks it starts, e.g. graph nodes) at most
+    `seconds` to finish. Nested scopes can only shorten the deadline. None adds none.
+    """
+    if seconds is None:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left until the current deadline, or None if there is no deadline."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class LatencyTracker:
+    """Keeps the latencies of the last `window` calls and answers percentile queries."""
+
+    def __init__(self, window: int = 200):
+        self._recent = collections.deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._recent.append(seconds)
+
+    def __len__(self):
+        return len(self._recent)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        if not self._recent:
+            return None
+        # Nearest-rank percentile.
+        ordered = sorted(self._recent)
+        index = math.ceil(percent / 100 * len(ordered)) - 1
+        return ordered[max(0, min(index, len(ordered) - 1))]
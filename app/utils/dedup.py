@@ -0,0 +1,198 @@
+import collections
+import hashlib
+import random
+import re
+import time
+from typing import Optional
+
+from app.config import config
+from app.utils.metrics import bug_report_duplicates
+
+# Digits are kept: error codes and versions often tell two bugs apart.
+_NON_ALPHANUMERIC = re.compile(r"[^a-z0-9]+")
+
+
+class MinHasher:
+    """
+    One-permutation MinHash signatures of a text's character shingles: each shingle is
+    hashed once into one of `num_perm` bins, keeping the minimum per bin, so computing
+    a signature is linear in the text's length. Empty bins borrow the value of a bin
+    picked by a fixed probe sequence ("optimal densification"), identical for every text.
+    Two signatures agree in roughly the Jaccard similarity of the texts' shingle sets,
+    so near-duplicate reports (the same problem in other words) score high.
+    """
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = random.Random(seed)
+        self._probes = [
+            [rng.randrange(num_perm) for _ in range(4 * num_perm)]
+            for _ in range(num_perm)
+        ]
+
+    def shingles(self, text: str) -> set:
+        text = _NON_ALPHANUMERIC.sub(" ", text.lower()).strip()
+        size = self.shingle_size
+        if len(text) <= size:
+            return {text}
+        return {text[i : i + size] for i in range(len(text) - size + 1)}
+
+    def signature(self, text: str) -> tuple:
+        bins = [None] * self.num_perm
+        for shingle in self.shingles(text):
+            # blake2b rather than hash(), which is salted per process.
+            digest = hashlib.blake2b(shingle.encode(), digest_size=8).digest()
+            value, bin_index = divmod(int.from_bytes(digest, "big"), self.num_perm)
+            if bins[bin_index] is None or value < bins[bin_index]:
+                bins[bin_index] = value
+        signature = list(bins)
+        for i, value in enumerate(bins):
+            if value is None:
+                probe = next((j for j in self._probes[i] if bins[j] is not None), None)
+                if probe is None:
+                    # Only for very short texts: take the next filled bin.
+                    probe = next(
+                        (i + k) % self.num_perm
+                        for k in range(1, self.num_perm)
+                        if bins[(i + k) % self.num_perm] is not None
+                    )
+                signature[i] = bins[probe]
+        return tuple(signature)
+
+
+def similarity(first: tuple, second: tuple) -> float:
+    """Estimated Jaccard similarity of the texts behind two MinHash signatures."""
+    return sum(x == y for x, y in zip(first, second)) / len(first)
+
+
+class _Entry:
+    __slots__ = ("ticket_id", "signature", "keys", "created_at", "report_count")
+
+    def __init__(self, ticket_id: str, signature: tuple, keys: list):
+        self.ticket_id = ticket_id
+        self.signature = signature
+        self.keys = keys
+        self.created_at = time.monotonic()
+        self.report_count = 1
+
+
+class _ProductIndex:
+    """The recent bug tickets of one product, with LSH buckets over their signatures."""
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.buckets = {}
+
+    def add(self, ticket_id: str, entry: _Entry):
+        self.entries[ticket_id] = entry
+        for key in entry.keys:
+            self.buckets.setdefault(key, set()).add(ticket_id)
+
+    def evict_oldest(self):
+        ticket_id, entry = self.entries.popitem(last=False)
+        for key in entry.keys:
+            bucket = self.buckets[key]
+            bucket.discard(ticket_id)
+            if not bucket:
+                del self.buckets[key]
+
+
+class BugReportIndex:
+    """
+    Incremental near-duplicate index over the bug tickets created in the last
+    `window_seconds` (at most `window_size` per product). Signatures are split into
+    `bands` for locality-sensitive hashing, so a lookup only compares a new report with
+    the tickets that share a band with it, and reports at least `threshold` similar
+    to a ticket are attached to it instead of creating a new one.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        threshold: float = 0.6,
+        window_size: int = 1000,
+        window_seconds: float = 3600,
+        num_perm: int = 64,
+        bands: int = 16,
+        shingle_size: int = 5,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.enabled = enabled
+        self.threshold = threshold
+        self.window_size = window_size
+        self.window_seconds = window_seconds
+        self.bands = bands
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self._products = {}
+
+    def _band_keys(self, signature: tuple) -> list:
+        rows = len(signature) // self.bands
+        return [
+            (band, signature[band * rows : (band + 1) * rows])
+            for band in range(self.bands)
+        ]
+
+    def _expire(self, index: _ProductIndex):
+        oldest = time.monotonic() - self.window_seconds
+        while index.entries and (
+            len(index.entries) > self.window_size
+            or next(iter(index.entries.values())).created_at < oldest
+        ):
+            index.evict_oldest()
+
+    def attach(self, product: str, message: str) -> Optional[dict]:
+        """
+        Attaches the report to the most similar recent ticket of `product`, if any is
+        similar enough, and returns that ticket's `id` and updated `report_count`. Only
+        those: the rest of the ticket was extracted from another customer's message.
+        """
+        index = self._products.get(product)
+        if not self.enabled or index is None:
+            return None
+        self._expire(index)
+        signature = self.hasher.signature(message)
+        candidates = set()
+        for key in self._band_keys(signature):
+            candidates.update(index.buckets.get(key, ()))
+        best, best_score = None, self.threshold
+        for ticket_id in candidates:
+            score = similarity(signature, index.entries[ticket_id].signature)
+            if score >= best_score:
+                best, best_score = index.entries[ticket_id], score
+        if best is None:
+            return None
+        best.report_count += 1
+        bug_report_duplicates.inc(product=product)
+        return {"id": best.ticket_id, "report_count": best.report_count}
+
+    def add(self, product: str, message: str, ticket: dict):
+        """Indexes a newly created ticket under the report that created it."""
+        if not self.enabled:
+            return
+        index = self._products.setdefault(product, _ProductIndex())
+        signature = self.hasher.signature(message)
+        index.add(
+            ticket["id"], _Entry(ticket["id"], signature, self._band_keys(signature))
+        )
+        self._expire(index)
+
+    def __len__(self):
+        return sum(len(index.entries) for index in self._products.values())
+
+
+def create_bug_report_index(dedup_config: dict) -> BugReportIndex:
+    """Builds the BugReportIndex described by the "bug_dedup" section of the config."""
+    return BugReportIndex(
+        enabled=dedup_config.get("enabled", False),
+        threshold=dedup_config.get("similarity_threshold", 0.6),
+        window_size=dedup_config.get("window_size", 1000),
+        window_seconds=dedup_config.get("window_seconds", 3600),
+        num_perm=dedup_config.get("num_perm", 64),
+        bands=dedup_config.get("bands", 16),
+        shingle_size=dedup_config.get("shingle_size", 5),
+    )
+
+
+bug_report_index = create_bug_report_index(config.get("bug_dedup", {}))
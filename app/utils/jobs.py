@@ -0,0 +1,322 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Optional
+from urllib.parse import urlsplit
+
+from app.config import resolve_path
+from app.utils.metrics import jobs_finished, job_queue_wait
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteJobQueue:
+    """
+    Persistent priority queue of workflow jobs in a SQLite file, so queued work survives
+    restarts and can be shared by every worker process on the host. Higher priorities are
+    claimed first, then oldest first. A job claimed by a worker that died is handed out
+    again once it has been running for `visibility_timeout` seconds.
+    """
+
+    def __init__(self, path: str, visibility_timeout: float = 300):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, timeout=30, isolation_level=None
+        )
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, priority INTEGER NOT NULL, "
+                "payload TEXT NOT NULL, callback_url TEXT, result TEXT, error TEXT, "
+                "created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_claim_order "
+                "ON jobs (status, priority DESC, created_at)"
+            )
+
+    def submit(self, payload: dict, priority: int = 0, callback_url: str = None) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, priority, payload, callback_url, created_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, priority, json.dumps(payload), callback_url, time.time()),
+            )
+        return job_id
+
+    def claim(self) -> Optional[dict]:
+        """Marks the next job as running and returns it, or None if no job is waiting."""
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock up front, so two workers never claim
+            # the same job.
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'queued' "
+                    "WHERE status = 'running' AND started_at < ?",
+                    (now - self.visibility_timeout,),
+                )
+                row = self._conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ("
+                    "SELECT id FROM jobs WHERE status = 'queued' "
+                    "ORDER BY priority DESC, created_at LIMIT 1) "
+                    "RETURNING id, priority, payload, callback_url, created_at",
+                    (now,),
+                ).fetchone()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job_id, priority, payload, callback_url, created_at = row
+        return {
+            "job_id": job_id,
+            "priority": priority,
+            "payload": json.loads(payload),
+            "callback_url": callback_url,
+            "created_at": created_at,
+            "started_at": now,
+        }
+
+    def finish(self, job: dict, result: dict = None, error: str = None) -> bool:
+        """
+        Stores the result (or error) of a job claimed as `job`. Returns False, storing
+        nothing, if the claim has since expired and the job was handed out again.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? "
+                "WHERE id = ? AND status = 'running' AND started_at = ?",
+                (
+                    "failed" if error is not None else "done",
+                    json.dumps(result) if result is not None else None,
+                    error,
+                    time.time(),
+                    job["job_id"],
+                    job["started_at"],
+                ),
+            )
+        return cursor.rowcount == 1
+
+    def release(self, job: dict):
+        """Puts a claimed job back in the queue, e.g. when its worker shuts down."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL "
+                "WHERE id = ? AND status = 'running' AND started_at = ?",
+                (job["job_id"], job["started_at"]),
+            )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, priority, result, error, created_at, started_at, "
+                "finished_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, status, priority, result, error, created_at, started_at, finished_at = (
+            row
+        )
+        return {
+            "job_id": job_id,
+            "status": status,
+            "priority": priority,
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+        }
+
+    def purge(self, older_than: float) -> int:
+        """Deletes finished jobs that finished more than `older_than` seconds ago."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (time.time() - older_than,),
+            )
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        return {"queued": 0, "running": 0, "done": 0, "failed": 0, **dict(rows)}
+
+
+class JobWorkerPool:
+    """
+    Runs up to `concurrency` jobs from the queue at once on the event loop, passing each
+    job's payload to `run` and storing what it returns. Results of jobs submitted with a
+    callback URL are also POSTed there, if its host is in `callback_hosts`. Idle workers
+    poll the queue every `poll_interval` seconds, or sooner when a job is submitted
+    through this pool.
+    """
+
+    def __init__(
+        self,
+        queue: SQLiteJobQueue,
+        run: Callable[[dict], Awaitable[dict]],
+        concurrency: int = 8,
+        poll_interval: float = 1.0,
+        retention: float = 86400,
+        callback_timeout: float = 10,
+        callback_hosts: tuple = (),
+    ):
+        self.queue = queue
+        self.run = run
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.callback_timeout = callback_timeout
+        self.callback_hosts = tuple(host.lower() for host in callback_hosts)
+        self._wake = asyncio.Event()
+        self._workers = []
+        self._last_purge = 0.0
+        self._http_client = None
+
+    async def submit(
+        self, payload: dict, priority: int = 0, callback_url: str = None
+    ) -> str:
+        job_id = await asyncio.to_thread(
+            self.queue.submit, payload, priority, callback_url
+        )
+        self._wake.set()
+        return job_id
+
+    def callback_allowed(self, callback_url: str) -> bool:
+        """
+        Whether results may be POSTed to `callback_url`: an http(s) URL whose host is one
+        of `callback_hosts` or a subdomain of one. Anything else could point the server
+        at internal services.
+        """
+        url = urlsplit(callback_url)
+        host = (url.hostname or "").lower()
+        return url.scheme in ("http", "https") and any(
+            host == allowed or host.endswith(f".{allowed}")
+            for allowed in self.callback_hosts
+        )
+
+    def start(self):
+        import httpx
+
+        self._http_client = httpx.AsyncClient(timeout=self.callback_timeout)
+        self._workers = [
+            asyncio.create_task(self._work()) for _ in range(self.concurrency)
+        ]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._http_client is not None:
+            await self._http_client.aclose()
+
+    async def _work(self):
+        while True:
+            # Cleared before looking at the queue, not after finding it empty: a job
+            # submitted in between must still wake this worker.
+            self._wake.clear()
+            try:
+                job = await asyncio.to_thread(self.queue.claim)
+            except sqlite3.Error as e:
+                logger.error(f"Claiming a job failed: {str(e)}")
+                job = None
+            if job is None:
+                await self._idle()
+                continue
+            await self._process(job)
+
+    async def _idle(self):
+        if time.time() - self._last_purge > 60:
+            self._last_purge = time.time()
+            try:
+                await asyncio.to_thread(self.queue.purge, self.retention)
+            except sqlite3.Error as e:
+                logger.error(f"Purging finished jobs failed: {str(e)}")
+        try:
+            await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+        except TimeoutError:
+            pass
+
+    async def _process(self, job: dict):
+        job_queue_wait.observe(
+            job["started_at"] - job["created_at"], priority=job["priority"]
+        )
+        try:
+            result, error = await self.run(job["payload"]), None
+        except asyncio.CancelledError:
+            # Shutting down: hand the job back rather than wait out the visibility timeout.
+            try:
+                await asyncio.to_thread(self.queue.release, job)
+            except sqlite3.Error as e:
+                logger.error(f"Releasing job {job['job_id']} failed: {str(e)}")
+            raise
+        except Exception as e:
+            logger.error(f"Job {job['job_id']} failed: {str(e)}")
+            result, error = None, str(e)
+        try:
+            finished = await asyncio.to_thread(self.queue.finish, job, result, error)
+        except sqlite3.Error as e:
+            # Handed out again once its visibility timeout has passed.
+            logger.error(f"Storing the result of job {job['job_id']} failed: {str(e)}")
+            return
+        if not finished:
+            logger.warning(
+                f"Job {job['job_id']} was handed out again before it finished, "
+                "discarding this result"
+            )
+            return
+        jobs_finished.inc(status="failed" if error is not None else "done")
+        if job["callback_url"]:
+            await self._notify(job["callback_url"], job["job_id"])
+
+    async def _notify(self, callback_url: str, job_id: str):
+        """POSTs the finished job to its callback URL. Failures are only logged."""
+        # Checked again: the allowlist may have changed since the job was submitted.
+        if not self.callback_allowed(callback_url):
+            logger.warning(f"Callback for job {job_id} skipped: host not allowed")
+            return
+        try:
+            job = await asyncio.to_thread(self.queue.get, job_id)
+            response = await self._http_client.post(callback_url, json=job)
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning(f"Callback for job {job_id} failed: {str(e)}")
+
+
+def create_job_worker_pool(
+    jobs_config: dict, run: Callable[[dict], Awaitable[dict]]
+) -> Optional[JobWorkerPool]:
+    """Builds the JobWorkerPool described by the "jobs" section of the config, if enabled."""
+    if not jobs_config.get("enabled", False):
+        return None
+    queue = SQLiteJobQueue(
+        resolve_path(jobs_config.get("sqlite_path", "data/jobs.sqlite3")),
+        jobs_config.get("visibility_timeout_seconds", 300),
+    )
+    return JobWorkerPool(
+        queue,
+        run,
+        concurrency=jobs_config.get("concurrency", 8),
+        poll_interval=jobs_config.get("poll_interval_seconds", 1.0),
+        retention=jobs_config.get("retention_seconds", 86400),
+        callback_timeout=jobs_config.get("callback_timeout_seconds", 10),
+        callback_hosts=jobs_config.get("callback_allowed_hosts", []),
+    )
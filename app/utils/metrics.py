@@ -0,0 +1,451 @@
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable
+
+from app.config import config_store
+
+# Prometheus' default latency buckets, extended for slow LLM calls.
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+# Name of the graph node currently running, used to label LLM calls made from it.
+current_node = contextvars.ContextVar("current_node", default="")
+# Per-request list of timing stages, only set while a debug timing breakdown is requested.
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+# Token counts of the LLM calls made in the current context, only set while tracked.
+_llm_usage = contextvars.ContextVar("llm_usage", default=None)
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [
+        f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)
+    ] + ([extra] if extra else [])
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+class Counter:
+    """A monotonically increasing value per label set, e.g. tokens used."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def snapshot(self) -> list:
+        """The current values as JSON-serializable [label values, value] pairs."""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def samples(self, others: list = ()) -> list:
+        """Sample lines of this counter, plus the snapshots of other workers in `others`."""
+        with self._lock:
+            values = dict(self._values)
+        for snapshot in others:
+            for key, value in snapshot:
+                key = tuple(key)
+                values[key] = values.get(key, 0) + value
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+            for key, value in values.items()
+        ]
+
+
+class Histogram:
+    """Counts observations into cumulative buckets per label set, e.g. latencies."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> [bucket counts..., sum, count]
+        self._values = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(tuple(labels[name] for name in self.labelnames))
+        return state[-1] if state else 0
+
+    def snapshot(self) -> list:
+        """The current values as JSON-serializable [label values, state] pairs."""
+        with self._lock:
+            return [[list(key), list(state)] for key, state in self._values.items()]
+
+    def samples(self, others: list = ()) -> list:
+        """Sample lines of this histogram, plus the snapshots of other workers in `others`."""
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        for snapshot in others:
+            for key, state in snapshot:
+                key = tuple(key)
+                merged = values.get(key)
+                if merged is None:
+                    values[key] = list(state)
+                else:
+                    values[key] = [a + b for a, b in zip(merged, state)]
+        lines = []
+        for key, state in values.items():
+            for bound, bucket_count in zip(self.buckets, state):
+                le = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {bucket_count}")
+            le = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {state[-1]}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {state[-2]}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Renders all registered metrics in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> dict:
+        """All current values by metric name, e.g. to share with other worker processes."""
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def render(self, others: list = ()) -> str:
+        """
+        The exposition text. Snapshots of other worker processes passed in `others` are
+        added in, so any worker can serve the totals of the whole server.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(
+                metric.samples([other.get(metric.name, []) for other in others])
+            )
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+node_duration = metrics.register(
+    Histogram(
+        "agent_node_duration_seconds",
+        "Wall time of graph node executions.",
+        ("node", "product", "classification"),
+    )
+)
+llm_call_duration = metrics.register(
+    Histogram(
+        "agent_llm_call_duration_seconds",
+        "Wall time of LLM API calls, including retries, excluding queue wait.",
+        ("node", "model"),
+    )
+)
+llm_queue_wait = metrics.register(
+    Histogram(
+        "agent_llm_queue_wait_seconds",
+        "Time LLM calls waited for the rate limits and a free concurrency slot.",
+        ("node", "model"),
+    )
+)
+llm_parse_duration = metrics.register(
+    Histogram(
+        "agent_llm_parse_duration_seconds",
+        "Time spent parsing LLM responses into pydantic models.",
+        ("node", "model"),
+    )
+)
+llm_tokens = metrics.register(
+    Counter(
+        "agent_llm_tokens_total",
+        "Tokens used by LLM calls.",
+        ("node", "model", "kind"),
+    )
+)
+llm_retries = metrics.register(
+    Counter(
+        "agent_llm_retries_total",
+        "Retries of failed LLM calls.",
+        ("node", "model"),
+    )
+)
+llm_errors = metrics.register(
+    Counter(
+        "agent_llm_errors_total",
+        "LLM calls that failed after all retries.",
+        ("node", "model"),
+    )
+)
+llm_rate_limited = metrics.register(
+    Counter(
+        "agent_llm_rate_limited_total",
+        "Rate limit (429) responses from the LLM provider.",
+        ("model",),
+    )
+)
+llm_shed = metrics.register(
+    Counter(
+        "agent_llm_shed_total",
+        "LLM calls rejected because the admission queue was full.",
+        ("model",),
+    )
+)
+llm_hedges = metrics.register(
+    Counter(
+        "agent_llm_hedges_total",
+        "Hedged LLM requests: duplicates fired for slow calls, and those that won.",
+        ("model", "outcome"),
+    )
+)
+llm_deadline_exceeded = metrics.register(
+    Counter(
+        "agent_llm_deadline_exceeded_total",
+        "LLM calls abandoned because the request deadline passed.",
+        ("node",),
+    )
+)
+llm_cost = metrics.register(
+    Counter(
+        "agent_llm_cost_usd_total",
+        "Estimated cost of LLM calls, from the tier prices in model_routing.",
+        ("node", "model"),
+    )
+)
+llm_tier_calls = metrics.register(
+    Counter(
+        "agent_llm_tier_calls_total",
+        "Routed LLM calls made on each model tier.",
+        ("node", "tier"),
+    )
+)
+llm_escalations = metrics.register(
+    Counter(
+        "agent_llm_escalations_total",
+        "Routed LLM calls escalated to a stronger tier.",
+        ("node", "from_tier", "reason"),
+    )
+)
+routed_call_duration = metrics.register(
+    Histogram(
+        "agent_routed_call_duration_seconds",
+        "Wall time of routed LLM calls across all tiers tried, by the tier that answered.",
+        ("node", "tier", "escalated"),
+    )
+)
+message_tokens = metrics.register(
+    Histogram(
+        "agent_message_tokens",
+        "Tokens of customer messages before (original) and after (clean) preprocessing.",
+        ("product", "stage"),
+        buckets=(16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384),
+    )
+)
+preprocess_tokens_saved = metrics.register(
+    Histogram(
+        "agent_preprocess_tokens_saved",
+        "Tokens removed from each customer message by preprocessing, per LLM prompt.",
+        ("product",),
+        buckets=(0, 16, 64, 256, 1024, 4096, 16384),
+    )
+)
+llm_batch_size = metrics.register(
+    Histogram(
+        "agent_llm_batch_size",
+        "Items answered together by one micro-batched LLM call.",
+        ("batcher",),
+        buckets=(1, 2, 4, 8, 16, 32, 64),
+    )
+)
+bug_report_duplicates = metrics.register(
+    Counter(
+        "agent_bug_report_duplicates_total",
+        "Bug reports attached to a recent similar ticket instead of creating one.",
+        ("product",),
+    )
+)
+speculations = metrics.register(
+    Counter(
+        "agent_speculations_total",
+        "Extractions started alongside classification for a guessed class, by whether "
+        "the guess was right (hit/miss) or not likely enough to try (skipped).",
+        ("product", "outcome"),
+    )
+)
+speculation_wasted_tokens = metrics.register(
+    Counter(
+        "agent_speculation_wasted_tokens_total",
+        "Tokens of speculative extractions for the wrong class that completed.",
+        ("product", "kind"),
+    )
+)
+speculation_cancelled_tokens = metrics.register(
+    Counter(
+        "agent_speculation_cancelled_prompt_tokens_total",
+        "Estimated prompt tokens of speculative extractions for the wrong class that "
+        "were cancelled in flight (the provider may still bill them).",
+        ("product",),
+    )
+)
+tickets_dropped = metrics.register(
+    Counter(
+        "agent_tickets_dropped_total",
+        "Ticket store records and report counts dropped unwritten: the buffer was full "
+        "while writes kept failing, or retrying the write could not help.",
+        ("kind",),
+    )
+)
+jobs_finished = metrics.register(
+    Counter(
+        "agent_jobs_total",
+        "Queued jobs finished by the job workers, by outcome.",
+        ("status",),
+    )
+)
+job_queue_wait = metrics.register(
+    Histogram(
+        "agent_job_queue_wait_seconds",
+        "Time jobs waited in the job queue before a worker claimed them.",
+        ("priority",),
+    )
+)
+http_request_duration = metrics.register(
+    Histogram(
+        "agent_http_request_duration_seconds",
+        "Wall time of HTTP requests, including response serialization.",
+        ("method", "path", "status"),
+    )
+)
+
+
+@contextmanager
+def collect_timings(enabled: bool = True):
+    """
+    Collects the timing stages recorded in this context (and the tasks it starts) into
+    the yielded list. Yields None and records nothing when `enabled` is False.
+    """
+    if not enabled:
+        yield None
+        return
+    stages = []
+    token = _request_timings.set(stages)
+    try:
+        yield stages
+    finally:
+        _request_timings.reset(token)
+
+
+def record_stage(stage: str, seconds: float, **details):
+    """Adds a stage to the current request's timing breakdown, if one is being collected."""
+    stages = _request_timings.get()
+    if stages is not None:
+        stages.append({"stage": stage, "seconds": round(seconds, 6), **details})
+
+
+@contextmanager
+def track_llm_usage():
+    """
+    Adds up the tokens of the LLM calls made in this context (and the tasks it starts)
+    in the yielded dict. "cancelled_prompt_tokens" estimates the prompts of calls that
+    were cancelled before they returned.
+    """
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "cancelled_prompt_tokens": 0}
+    token = _llm_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _llm_usage.reset(token)
+
+
+def record_llm_usage(
+    prompt_tokens: int = 0, completion_tokens: int = 0, cancelled_prompt_tokens: int = 0
+):
+    """Adds to the tokens of the current tracked context (see track_llm_usage), if any."""
+    usage = _llm_usage.get()
+    if usage is not None:
+        usage["prompt_tokens"] += prompt_tokens
+        usage["completion_tokens"] += completion_tokens
+        usage["cancelled_prompt_tokens"] += cancelled_prompt_tokens
+
+
+def _product_label(product: str) -> str:
+    # Unknown products come from user input and would make the label set unbounded.
+    return product if config_store.snapshot().has_product(product) else "unknown"
+
+
+def instrument_node(name: str, node: Callable[[dict], Awaitable[dict]]):
+    """Wraps a graph node so its executions are timed and its LLM calls labelled with it."""
+
+    @functools.wraps(node)
+    async def instrumented(state: dict) -> dict:
+        token = current_node.set(name)
+        start = time.perf_counter()
+        result = None
+        try:
+            result = await node(state)
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            current_node.reset(token)
+            classification = (result or {}).get("classification") or state.get(
+                "classification"
+            )
+            node_duration.observe(
+                elapsed,
+                node=name,
+                product=_product_label(state.get("product") or ""),
+                classification=classification or "none",
+            )
+            record_stage(f"node:{name}", elapsed)
+
+    return instrumented
@@ -0,0 +1,84 @@
+from typing import Optional
+
+import openai
+
+from app.config import ConfigSnapshot, config_store
+
+# The model did not produce a valid structured output. pydantic's ValidationError and
+# JSON decoding errors are ValueErrors.
+PARSE_ERRORS = (
+    ValueError,
+    openai.LengthFinishReasonError,
+    openai.ContentFilterFinishReasonError,
+)
+
+
+class Route:
+    """The models to try for one call, cheapest first, and when to move to the next one."""
+
+    __slots__ = ("models", "min_confidence")
+
+    def __init__(self, models: list, min_confidence: Optional[float] = None):
+        self.models = models
+        self.min_confidence = min_confidence
+
+
+def _rule(snapshot: ConfigSnapshot, node: str, product: str) -> dict:
+    """Merges the default, per-node and per-product routing rules (most specific wins)."""
+    rules = snapshot.derived.setdefault("routing_rules", {})
+    rule = rules.get((node, product))
+    if rule is None:
+        config = snapshot["model_routing"].get("rules", {})
+        rule = rules[(node, product)] = {
+            **config.get("default", {}),
+            **config.get("nodes", {}).get(node, {}),
+            **config.get("products", {}).get(product, {}).get(node, {}),
+        }
+    return rule
+
+
+def plan_route(
+    snapshot: ConfigSnapshot, node: str, product: str, message: str
+) -> Route:
+    """
+    Picks the tiers for a call from "model_routing". Calls start on the rule's
+    `start_tier`, except messages longer than `max_message_chars`, which go straight
+    to the strongest tier. Without routing, every call uses the configured "model".
+    """
+    routing = snapshot.get("model_routing", {})
+    if not routing.get("enabled", False):
+        return Route([snapshot["model"]])
+    rule = _rule(snapshot, node, product)
+    tiers = routing["tiers"]
+    names = [tier["name"] for tier in tiers]
+    start = names.index(rule.get("start_tier", names[0]))
+    if len(message) > rule.get("max_message_chars", float("inf")):
+        start = len(tiers) - 1
+    return Route([tier["model"] for tier in tiers[start:]], rule.get("min_confidence"))
+
+
+def _tiers_by_model(snapshot: ConfigSnapshot) -> dict:
+    tiers = snapshot.derived.get("tiers_by_model")
+    if tiers is None:
+        routing = snapshot.get("model_routing", {})
+        tiers = snapshot.derived["tiers_by_model"] = {
+            tier["model"]: tier for tier in routing.get("tiers", [])
+        }
+    return tiers
+
+
+def tier_name(model: str, snapshot: ConfigSnapshot = None) -> str:
+    """The name of the tier that uses `model`, or the model itself if it is in no tier."""
+    tier = _tiers_by_model(snapshot or config_store.snapshot()).get(model)
+    return tier["name"] if tier else model
+
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """The USD cost of a call, from the tier prices in "model_routing" (0 if unpriced)."""
+    tier = _tiers_by_model(config_store.snapshot()).get(model)
+    if tier is None:
+        return 0.0
+    return (
+        prompt_tokens * tier.get("prompt_usd_per_1m_tokens", 0)
+        + completion_tokens * tier.get("completion_usd_per_1m_tokens", 0)
+    ) / 1_000_000
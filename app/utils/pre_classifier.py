@@ -0,0 +1,249 @@
+"""
+Local pre-classifiers that answer obvious messages without an LLM call.
+
+Every pre-classifier implements `predict(message) -> Optional[(classification, confidence)]`
+and `record_agreement(...)`; the pre_classify node only trusts a prediction whose confidence
+reaches "fast_path.min_confidence" and otherwise falls through to the LLM.
+
+Fitting the logistic regression classifier from logged LLM labels (requires scikit-learn):
+
+    python -m app.utils.pre_classifier --labels data/llm_labels.jsonl --output data/pre_classifier.pkl
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import pickle
+import re
+from typing import Optional
+
+from app.config import config, resolve_path
+
+logger = logging.getLogger(__name__)
+
+
+class RuleBasedPreClassifier:
+    """
+    Keyword/regex rules from "fast_path.rules". Each rule carries a prior confidence which is
+    calibrated online: once the LLM has been asked about messages a rule matched (shadow
+    checks), the rule's confidence becomes its smoothed observed agreement rate.
+    """
+
+    # Weight of the configured prior, in number of pseudo-observations.
+    PRIOR_WEIGHT = 20
+
+    def __init__(self, rules: list[dict]):
+        self.rules = [
+            {
+                "pattern": re.compile(rule["pattern"]),
+                "classification": rule["classification"],
+                "confidence": rule.get("confidence", 0.9),
+                "checked": 0,
+                "agreed": 0,
+            }
+            for rule in rules
+        ]
+
+    def _confidence(self, rule: dict) -> float:
+        return (rule["confidence"] * self.PRIOR_WEIGHT + rule["agreed"]) / (
+            self.PRIOR_WEIGHT + rule["checked"]
+        )
+
+    def _match(self, message: str) -> Optional[dict]:
+        return next(
+            (rule for rule in self.rules if rule["pattern"].search(message)), None
+        )
+
+    def predict(self, message: str) -> Optional[tuple[str, float]]:
+        rule = self._match(message)
+        if rule is None:
+            return None
+        return rule["classification"], self._confidence(rule)
+
+    def record_agreement(self, message: str, llm_classification: str):
+        rule = self._match(message)
+        if rule is not None:
+            rule["checked"] += 1
+            rule["agreed"] += rule["classification"] == llm_classification
+
+
+class LogisticRegressionPreClassifier:
+    """
+    TF-IDF + logistic regression model fit from logged LLM labels. Its predicted class
+    probability is used as the confidence score.
+    """
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+    @classmethod
+    def fit(cls, messages: list[str], labels: list[str]):
+        try:
+            from sklearn.feature_extraction.text import TfidfVectorizer
+            from sklearn.linear_model import LogisticRegression
+            from sklearn.pipeline import make_pipeline
+        except ImportError as e:
+            raise ImportError(
+                "The logistic regression pre-classifier requires scikit-learn: "
+                "pip install scikit-learn"
+            ) from e
+        pipeline = make_pipeline(
+            TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True, min_df=2),
+            LogisticRegression(max_iter=1000),
+        )
+        pipeline.fit(messages, labels)
+        return cls(pipeline)
+
+    @classmethod
+    def fit_from_label_log(cls, path: str, min_llm_confidence: float = 0.8):
+        messages, labels = [], []
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                if record["confidence_score"] >= min_llm_confidence:
+                    messages.append(record["message"])
+                    labels.append(record["classification"])
+        return cls.fit(messages, labels)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, "rb") as f:
+            return cls(pickle.load(f))
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "wb") as f:
+            pickle.dump(self.pipeline, f)
+
+    def predict(self, message: str) -> Optional[tuple[str, float]]:
+        probabilities = self.pipeline.predict_proba([message])[0]
+        best = probabilities.argmax()
+        return self.pipeline.classes_[best], float(probabilities[best])
+
+    def record_agreement(self, message: str, llm_classification: str):
+        pass
+
+
+class FastPathStats:
+    """Counts fast-path hits and how often shadow-checked hits agree with the LLM."""
+
+    def __init__(self):
+        self.lookups = 0
+        self.hits = 0
+        self.shadow_checked = 0
+        self.shadow_agreed = 0
+
+    def stats(self) -> dict:
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "shadow_checked": self.shadow_checked,
+            "agreement_rate": (
+                self.shadow_agreed / self.shadow_checked
+                if self.shadow_checked
+                else None
+            ),
+        }
+
+
+def create_pre_classifier(fast_path_config: dict):
+    """Builds the pre-classifier described by the "fast_path" section of the config."""
+    if not fast_path_config.get("enabled", False):
+        return None
+    kind = fast_path_config.get("classifier", "rules")
+    if kind == "rules":
+        return RuleBasedPreClassifier(fast_path_config.get("rules", []))
+    if kind == "logistic_regression":
+        return LogisticRegressionPreClassifier.load(
+            resolve_path(fast_path_config["model_path"])
+        )
+    raise ValueError(f"Unknown pre-classifier: {kind}")
+
+
+pre_classifier = create_pre_classifier(config.get("fast_path", {}))
+fast_path_stats = FastPathStats()
+
+
+class LabelLog:
+    """
+    Appends LLM classifications to JSONL label logs without blocking the event loop:
+    `record` only buffers a line, and a background task appends what is buffered on a
+    worker thread. Call `close` on shutdown to write what is left.
+    """
+
+    def __init__(self):
+        self._lines = []
+        self._writer = None
+
+    def record(self, path: str, record: dict):
+        self._lines.append((path, json.dumps(record) + "\n"))
+        loop = asyncio.get_running_loop()
+        if (
+            self._writer is None
+            or self._writer.done()
+            or self._writer.get_loop() is not loop
+        ):
+            self._writer = loop.create_task(self._write())
+
+    async def _write(self):
+        while self._lines:
+            lines, self._lines = self._lines, []
+            try:
+                await asyncio.to_thread(_append_lines, lines)
+            except OSError as e:
+                logger.error(f"Writing {len(lines)} LLM labels failed: {str(e)}")
+
+    async def close(self):
+        writer = self._writer
+        if writer is not None and writer.get_loop() is asyncio.get_running_loop():
+            await writer
+        await self._write()
+
+
+def _append_lines(lines: list[tuple[str, str]]):
+    files = {}
+    for path, line in lines:
+        files.setdefault(path, []).append(line)
+    for path, file_lines in files.items():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a") as f:
+            f.writelines(file_lines)
+
+
+label_log = LabelLog()
+
+
+def log_llm_label(product: str, message: str, classification: str, confidence: float):
+    """Appends an LLM classification to "fast_path.label_log_path", if configured."""
+    label_log_path = config.get("fast_path", {}).get("label_log_path")
+    if not label_log_path:
+        return
+    record = {
+        "product": product,
+        "message": message,
+        "classification": classification,
+        "confidence_score": confidence,
+    }
+    label_log.record(resolve_path(label_log_path), record)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fit the logistic regression pre-classifier from logged LLM labels."
+    )
+    parser.add_argument("--labels", required=True, help="JSONL label log")
+    parser.add_argument("--output", required=True, help="Where to write the model")
+    parser.add_argument("--min-llm-confidence", type=float, default=0.8)
+    args = parser.parse_args()
+    model = LogisticRegressionPreClassifier.fit_from_label_log(
+        args.labels, args.min_llm_confidence
+    )
+    model.save(args.output)
+    print(f"Saved pre-classifier with classes {list(model.pipeline.classes_)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import logging
+import math
+import re
+from typing import Optional
+
+from app.config import ConfigSnapshot
+
+logger = logging.getLogger(__name__)
+
+# Where an email client starts quoting the message being replied to.
+_REPLY_HEADERS = re.compile(
+    r"^\s*(On\b.{0,200}\bwrote:\s*$"
+    r"|-{2,}\s*Original Message\s*-{2,}"
+    r"|-{2,}\s*Forwarded message\s*-{2,}"
+    r"|_{10,}\s*$"
+    r"|From:\s.+$(?=\n\s*(Sent|Date|To):))",
+    re.I | re.M,
+)
+_QUOTED_LINE = re.compile(r"^\s*>.*$\n?", re.M)
+# Lines that end a message: the standard "-- " signature delimiter, sign-offs on a line
+# of their own and mobile client footers.
+_SIGN_OFF = re.compile(
+    r"^\s*(--\s*"
+    r"|(best( regards)?|kind regards|regards|cheers|thanks( again)?|thank you|sincerely)"
+    r"[,!.]?\s*"
+    r"|sent from my \w+( \w+)?)$",
+    re.I,
+)
+# What may follow a sign-off: short name, title and company lines, or contact details.
+_SIGNATURE_LINE = re.compile(
+    r"^\s*(([A-Z][a-zA-Z.'&-]*,?|&|of|at|\|)(\s+([A-Z][a-zA-Z.'&-]*,?|&|of|at|\|)){0,5}"
+    r"|((tel|phone|mobile|cell|fax|e-?mail|web)\s*:\s*)?"
+    r"([\w.+-]+@[\w-]+\.[\w.]+|(https?://|www\.)\S+|\+?[\d\s().-]{7,}))\s*$"
+)
+_MAX_SIGNATURE_LINES = 6
+# A legal footer starts with one of these, and runs to the end of the message.
+_DISCLAIMER_START = re.compile(
+    r"^\s*((confidentiality notice|disclaimer)\s*:"
+    r"|this (e-?mail|message)( and any (files|attachments)[\w ]*?)? "
+    r"(is confidential|(is intended|are intended) (solely|only) for"
+    r"|(may contain|contains) (confidential|privileged)))",
+    re.I | re.M,
+)
+# Lines of pasted logs and stack traces.
+_LOG_LINE = re.compile(
+    r"^\s*(at [\w.$<>]+\(.*\)"
+    r"|File \".+\", line \d+"
+    r"|\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}"
+    r"|\[?(TRACE|DEBUG|INFO|WARN|WARNING|ERROR|FATAL)\]?[\s:]"
+    r"|\.\.\. \d+ more"
+    r"|#\d+\s+0x[0-9a-f]+)",
+    re.I,
+)
+
+
+def strip_quoted_history(text: str) -> str:
+    """Drops the quoted reply chain: everything from the first reply header, and > lines."""
+    match = _REPLY_HEADERS.search(text)
+    if match:
+        text = text[: match.start()]
+    return _QUOTED_LINE.sub("", text)
+
+
+def strip_signature(text: str) -> str:
+    """
+    Drops the legal footer, then a trailing signature: a sign-off followed by nothing but
+    a few short name or contact lines. A sign-off with anything else after it is kept.
+    """
+    match = _DISCLAIMER_START.search(text)
+    if match and match.start() > 0:
+        text = text[: match.start()]
+    lines = text.split("\n")
+    cut = None
+    signature_lines = 0
+    for index in range(len(lines) - 1, -1, -1):
+        line = lines[index]
+        if not line.strip():
+            continue
+        if _SIGN_OFF.match(line):
+            cut = index
+        elif _SIGNATURE_LINE.match(line) and signature_lines < _MAX_SIGNATURE_LINES:
+            signature_lines += 1
+        else:
+            break
+    if cut is None or cut == 0:
+        return text
+    return "\n".join(lines[:cut])
+
+
+def collapse_logs(text: str, head: int = 5, tail: int = 5) -> str:
+    """Keeps only the first `head` and last `tail` lines of each run of log lines."""
+    lines = text.split("\n")
+    collapsed, run = [], []
+
+    def flush_run():
+        if len(run) > head + tail + 1:
+            omitted = len(run) - head - tail
+            collapsed.extend(run[:head])
+            collapsed.append(f"[... {omitted} log lines omitted ...]")
+            collapsed.extend(run[-tail:] if tail else [])
+        else:
+            collapsed.extend(run)
+        run.clear()
+
+    for line in lines:
+        if _LOG_LINE.match(line):
+            run.append(line)
+        else:
+            flush_run()
+            collapsed.append(line)
+    flush_run()
+    return "\n".join(collapsed)
+
+
+class TokenCounter:
+    """
+    Counts tokens with tiktoken's encoding for `model`. Without tiktoken, or when its
+    encoding file cannot be loaded (it is downloaded on first use), estimates them as one
+    per four characters, as the LLM client does.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self._encoding = None
+        try:
+            import tiktoken
+        except ImportError:
+            logger.warning("tiktoken is not installed, estimating tokens from length")
+            return
+        try:
+            try:
+                self._encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self._encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logger.warning(
+                f"Could not load the tiktoken encoding for {model}, "
+                f"estimating tokens from length: {str(e)}"
+            )
+
+    def count(self, text: str) -> int:
+        if self._encoding is None:
+            return math.ceil(len(text) / 4)
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """The longest prefix of `text` within `max_tokens` tokens."""
+        if self._encoding is None:
+            return text[: max_tokens * 4]
+        tokens = self._encoding.encode(text, disallowed_special=())
+        return self._encoding.decode(tokens[:max_tokens])
+
+
+class PreprocessedMessage:
+    __slots__ = ("text", "original_tokens", "tokens", "truncated")
+
+    def __init__(self, text: str, original_tokens: int, tokens: int, truncated: bool):
+        self.text = text
+        self.original_tokens = original_tokens
+        self.tokens = tokens
+        self.truncated = truncated
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.original_tokens - self.tokens
+
+
+def _token_counter(snapshot: ConfigSnapshot) -> TokenCounter:
+    counter = snapshot.derived.get("token_counter")
+    if counter is None:
+        counter = snapshot.derived["token_counter"] = TokenCounter(snapshot["model"])
+    return counter
+
+
+def token_budget(snapshot: ConfigSnapshot, product: str) -> Optional[int]:
+    """The product's "max_message_tokens" in "preprocessing", or the default one."""
+    settings = snapshot.get("preprocessing", {})
+    product_settings = settings.get("products", {}).get(product, {})
+    return product_settings.get(
+        "max_message_tokens", settings.get("max_message_tokens")
+    )
+
+
+def preprocess_message(
+    message: str, product: str, snapshot: ConfigSnapshot
+) -> PreprocessedMessage:
+    """
+    Cleans an email-style customer message for the LLM prompts: drops the quoted reply
+    chain, signature and legal footer, collapses pasted logs to their first and last
+    lines and cuts what is left to the product's token budget. A message that would end
+    up empty is kept as it is.
+    """
+    settings = snapshot.get("preprocessing", {})
+    counter = _token_counter(snapshot)
+    original_tokens = counter.count(message)
+
+    text = strip_signature(strip_quoted_history(message))
+    text = collapse_logs(
+        text, settings.get("log_head_lines", 5), settings.get("log_tail_lines", 5)
+    )
+    text = re.sub(r"\n{3,}", "\n\n", text).strip()
+    if not text:
+        text = message.strip()
+
+    tokens = counter.count(text)
+    budget = token_budget(snapshot, product)
+    truncated = budget is not None and tokens > budget
+    if truncated:
+        text = counter.truncate(text, budget) + " [... truncated]"
+        tokens = counter.count(text)
+    return PreprocessedMessage(text, original_tokens, tokens, truncated)
+
+
+def prompt_message(state: dict) -> str:
+    """The customer message to put in LLM prompts: the preprocessed one, if there is one."""
+    return state.get("clean_message") or state.get("message", "")
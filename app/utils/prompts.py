@@ -0,0 +1,72 @@
+import hashlib
+from typing import Callable
+
+from app.config import ConfigSnapshot, config_store
+
+
+class RenderedPrompt:
+    """
+    The static part of a node's prompt for one product. Only the customer message is
+    appended per request, so the rendered prefix is identical across requests (which
+    also lets the provider's prompt caching reuse it).
+    """
+
+    __slots__ = ("system", "prefix", "version")
+
+    def __init__(self, system: str, prefix: str):
+        self.system = system
+        self.prefix = prefix
+        # Changes whenever the prompt text or the product config it embeds changes,
+        # so it can key caches and tell prompt variants apart in A/B tests.
+        self.version = hashlib.sha256(f"{system}\0{prefix}".encode()).hexdigest()[:12]
+
+    def messages(self, message: str) -> list:
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": f'{self.prefix}Customer message: "{message}"'},
+        ]
+
+    def batch_messages(self, messages: list) -> list:
+        """The prompt for several customer messages at once, numbered from 0."""
+        numbered = "\n".join(
+            f'{i}. Customer message: "{message}"' for i, message in enumerate(messages)
+        )
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": f"{self.prefix}{numbered}"},
+        ]
+
+
+class PromptRegistry:
+    """
+    Renders each node prompt once per product and config snapshot, on first use. Rendered
+    prompts live on the snapshot, so a request always sees prompts that match the config
+    it is using and a reload discards them together with the old snapshot.
+    """
+
+    def __init__(self):
+        self._templates = {}
+
+    def register(self, node: str, system: str, render_prefix: Callable[[dict], str]):
+        """
+        Registers a node prompt. `render_prefix(product_config)` returns the instructions
+        that precede the customer message for that product.
+        """
+        self._templates[node] = (system, render_prefix)
+
+    def get(
+        self, node: str, product: str, snapshot: ConfigSnapshot = None
+    ) -> RenderedPrompt:
+        snapshot = snapshot or config_store.snapshot()
+        rendered = snapshot.derived.setdefault("prompts", {})
+        prompt = rendered.get((node, product))
+        if prompt is None:
+            prompt = rendered[(node, product)] = self._render(node, snapshot, product)
+        return prompt
+
+    def _render(self, node: str, snapshot: ConfigSnapshot, product: str):
+        system, render_prefix = self._templates[node]
+        return RenderedPrompt(system, render_prefix(snapshot.product(product).config))
+
+
+prompt_registry = PromptRegistry()
@@ -0,0 +1,267 @@
+import asyncio
+import random
+import time
+from typing import Optional
+
+from app.utils.shared_state import SharedStateStore, shared_state
+
+
+class LLMOverloadedError(Exception):
+    """
+    Raised when an LLM call is shed instead of queued (the admission queue is full) or
+    the provider keeps rate limiting it. The API turns it into a 503 with Retry-After.
+    """
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Refills at `rate_per_minute` up to `burst_seconds` worth of tokens. Callers reserve
+    tokens up front, possibly going into debt, and wait until the debt is repaid, so
+    waiting callers are served in arrival order.
+    """
+
+    def __init__(self, rate_per_minute: float, burst_seconds: float = 1.0):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _update(self, change: float) -> float:
+        """Refills the bucket, adds `change` tokens and returns the new token count."""
+        now = time.monotonic()
+        tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._tokens = min(self.capacity, tokens + change)
+        self._updated = now
+        return self._tokens
+
+    def reserve(self, amount: float) -> float:
+        """Takes `amount` tokens and returns how many seconds to wait before using them."""
+        tokens = self._update(-min(amount, self.capacity))
+        return max(0.0, -tokens / self.rate)
+
+    def refund(self, amount: float):
+        """Returns unused tokens (or charges more, if `amount` is negative)."""
+        self._update(amount)
+
+    def wait_time(self) -> float:
+        return max(0.0, -self._update(0) / self.rate)
+
+
+class SharedTokenBucket(TokenBucket):
+    """A TokenBucket kept in a SharedStateStore, drawn from by every worker process."""
+
+    def __init__(
+        self,
+        store: SharedStateStore,
+        key: str,
+        rate_per_minute: float,
+        burst_seconds: float = 1.0,
+    ):
+        super().__init__(rate_per_minute, burst_seconds)
+        self.store = store
+        self.key = key
+
+    def _update(self, change: float) -> float:
+        return self.store.update_bucket(self.key, self.rate, self.capacity, change)
+
+
+class RateLimiter:
+    """
+    Client-side requests/min and tokens/min limits for one model, shared by every call
+    made through an LLMClient. A provider 429 pauses all callers for its Retry-After.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = None,
+        tokens_per_minute: float = None,
+        burst_seconds: float = 1.0,
+    ):
+        self.requests = (
+            TokenBucket(requests_per_minute, burst_seconds)
+            if requests_per_minute
+            else None
+        )
+        self.tokens = (
+            TokenBucket(tokens_per_minute, burst_seconds) if tokens_per_minute else None
+        )
+        self._paused_until = 0.0
+
+    async def _run(self, function, *args):
+        """Runs a synchronous bucket or pause operation. In process, they never block."""
+        return function(*args)
+
+    def _reserve(self, tokens: int) -> float:
+        return max(
+            self.requests.reserve(1) if self.requests else 0.0,
+            self.tokens.reserve(tokens) if self.tokens else 0.0,
+        )
+
+    def _refund(self, tokens: int):
+        if self.requests:
+            self.requests.refund(1)
+        if self.tokens:
+            self.tokens.refund(tokens)
+
+    def _try_reserve(self, tokens: int) -> bool:
+        if self.paused_until() > time.monotonic():
+            return False
+        if self._reserve(tokens) > 0:
+            self._refund(tokens)
+            return False
+        return True
+
+    def _wait_time(self) -> float:
+        return max(
+            self.requests.wait_time() if self.requests else 0.0,
+            self.tokens.wait_time() if self.tokens else 0.0,
+            self.paused_until() - time.monotonic(),
+        )
+
+    async def acquire(self, tokens: int):
+        while True:
+            pause = await self._run(self.paused_until) - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            wait = await self._run(self._reserve, tokens)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if await self._run(self.paused_until) <= time.monotonic():
+                return
+            # A 429 paused the limiter while this call waited. Give the reservation back
+            # and queue again after the pause, so the paused calls do not fire at once.
+            await self._run(self._refund, tokens)
+
+    async def try_acquire(self, tokens: int) -> bool:
+        """Reserves capacity for a call only if it is available right away."""
+        return await self._run(self._try_reserve, tokens)
+
+    async def record_usage(self, estimated_tokens: int, actual_tokens: int):
+        if self.tokens:
+            await self._run(self.tokens.refund, estimated_tokens - actual_tokens)
+
+    def paused_until(self) -> float:
+        """The monotonic time until which a provider 429 paused all calls."""
+        return self._paused_until
+
+    def _pause(self, until: float):
+        self._paused_until = max(self._paused_until, until)
+
+    async def pause(self, seconds: float):
+        await self._run(self._pause, time.monotonic() + seconds)
+
+    async def wait_time(self) -> float:
+        """Roughly how long a call arriving now would wait."""
+        return await self._run(self._wait_time)
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    A RateLimiter for `name` (a model) whose buckets and 429 pauses are kept in a
+    SharedStateStore, so the limits hold for all worker processes together. Store
+    operations run on a thread: the file may be locked by another worker for a while.
+    """
+
+    def __init__(
+        self,
+        store: SharedStateStore,
+        name: str,
+        requests_per_minute: float = None,
+        tokens_per_minute: float = None,
+        burst_seconds: float = 1.0,
+    ):
+        super().__init__(requests_per_minute, tokens_per_minute, burst_seconds)
+        self.store = store
+        self.name = name
+        if self.requests:
+            self.requests = SharedTokenBucket(
+                store, f"{name}:requests", requests_per_minute, burst_seconds
+            )
+        if self.tokens:
+            self.tokens = SharedTokenBucket(
+                store, f"{name}:tokens", tokens_per_minute, burst_seconds
+            )
+
+    async def _run(self, function, *args):
+        return await asyncio.to_thread(function, *args)
+
+    def paused_until(self) -> float:
+        return self.store.paused_until(self.name)
+
+    def _pause(self, until: float):
+        self.store.pause(self.name, until)
+
+
+def create_rate_limiter(
+    limits: Optional[dict], name: str = ""
+) -> Optional[RateLimiter]:
+    """
+    Builds a RateLimiter from a "llm.rate_limits" entry, or None if it sets no limit.
+    Under the multi-worker launcher, the limiter for `name` is shared by all workers.
+    """
+    if not limits:
+        return None
+    if shared_state is not None:
+        return SharedRateLimiter(
+            shared_state,
+            name,
+            limits.get("requests_per_minute"),
+            limits.get("tokens_per_minute"),
+            limits.get("burst_seconds", 1.0),
+        )
+    return RateLimiter(
+        limits.get("requests_per_minute"),
+        limits.get("tokens_per_minute"),
+        limits.get("burst_seconds", 1.0),
+    )
+
+
+def is_retryable(error: Exception) -> bool:
+    """Connection errors, timeouts, 408/409/429 and 5xx responses are worth retrying."""
+    # Not imported at the top: the API imports this module (for LLMOverloadedError) at
+    # startup, long before the first LLM call loads the SDK.
+    import openai
+
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def is_rate_limited(error: Exception) -> bool:
+    import openai
+
+    return isinstance(error, openai.APIStatusError) and error.status_code == 429
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """The delay requested by the provider's retry-after-ms or Retry-After header, if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        if "retry-after-ms" in response.headers:
+            return float(response.headers["retry-after-ms"]) / 1000
+        if "retry-after" in response.headers:
+            return float(response.headers["retry-after"])
+    except ValueError:
+        # HTTP-date values are not worth parsing; fall back to backoff.
+        return None
+    return None
+
+
+def backoff_delay(
+    attempt: int, base: float, maximum: float, retry_after: float = None
+) -> float:
+    """
+    Exponential backoff with full jitter, so retries from many callers spread out. A
+    Retry-After from the provider is honored as the minimum delay, plus a little jitter.
+    """
+    if retry_after is not None:
+        return retry_after + random.uniform(0, base)
+    return random.uniform(0, min(maximum, base * 2**attempt))
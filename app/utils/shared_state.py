@@ -0,0 +1,139 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from app.config import config, resolve_path
+
+# Set by the multi-worker launcher (app.server) in every worker process it forks.
+WORKER_ID_ENV = "AGENT_WORKER_ID"
+
+
+def worker_id() -> Optional[str]:
+    """This process' worker number when run by app.server, or None for a single process."""
+    return os.environ.get(WORKER_ID_ENV)
+
+
+class SharedStateStore:
+    """
+    State the worker processes of one server share through a local SQLite file: the
+    client-side rate limit buckets and 429 pauses of each model, and the latest metrics
+    snapshot of each worker. Every update is a single statement, so concurrent workers
+    never see a half-applied change.
+
+    Times are time.monotonic() values: the monotonic clock is per host, not per process,
+    so they compare across the workers. The launcher resets the store when it starts.
+    """
+
+    def __init__(self, path: str, worker: str = None):
+        self.path = path
+        # Per process: a restarted worker publishes fresh metrics next to the
+        # counts its predecessor left, instead of overwriting them.
+        self.worker = f"{worker}:{os.getpid()}" if worker is not None else None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, timeout=30, isolation_level=None
+        )
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # Losing the last updates in a power cut is fine for this state, and
+            # syncing on every rate limit reservation is not.
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pauses ("
+                "key TEXT PRIMARY KEY, until REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS worker_metrics ("
+                "worker TEXT PRIMARY KEY, updated_at REAL NOT NULL, data TEXT NOT NULL)"
+            )
+
+    def update_bucket(
+        self, key: str, rate: float, capacity: float, change: float
+    ) -> float:
+        """
+        Refills the token bucket `key` at `rate` tokens/second up to `capacity`, adds
+        `change` (negative to take tokens) and returns its new token count.
+        """
+        now = time.monotonic()
+        with self._lock:
+            (tokens,) = self._conn.execute(
+                "INSERT INTO token_buckets "
+                "VALUES (:key, min(:capacity, :capacity + :change), :now) "
+                "ON CONFLICT (key) DO UPDATE SET tokens = min(:capacity, "
+                "min(:capacity, tokens + max(0, :now - updated) * :rate) + :change), "
+                "updated = :now RETURNING tokens",
+                {
+                    "key": key,
+                    "rate": rate,
+                    "capacity": capacity,
+                    "change": change,
+                    "now": now,
+                },
+            ).fetchone()
+        return tokens
+
+    def pause(self, key: str, until: float):
+        """Pauses `key` until the monotonic time `until`, unless it already is longer."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO pauses VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET until = max(until, excluded.until)",
+                (key, until),
+            )
+
+    def paused_until(self, key: str) -> float:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT until FROM pauses WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else 0.0
+
+    def publish_metrics(self, snapshot: dict):
+        """Stores this worker's MetricsRegistry.snapshot() for the other workers."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO worker_metrics VALUES (?, ?, ?)",
+                (self.worker, time.time(), json.dumps(snapshot)),
+            )
+
+    def other_workers_metrics(self) -> list:
+        """The last published metrics snapshots of every other worker, dead ones included."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM worker_metrics WHERE worker IS NOT ?", (self.worker,)
+            ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def reset(self):
+        """Forgets all state, e.g. the metrics of a previous server run."""
+        with self._lock:
+            for table in ("token_buckets", "pauses", "worker_metrics"):
+                self._conn.execute(f"DELETE FROM {table}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def shared_state_path(server_config: dict) -> str:
+    return resolve_path(
+        server_config.get("shared_state_path", "data/shared_state.sqlite3")
+    )
+
+
+def create_shared_state_store(server_config: dict) -> Optional[SharedStateStore]:
+    """The store shared with the other workers, or None when not run by app.server."""
+    if worker_id() is None:
+        return None
+    return SharedStateStore(shared_state_path(server_config), worker_id())
+
+
+shared_state = create_shared_state_store(config.get("server", {}))
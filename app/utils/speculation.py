@@ -0,0 +1,70 @@
+import collections
+
+from app.config import config
+from app.utils.pre_classifier import pre_classifier
+
+CLASSES = ("bug_report", "feature_request", "general_inquiry")
+
+
+class ClassPriors:
+    """
+    How often each product's messages are of each class, learned from its last
+    `window_size` LLM classifications. Configured `priors` (class probabilities per
+    product) count as `prior_weight` classifications, so a new worker guesses sensibly
+    before it has seen any traffic.
+    """
+
+    def __init__(
+        self, priors: dict = None, window_size: int = 500, prior_weight: float = 20
+    ):
+        self.priors = priors or {}
+        self.window_size = window_size
+        self.prior_weight = prior_weight
+        self._recent = {}
+        self._counts = {}
+
+    def observe(self, product: str, classification: str):
+        if classification not in CLASSES:
+            return
+        recent = self._recent.setdefault(product, collections.deque())
+        counts = self._counts.setdefault(product, collections.Counter())
+        recent.append(classification)
+        counts[classification] += 1
+        if len(recent) > self.window_size:
+            counts[recent.popleft()] -= 1
+
+    def probabilities(self, product: str) -> dict:
+        priors = self.priors.get(product, {})
+        counts = self._counts.get(product, {})
+        weights = {
+            label: counts.get(label, 0) + self.prior_weight * priors.get(label, 0)
+            for label in CLASSES
+        }
+        total = sum(weights.values())
+        if not total:
+            return {label: 1 / len(CLASSES) for label in CLASSES}
+        return {label: weight / total for label, weight in weights.items()}
+
+    def guess(self, product: str, message: str) -> tuple[str, float]:
+        """
+        The most likely class of the message and its estimated probability: the local
+        pre-classifier's prediction if it has one, else the product's most frequent class.
+        """
+        if pre_classifier is not None:
+            prediction = pre_classifier.predict(message)
+            if prediction is not None and prediction[0] in CLASSES:
+                return prediction
+        probabilities = self.probabilities(product)
+        return max(probabilities.items(), key=lambda item: item[1])
+
+
+def create_class_priors(speculation_config: dict) -> ClassPriors:
+    """Builds the ClassPriors described by "graph.speculation" in the config."""
+    return ClassPriors(
+        priors=speculation_config.get("priors", {}),
+        window_size=speculation_config.get("window_size", 500),
+        prior_weight=speculation_config.get("prior_weight", 20),
+    )
+
+
+class_priors = create_class_priors(config.get("graph", {}).get("speculation", {}))
@@ -0,0 +1,39 @@
+import contextvars
+import functools
+import json
+from typing import Awaitable, Callable
+
+# Receives the partially parsed output (a dict) of LLM calls as tokens arrive. Only set
+# while a node runs on behalf of a streaming request, see `stream_llm_partials`.
+llm_partials = contextvars.ContextVar("llm_partials", default=None)
+
+
+def stream_llm_partials(name: str, node: Callable[[dict], Awaitable[dict]]):
+    """
+    Wraps a graph node so that, when the graph is streamed with
+    `config={"configurable": {"stream_partials": True}}` and the "custom" stream mode,
+    the node's LLM calls are token-streamed and their partial outputs are emitted as
+    `{"node": name, "fields": {...}}` custom stream chunks.
+    """
+    # Imported with the graph rather than with this module, which the API imports at startup.
+    from langgraph.config import get_config, get_stream_writer
+
+    @functools.wraps(node)
+    async def streaming(state: dict) -> dict:
+        if not get_config().get("configurable", {}).get("stream_partials"):
+            return await node(state)
+        writer = get_stream_writer()
+        token = llm_partials.set(
+            lambda fields: writer({"node": name, "fields": fields})
+        )
+        try:
+            return await node(state)
+        finally:
+            llm_partials.reset(token)
+
+    return streaming
+
+
+def sse_event(event: str, data) -> str:
+    """Formats one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import sqlite3
+import threading
+
+from app.config import config, resolve_path
+
+
+class InProcessTicketIdAllocator:
+    """
+    Atomic in-process counters. IDs restart at 1 when the process restarts and are not
+    shared between workers, so this backend is only suitable for tests and single workers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def would_block(self, sequence: str) -> bool:
+        return False
+
+    def allocate(self, sequence: str, count: int = 1) -> int:
+        """Reserves `count` consecutive IDs of `sequence` and returns the first one."""
+        with self._lock:
+            first = self._counters.get(sequence, 0) + 1
+            self._counters[sequence] = first + count - 1
+        return first
+
+
+class SQLiteTicketIdAllocator:
+    """
+    Counters persisted in a SQLite file. Every allocation is a single write transaction,
+    so IDs survive restarts and stay unique across all processes using the same file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, timeout=30, isolation_level=None
+        )
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS ticket_counters ("
+                "sequence TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+
+    def would_block(self, sequence: str) -> bool:
+        return True
+
+    def allocate(self, sequence: str, count: int = 1) -> int:
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock up front, serializing allocators.
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                (last,) = self._conn.execute(
+                    "INSERT INTO ticket_counters VALUES (?, ?) "
+                    "ON CONFLICT (sequence) DO UPDATE SET value = value + excluded.value "
+                    "RETURNING value",
+                    (sequence, count),
+                ).fetchone()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return last - count + 1
+
+
+class BlockLeasingTicketIdAllocator:
+    """
+    Leases blocks of `block_size` IDs from a shared backend and hands them out locally,
+    so only one storage round trip is needed per block instead of per ticket. IDs left in
+    a block when the process exits are skipped, never reused.
+    """
+
+    def __init__(self, backend, block_size: int = 100):
+        self.backend = backend
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._blocks = {}
+
+    def allocate(self, sequence: str, count: int = 1) -> int:
+        with self._lock:
+            next_id, end = self._blocks.get(sequence, (0, 0))
+            if next_id + count > end:
+                next_id = self.backend.allocate(sequence, max(count, self.block_size))
+                end = next_id + max(count, self.block_size)
+            self._blocks[sequence] = (next_id + count, end)
+        return next_id
+
+    def would_block(self, sequence: str) -> bool:
+        next_id, end = self._blocks.get(sequence, (0, 0))
+        return next_id >= end and self.backend.would_block(sequence)
+
+
+class TicketIdService:
+    """Allocates ticket IDs such as BUG-42 or FR-7 from the configured backend."""
+
+    def __init__(self, allocator):
+        self.allocator = allocator
+
+    async def next_id(self, prefix: str) -> str:
+        # Storage round trips run in a thread so they never stall the event loop.
+        if self.allocator.would_block(prefix):
+            number = await asyncio.to_thread(self.allocator.allocate, prefix)
+        else:
+            number = self.allocator.allocate(prefix)
+        return f"{prefix}-{number}"
+
+
+def create_ticket_id_service(ticket_id_config: dict) -> TicketIdService:
+    """Builds the TicketIdService described by the "ticket_ids" section of the config."""
+    backend = ticket_id_config.get("backend", "memory")
+    if backend == "memory":
+        allocator = InProcessTicketIdAllocator()
+    elif backend == "sqlite":
+        allocator = SQLiteTicketIdAllocator(
+            resolve_path(ticket_id_config.get("sqlite_path", "data/ticket_ids.sqlite3"))
+        )
+    else:
+        raise ValueError(f"Unknown ticket ID backend: {backend}")
+    block_size = ticket_id_config.get("block_size", 1)
+    if block_size > 1:
+        allocator = BlockLeasingTicketIdAllocator(allocator, block_size)
+    return TicketIdService(allocator)
+
+
+ticket_ids = create_ticket_id_service(config.get("ticket_ids", {}))
@@ -0,0 +1,396 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+
+from app.config import config, config_store, resolve_path
+from app.utils.metrics import tickets_dropped
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = (
+    "id",
+    "kind",
+    "product",
+    "status",
+    "title",
+    "customer_id",
+    "report_count",
+    "created_at",
+    "data",
+    "message",
+)
+
+
+class SQLiteTicketBackend:
+    """
+    Tickets and inquiry records in a SQLite file, shared by every worker on the host.
+    Each ticket also has one row per assigned team and affected component in
+    `ticket_labels`, ordered by time, so a query filtered by team or component walks
+    that index newest first and stops once the page is full. Reads use their own
+    connection, so they are not queued behind batched writes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._write_conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._write_lock, self._write_conn:
+            self._write_conn.execute("PRAGMA journal_mode=WAL")
+            # Worker processes open the store at the same time; only one of them may
+            # create or migrate the schema.
+            self._write_conn.execute("BEGIN IMMEDIATE")
+            self._write_conn.execute(
+                "CREATE TABLE IF NOT EXISTS tickets ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, product TEXT NOT NULL, "
+                "status TEXT NOT NULL, title TEXT, customer_id TEXT, "
+                "report_count INTEGER NOT NULL DEFAULT 1, created_at REAL NOT NULL, "
+                "data TEXT NOT NULL, message TEXT)"
+            )
+            columns = {
+                row[1] for row in self._write_conn.execute("PRAGMA table_info(tickets)")
+            }
+            if "message" not in columns:
+                # Stores created before the original message was kept.
+                self._write_conn.execute("ALTER TABLE tickets ADD COLUMN message TEXT")
+            self._write_conn.execute(
+                "CREATE TABLE IF NOT EXISTS ticket_labels ("
+                "name TEXT NOT NULL, value TEXT NOT NULL, created_at REAL NOT NULL, "
+                "ticket_id TEXT NOT NULL, "
+                "PRIMARY KEY (name, value, created_at, ticket_id)) WITHOUT ROWID"
+            )
+            for index in (
+                "tickets_created_at ON tickets (created_at, id)",
+                "tickets_kind ON tickets (kind, status, created_at, id)",
+                "tickets_product ON tickets (product, kind, created_at, id)",
+                "ticket_labels_ticket ON ticket_labels (ticket_id, name, value)",
+            ):
+                self._write_conn.execute(f"CREATE INDEX IF NOT EXISTS {index}")
+        self._read_conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+
+    def write(self, records: list, report_counts: dict):
+        """Inserts new records and raises report counts, all in one transaction."""
+        with self._write_lock, self._write_conn:
+            self._write_conn.executemany(
+                f"INSERT OR IGNORE INTO tickets ({', '.join(_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(_COLUMNS))})",
+                [
+                    tuple(
+                        json.dumps(r["data"]) if c == "data" else r[c] for c in _COLUMNS
+                    )
+                    for r in records
+                ],
+            )
+            self._write_conn.executemany(
+                "INSERT OR IGNORE INTO ticket_labels VALUES (?, ?, ?, ?)",
+                [
+                    (name, value, r["created_at"], r["id"])
+                    for r in records
+                    for component, team in r["assignments"]
+                    for name, value in (("component", component), ("team", team))
+                    if value
+                ],
+            )
+            self._write_conn.executemany(
+                "UPDATE tickets SET report_count = MAX(report_count, ?) WHERE id = ?",
+                [(count, ticket_id) for ticket_id, count in report_counts.items()],
+            )
+
+    def query(
+        self,
+        product: str = None,
+        kind: str = None,
+        status: str = None,
+        team: str = None,
+        component: str = None,
+        since: float = None,
+        until: float = None,
+        after: tuple = None,
+        limit: int = 50,
+    ) -> list:
+        """
+        The tickets matching every given filter, newest first. `after` is the
+        (created_at, id) of the last ticket of the previous page.
+        """
+        labels = [
+            (name, value)
+            for name, value in (("team", team), ("component", component))
+            if value is not None
+        ]
+        # A team or component filter is served from its label rows, which are already
+        # in time order; other label filters are checked per ticket.
+        if labels:
+            source = "ticket_labels AS l JOIN tickets AS t ON t.id = l.ticket_id"
+            clauses, params = ["l.name = ?", "l.value = ?"], list(labels[0])
+            order = ("l.created_at", "l.ticket_id")
+        else:
+            source, clauses, params = "tickets AS t", [], []
+            order = ("t.created_at", "t.id")
+        for name, value in labels[1:]:
+            clauses.append(
+                "EXISTS (SELECT 1 FROM ticket_labels "
+                "WHERE ticket_id = t.id AND name = ? AND value = ?)"
+            )
+            params.extend((name, value))
+        for column, value in (("product", product), ("kind", kind), ("status", status)):
+            if value is not None:
+                clauses.append(f"t.{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append(f"{order[0]} >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append(f"{order[0]} < ?")
+            params.append(until)
+        if after is not None:
+            clauses.append(f"({order[0]}, {order[1]}) < (?, ?)")
+            params.extend(after)
+        columns = ", ".join(f"t.{column}" for column in _COLUMNS)
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                f"SELECT {columns} FROM {source} {where}"
+                f"ORDER BY {order[0]} DESC, {order[1]} DESC LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        return [_ticket(row) for row in rows]
+
+    def get(self, ticket_id: str) -> Optional[dict]:
+        with self._read_lock:
+            row = self._read_conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM tickets WHERE id = ?",
+                (ticket_id,),
+            ).fetchone()
+        return _ticket(row) if row else None
+
+
+def _ticket(row: tuple) -> dict:
+    ticket = dict(zip(_COLUMNS, row))
+    ticket["data"] = json.loads(ticket["data"])
+    return ticket
+
+
+def build_record(
+    customer_id: str, product: str, response_data: dict, message: str = None
+) -> Optional[dict]:
+    """
+    The ticket (or inquiry) record for a workflow result, or None if it made none.
+    `message` is the customer's original message, before preprocessing.
+    """
+    now = time.time()
+    if "ticket" in response_data:
+        ticket = response_data["ticket"]
+        return {
+            "id": ticket["id"],
+            "kind": "bug_report",
+            "status": "open",
+            "title": ticket.get("title"),
+            "report_count": ticket.get("report_count", 1),
+            "assignments": list(
+                zip(ticket.get("affected_components") or [], ticket["assigned_team"])
+            ),
+            "data": ticket,
+            "customer_id": customer_id,
+            "product": product,
+            "created_at": now,
+            "message": message,
+        }
+    if "product_requirement" in response_data:
+        requirement = response_data["product_requirement"]
+        product_index = config_store.snapshot().product(product)
+        return {
+            "id": requirement["id"],
+            "kind": "feature_request",
+            "status": requirement.get("status", "Under Review"),
+            "title": requirement.get("title"),
+            "report_count": 1,
+            "assignments": [
+                (component, product_index.team_for(component))
+                for component in requirement.get("affected_components") or []
+            ],
+            "data": requirement,
+            "customer_id": customer_id,
+            "product": product,
+            "created_at": now,
+            "message": message,
+        }
+    if "inquiry_category" in response_data:
+        return {
+            "id": f"INQ-{uuid.uuid4().hex[:16]}",
+            "kind": "general_inquiry",
+            # Inquiries answered with resources need no follow-up.
+            "status": (
+                "open" if response_data.get("requires_human_review") else "resolved"
+            ),
+            "title": response_data["inquiry_category"],
+            "report_count": 1,
+            "assignments": [],
+            "data": response_data,
+            "customer_id": customer_id,
+            "product": product,
+            "created_at": now,
+            "message": message,
+        }
+    return None
+
+
+class TicketStore:
+    """
+    Persists the tickets and inquiries produced by the workflow. `record` only buffers
+    them, so it adds no storage latency to requests; the buffer is written in one
+    transaction every `flush_interval` seconds, or as soon as `batch_size` records are
+    waiting. A failed write is retried with the next flush, keeping at most
+    `max_buffered` records (and report counts) and dropping the oldest beyond that.
+    Call `close` on shutdown to write what is left.
+    """
+
+    def __init__(
+        self,
+        backend: SQLiteTicketBackend = None,
+        batch_size: int = 200,
+        flush_interval: float = 0.5,
+        max_buffered: int = 10000,
+    ):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self._records = []
+        self._report_counts = {}
+        self._flusher = None
+        self._batch_ready = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def record(self, result: dict):
+        """Buffers the ticket or inquiry made by a finished workflow run, if any."""
+        if not self.enabled:
+            return
+        response_data = result.get("response_data") or {}
+        if response_data.get("duplicate"):
+            ticket = response_data["ticket"]
+            self._report_counts[ticket["id"]] = max(
+                ticket["report_count"], self._report_counts.get(ticket["id"], 0)
+            )
+        else:
+            record = build_record(
+                result.get("customer_id"),
+                result.get("product"),
+                response_data,
+                result.get("message"),
+            )
+            if record is None:
+                return
+            self._records.append(record)
+        self._ensure_flusher()
+        if len(self._records) + len(self._report_counts) >= self.batch_size:
+            self._batch_ready.set()
+
+    def _ensure_flusher(self):
+        loop = asyncio.get_running_loop()
+        if (
+            self._flusher is None
+            or self._flusher.done()
+            or self._flusher.get_loop() is not loop
+        ):
+            self._batch_ready = asyncio.Event()
+            self._flusher = loop.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+            except TimeoutError:
+                pass
+            self._batch_ready.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # The next flush still writes what is buffered by then.
+                logger.error(f"Flushing the ticket store failed: {str(e)}")
+
+    async def flush(self):
+        if not self._records and not self._report_counts:
+            return
+        records, self._records = self._records, []
+        report_counts, self._report_counts = self._report_counts, {}
+        try:
+            await asyncio.to_thread(self.backend.write, records, report_counts)
+        except sqlite3.Error as e:
+            # Kept for the next flush rather than lost.
+            logger.error(f"Writing {len(records)} tickets failed: {str(e)}")
+            self._records[:0] = records
+            for ticket_id, count in report_counts.items():
+                self._report_counts[ticket_id] = max(
+                    count, self._report_counts.get(ticket_id, 0)
+                )
+            self._drop_overflow()
+        except Exception as e:
+            # Not a storage error: writing the same records again would fail again.
+            logger.error(
+                f"Writing {len(records)} tickets failed, dropping them: {str(e)}: "
+                f"{', '.join(record['id'] for record in records)}"
+            )
+            for record in records:
+                tickets_dropped.inc(kind=record["kind"])
+            tickets_dropped.inc(len(report_counts), kind="report_count")
+
+    def _drop_overflow(self):
+        """
+        Drops the oldest buffered records beyond `max_buffered`, so a store that stays
+        unwritable does not grow the buffer without bound.
+        """
+        overflow = len(self._records) - self.max_buffered
+        if overflow > 0:
+            dropped, self._records = self._records[:overflow], self._records[overflow:]
+            logger.error(
+                f"Ticket store buffer full, dropped {overflow} records: "
+                f"{', '.join(record['id'] for record in dropped)}"
+            )
+            for record in dropped:
+                tickets_dropped.inc(kind=record["kind"])
+        overflow = len(self._report_counts) - self.max_buffered
+        if overflow > 0:
+            dropped = list(self._report_counts)[:overflow]
+            for ticket_id in dropped:
+                del self._report_counts[ticket_id]
+            logger.error(
+                f"Ticket store buffer full, dropped {overflow} report counts: "
+                f"{', '.join(dropped)}"
+            )
+            tickets_dropped.inc(overflow, kind="report_count")
+
+    async def close(self):
+        """Stops the periodic flush and writes the remaining buffered records."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if self.enabled:
+            await self.flush()
+
+
+def create_ticket_store(store_config: dict) -> TicketStore:
+    """Builds the TicketStore described by the "ticket_store" section of the config."""
+    if not store_config.get("enabled", False):
+        return TicketStore()
+    backend = SQLiteTicketBackend(
+        resolve_path(store_config.get("sqlite_path", "data/tickets.sqlite3"))
+    )
+    return TicketStore(
+        backend,
+        batch_size=store_config.get("batch_size", 200),
+        flush_interval=store_config.get("flush_interval_seconds", 0.5),
+        max_buffered=store_config.get("max_buffered_records", 10000),
+    )
+
+
+ticket_store = create_ticket_store(config.get("ticket_store", {}))